@@ -4,11 +4,15 @@ import threading
 import logging
 import time
 import sys
+import json
 
 
 from file_protocol import  FileProtocol
+from framing import RequestReader, RequestTooLarge
 fp = FileProtocol()
 
+MAX_REQUEST_SIZE = 64 * 1024 * 1024 # UPLOAD membawa seluruh isi file (base64) di dalam request
+
 
 class ProcessTheClient(threading.Thread):
     def __init__(self, connection, address):
@@ -17,22 +21,21 @@ class ProcessTheClient(threading.Thread):
         threading.Thread.__init__(self)
 
     def run(self):
-        data_received = ""
-        while True:
-            data = self.connection.recv(32)
-            if data:
-                d = data.decode()
-                data_received += d
-                if data_received.endswith("\r\n\r\n"):
-                    hasil = fp.proses_string(data_received[:-4])
-                    # process_string returns json.dumps, we need to manually add \r\n\r\n
-                    hasil += "\r\n\r\n"
-                    self.connection.sendall(hasil.encode())
-                    data_received = ""
-
-            else:
-                break
-        self.connection.close()
+        reader = RequestReader(self.connection, max_size=MAX_REQUEST_SIZE)
+        try:
+            while True:
+                request = reader.read_request()
+                if request is None:
+                    break
+                hasil = fp.proses_string(request.decode())
+                # process_string returns json.dumps, we need to manually add \r\n\r\n
+                hasil += "\r\n\r\n"
+                self.connection.sendall(hasil.encode())
+        except RequestTooLarge as e:
+            logging.warning(f"request dari {self.address} terlalu besar: {e}")
+            self.connection.sendall(json.dumps(dict(status='ERROR',data='request terlalu besar')).encode() + b"\r\n\r\n")
+        finally:
+            self.connection.close()
 
 
 class Server(threading.Thread):
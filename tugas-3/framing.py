@@ -0,0 +1,80 @@
+import logging
+
+"""
+* RequestReader memotong aliran bytes dari socket menjadi request-request
+yang diakhiri delimiter (default "\r\n\r\n")
+
+* data disimpan dalam satu bytearray dan yang dicari delimiternya hanya
+bytes yang baru datang, sehingga request besar tetap linear
+
+* bytes yang datang setelah delimiter (misalnya isi file UPLOAD_STREAM atau
+request berikutnya) tetap disimpan dan bisa dibaca lewat recv_into/take_buffered
+"""
+
+REQUEST_DELIMITER = b"\r\n\r\n"
+MAX_HEADER_SIZE = 65536 # 64KB
+RECV_BUFFER_SIZE = 65536 # 64KB
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class RequestReader:
+    def __init__(self, connection, delimiter=REQUEST_DELIMITER, max_size=MAX_HEADER_SIZE, recv_size=RECV_BUFFER_SIZE):
+        self.connection = connection
+        self.delimiter = delimiter
+        self.max_size = max_size
+        self.buffer = bytearray()   # received but not yet consumed bytes
+        self.scanned = 0            # how much of buffer is known not to contain the delimiter
+        self.recv_buffer = bytearray(recv_size)
+        self.recv_view = memoryview(self.recv_buffer)
+
+    def _fill(self):
+        n = self.connection.recv_into(self.recv_view)
+        if n:
+            self.buffer += self.recv_view[:n]
+        return n
+
+    def read_request(self):
+        """
+        Return the next request without its delimiter, or None if the connection
+        closed before a complete request arrived. Raises RequestTooLarge when
+        more than max_size bytes arrive without a delimiter.
+        """
+        while True:
+            # The delimiter may straddle the previous recv, so back up a little
+            start = max(0, self.scanned - len(self.delimiter) + 1)
+            index = self.buffer.find(self.delimiter, start)
+            if index >= 0:
+                request = bytes(self.buffer[:index])
+                del self.buffer[:index + len(self.delimiter)]
+                self.scanned = 0
+                return request
+
+            self.scanned = len(self.buffer)
+            if self.scanned > self.max_size:
+                raise RequestTooLarge(f"request exceeds {self.max_size} bytes without terminator")
+
+            if not self._fill():
+                if self.buffer:
+                    logging.warning(f"Connection closed with {len(self.buffer)} bytes of incomplete request")
+                return None
+
+    def recv_into(self, view, nbytes=0):
+        """Socket-like recv_into that hands out already buffered bytes first"""
+        nbytes = nbytes or len(view)
+        if self.buffer:
+            n = min(nbytes, len(self.buffer))
+            view[:n] = self.buffer[:n]
+            del self.buffer[:n]
+            self.scanned = 0
+            return n
+        return self.connection.recv_into(view, nbytes)
+
+    def take_buffered(self):
+        """Return and forget every byte received after the last request"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.scanned = 0
+        return data
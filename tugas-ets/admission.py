@@ -0,0 +1,129 @@
+import time
+import socket
+import logging
+import multiprocessing
+
+from response import Response
+
+DEFAULT_BACKLOG = 64 # listen() backlog: connections the kernel holds until they are accepted
+DEFAULT_MAX_QUEUED = 64 # accepted connections waiting for a free worker, more are answered BUSY
+RETRY_AFTER = 1 # seconds a BUSY client should wait before connecting again
+BUSY_LINGER = 2.0 # seconds a rejected connection is kept half-open so the client can read BUSY
+MAX_LINGERING = 1024 # rejected connections kept half-open at once, older ones are closed early
+
+"""
+* setiap koneksi yang di-accept diserahkan ke worker pool (executor.submit).
+Antrian executor tidak terbatas, jadi saat server kelebihan beban koneksi
+menumpuk di memory dan client baru menyerah setelah timeout 120 detik
+
+* AdmissionControl membatasi antrian itu: koneksi yang sedang dilayani atau
+menunggu dihitung (selesai = future done), kalau yang menunggu sudah
+max_queued koneksi berikutnya langsung dijawab
+
+  {"status": "BUSY", "retry_after": 1, "data": "..."}
+
+lalu ditutup, jadi client bisa mundur dan mencoba lagi setelah retry_after
+detik, bukan menunggu timeout
+
+* koneksi yang ditolak tidak langsung di-close: setelah BUSY dikirim sisi
+tulis ditutup (shutdown) dan command yang masih datang dibuang sampai
+client menutup koneksi atau BUSY_LINGER habis. close() dengan data yang
+belum dibaca mengirim RST, yang bisa menghapus BUSY sebelum client membacanya
+
+* counter (queued, admitted, rejected) ada di shared memory, jadi STATS dari
+worker process pool juga bisa membacanya, lihat client_handler.use_admission_stats
+"""
+
+# slots in the shared counters array
+IN_FLIGHT, ADMITTED, REJECTED = range(3)
+
+
+class AdmissionStats:
+    """Counters of one AdmissionControl, kept in shared memory so worker processes can report them"""
+    def __init__(self, workers, max_queued):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.counters = multiprocessing.Array('q', 3)
+
+    def try_admit(self):
+        with self.counters.get_lock():
+            if self.counters[IN_FLIGHT] >= self.workers + self.max_queued:
+                self.counters[REJECTED] += 1
+                return False
+            self.counters[IN_FLIGHT] += 1
+            self.counters[ADMITTED] += 1
+            return True
+
+    def finished(self):
+        with self.counters.get_lock():
+            self.counters[IN_FLIGHT] -= 1
+
+    def snapshot(self):
+        with self.counters.get_lock():
+            in_flight, admitted, rejected = self.counters[:]
+        return dict(active=min(in_flight, self.workers), queued=max(0, in_flight - self.workers),
+                    max_queued=self.max_queued, workers=self.workers, admitted=admitted, rejected=rejected)
+
+
+class AdmissionControl:
+    """Bounded hand-off of accepted connections to an executor, used by the accepting thread only"""
+    def __init__(self, workers, max_queued=DEFAULT_MAX_QUEUED, retry_after=RETRY_AFTER):
+        self.stats = AdmissionStats(workers, max_queued)
+        self.busy_response = Response(dict(status='BUSY', retry_after=retry_after,
+                                           data='server sibuk, coba lagi nanti')).json_header()
+        self.lingering = [] # (deadline, connection) of rejected connections
+
+    def submit(self, executor, fn, connection, address):
+        """executor.submit(fn, connection, address), or answer BUSY when the queue is full. Returns the future or None."""
+        self.sweep()
+        if not self.stats.try_admit():
+            self.reject(connection, address)
+            return None
+        try:
+            future = executor.submit(fn, connection, address)
+        except BaseException:
+            self.stats.finished()
+            raise
+        future.add_done_callback(lambda future: self.stats.finished())
+        return future
+
+    def reject(self, connection, address):
+        logging.warning(f"Server busy, rejecting {address}: {self.stats.snapshot()}")
+        try:
+            connection.setblocking(False)
+            connection.send(self.busy_response) # fits in the empty send buffer of a new connection
+            connection.shutdown(socket.SHUT_WR)
+        except OSError:
+            connection.close()
+            return
+        if len(self.lingering) >= MAX_LINGERING:
+            self.lingering.pop(0)[1].close()
+        self.lingering.append((time.monotonic() + BUSY_LINGER, connection))
+
+    def sweep(self):
+        """Close rejected connections whose client closed its side, or whose BUSY_LINGER is over"""
+        if not self.lingering:
+            return
+        now = time.monotonic()
+        lingering = []
+        for deadline, connection in self.lingering:
+            done = now >= deadline
+            try:
+                for _ in range(16):
+                    if not connection.recv(65536):
+                        done = True
+                        break
+            except BlockingIOError:
+                pass
+            except OSError:
+                done = True
+            if done:
+                connection.close()
+            else:
+                lingering.append((deadline, connection))
+        self.lingering = lingering
+
+    def close(self):
+        for deadline, connection in self.lingering:
+            connection.close()
+        self.lingering = []
@@ -0,0 +1,465 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol_v2
+from protocol_v2 import ProtocolError
+from response import Response, FileRange
+from multiplex import AsyncMuxConnection, MAX_CONCURRENT_STREAMS
+
+# Same FileProtocol instance and limits as the thread/process servers
+from client_handler import fp, MAX_COMMAND_SIZE, IDLE_TIMEOUT, use_fsync_policy, use_shaping
+from shaping import parse_rate, SHAPE_CHUNK
+from admission import DEFAULT_BACKLOG
+
+STREAM_BUFFER_SIZE = 65536 # 64KB per disk read / socket write
+WRITE_BUFFER_HIGH = 1024 * 1024 # drain() blocks once this much is queued for a client
+READER_LIMIT = 256 * 1024 # StreamReader buffer, reading from a client pauses at twice this
+REQUEST_DELIMITER = b"\r\n\r\n"
+
+"""
+* asyncio_server melayani protokol yang sama dengan threadpool_server dan
+processpool_server (LIST/GET/MGET/ARCHIVE/UPLOAD/UPLOAD_STREAM/DELETE, keep-alive)
+
+* setiap koneksi hanya berupa coroutine, bukan thread/process. Operasi disk yang
+blocking (FileProtocol, baca/tulis file) dijalankan di ThreadPoolExecutor
+berukuran tetap, jadi client yang lambat atau idle tidak memakan worker
+
+* "HELLO 2" memindahkan koneksi ke frame biner v2 (protocol_v2.py), sama
+seperti di client_handler. Dengan "HELLO 3" setiap request dijawab di task
+sendiri dan body-nya dikirim sebagai frame DATA yang bergantian (multiplex.py)
+
+* buffer StreamReader kecil (READER_LIMIT), jadi upload yang lebih cepat dari
+disk membuat transport berhenti membaca (backpressure) dan tidak ditampung
+di memory. Command v1 boleh lebih panjang dari buffer itu (UPLOAD base64),
+read_command mengumpulkannya sepotong-sepotong sampai MAX_COMMAND_SIZE
+"""
+
+
+class Server:
+    def __init__(self, ipaddress='0.0.0.0', port=8889, max_workers=10, backlog=DEFAULT_BACKLOG):
+        self.ipinfo = (ipaddress, port)
+        self.backlog = backlog
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def shape(self, address, nbytes):
+        """Wait until nbytes more to or from address fit in the bandwidth limits, see shaping.py"""
+        wait = fp.shaper.reserve(address, nbytes) if fp.shaper is not None else 0
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def write_shaped(self, writer, address, data):
+        """writer.write(data) and drain, in SHAPE_CHUNK pieces while a bandwidth limit is set"""
+        if fp.shaper is None or not fp.shaper.active():
+            writer.write(data)
+            await writer.drain()
+            return
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), SHAPE_CHUNK):
+            piece = view[start:start + SHAPE_CHUNK]
+            await self.shape(address, len(piece))
+            writer.write(piece)
+            await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        logging.warning(f"Handling connection from {address}")
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        commands_handled = 0
+        protocol = 1 # until a HELLO switches to v2
+        try:
+            while True:
+                try:
+                    if protocol == 2:
+                        request = await asyncio.wait_for(self.read_frame(reader), IDLE_TIMEOUT)
+                    else:
+                        request = await asyncio.wait_for(self.read_command(reader), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logging.warning(f"Server: {address} idle for {IDLE_TIMEOUT}s after {commands_handled} commands, closing.")
+                    return
+                except asyncio.IncompleteReadError:
+                    # Client closed connection
+                    if commands_handled == 0:
+                        logging.warning(f"Server: No command data received from {address}, closing.")
+                    return
+                except asyncio.LimitOverrunError as e:
+                    logging.warning(f"Server: Command from {address} too large: {e}")
+                    writer.write(Response(dict(status='ERROR', data='request terlalu besar')).json_header())
+                    await writer.drain()
+                    return
+                except ProtocolError as e:
+                    # The next frame can't be found any more
+                    logging.warning(f"Server: Invalid v2 frame from {address}: {e}")
+                    return
+                if request is None:
+                    return # Client closed the connection between frames
+
+                commands_handled += 1
+                if protocol == 2:
+                    if not await self.process_frame(reader, writer, address, request):
+                        return
+                    continue
+
+                response = await self.process_command(reader, writer, address, request[:-4])
+                if response is None:
+                    return
+                if response.protocol is not None:
+                    # Answered a HELLO
+                    protocol = response.protocol
+                    if protocol == protocol_v2.MULTIPLEXED_VERSION:
+                        await self.serve_streams(reader, writer, address)
+                        return
+        except ConnectionError as e:
+            logging.warning(f"Connection with {address} lost: {e}")
+        except Exception as e:
+            logging.error(f"Error handling client {address}: {str(e)}")
+        finally:
+            logging.warning(f"Closing connection from {address}")
+            writer.close()
+
+    async def process_command(self, reader, writer, address, command_bytes):
+        """Answer one v1 command. Returns its Response, or None when the connection can't carry another command."""
+        response = await self.run_blocking(fp.proses_request, command_bytes.decode().strip(), address)
+
+        if response.upload is not None:
+            response = await self.receive_upload(reader, address, response.upload)
+            if response is None:
+                return None # Client went away mid-upload, nobody to answer
+
+        writer.write(response.json_header())
+        await writer.drain()
+        if not response.keep_alive:
+            return None
+        if response.body is not None and not await self.send_body(writer, address, response.body):
+            return None
+        return response
+
+    async def read_command(self, reader):
+        """
+        Next v1 command including its delimiter. Raises IncompleteReadError at EOF and
+        LimitOverrunError once MAX_COMMAND_SIZE bytes arrived without a delimiter.
+        """
+        command = bytearray()
+        while True:
+            try:
+                command += await reader.readuntil(REQUEST_DELIMITER)
+            except asyncio.LimitOverrunError as e:
+                # More than READER_LIMIT without a delimiter: keep what is surely
+                # command text (e.consumed bytes) and look on in the rest
+                command += await reader.readexactly(e.consumed)
+                if len(command) > MAX_COMMAND_SIZE:
+                    raise asyncio.LimitOverrunError(f"no request delimiter in {len(command)} bytes", len(command))
+                continue
+            except asyncio.IncompleteReadError as e:
+                raise asyncio.IncompleteReadError(bytes(command) + e.partial, None)
+            if len(command) > MAX_COMMAND_SIZE + len(REQUEST_DELIMITER):
+                raise asyncio.LimitOverrunError(f"request of {len(command)} bytes", len(command))
+            return bytes(command)
+
+    async def read_frame(self, reader):
+        """Next v2 frame, its payload is left in reader. None when the client closed between frames."""
+        try:
+            data = await reader.readexactly(protocol_v2.FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise ProtocolError("connection closed in the middle of a frame header")
+            return None
+        opcode, flags, request_id, header_length, payload_length = protocol_v2.unpack_frame_header(data)
+        header = protocol_v2.decode_value(await reader.readexactly(header_length)) if header_length else None
+        return protocol_v2.Frame(opcode, flags, request_id, header, payload_length)
+
+    async def process_frame(self, reader, writer, address, frame):
+        """Answer one v2 request frame. Returns False when the connection can't carry another request."""
+        response = await self.process_request(reader, address, frame)
+        if response is None:
+            return False
+
+        body = response.body
+        if body is None:
+            writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data))
+            await writer.drain()
+            return True
+
+        if body.length is None:
+            # Length not known up front (LIST_STREAM): every part becomes a DATA frame
+            writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, 0, protocol_v2.FLAG_MORE))
+            async for part in self.body_parts(body):
+                if isinstance(part, FileRange):
+                    writer.write(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id, None, part.length, protocol_v2.FLAG_MORE))
+                    if await self.send_content(writer, address, part.path, part.offset, part.length) < part.length:
+                        return False
+                elif len(part):
+                    writer.write(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id, None, len(part), protocol_v2.FLAG_MORE) + part)
+                    await writer.drain()
+            writer.write(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id))
+            await writer.drain()
+            return True
+
+        # GET, MGET and ARCHIVE bodies are the response payload
+        writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, body.length))
+        await writer.drain()
+        return await self.send_body(writer, address, body)
+
+    async def process_request(self, reader, address, frame):
+        """
+        Run the command of a v2/v3 request frame and consume its payload. Returns
+        the Response, or None when the connection broke mid-upload.
+        """
+        command = protocol_v2.OPCODES.get(frame.opcode)
+        params = frame.header if isinstance(frame.header, list) else []
+        if command is None:
+            response = Response(dict(status='ERROR', data='request tidak dikenali'))
+        elif command == 'upload_stream':
+            # The payload is the file, so its length is the file size
+            response = await self.run_blocking(fp.proses, command, params[:1] + [frame.payload_length], address)
+        else:
+            response = await self.run_blocking(fp.proses, command, params, address)
+
+        payload_read = False
+        if response.upload is not None:
+            response = await self.receive_upload(reader, address, response.upload)
+            if response is None:
+                return None # Client went away mid-upload, nobody to answer
+            payload_read = response.keep_alive # False: the upload could not even start
+        if frame.payload_length and not payload_read:
+            # Unexpected or rejected payload, its length is known so the next frame can still be found
+            remaining = frame.payload_length
+            while remaining:
+                chunk = await reader.read(min(STREAM_BUFFER_SIZE, remaining))
+                if not chunk:
+                    return None
+                remaining -= len(chunk)
+        return response
+
+    async def body_parts(self, body):
+        """The parts of a response.Body, produced in the executor when that touches the disk/index"""
+        if not body.blocking:
+            for part in body.parts:
+                yield part
+            return
+        parts = iter(body.parts)
+        while (part := await self.run_blocking(next, parts, None)) is not None:
+            yield part
+
+    async def send_body(self, writer, address, body):
+        """
+        Send a response.Body, writer is the client's StreamWriter or a
+        multiplex.AsyncMuxStream. Returns False when it came up short.
+        """
+        logging.warning(f"Server: Starting stream of {body.description} ({body.length} bytes) to {address}")
+        sent_bytes = 0
+        async for part in self.body_parts(body):
+            if isinstance(part, FileRange):
+                n = await self.send_content(writer, address, part.path, part.offset, part.length)
+                sent_bytes += n
+                if n < part.length:
+                    break
+            else:
+                await self.write_shaped(writer, address, part)
+                sent_bytes += len(part)
+        else:
+            if body.length in (None, sent_bytes):
+                logging.info(f"Server: Successfully streamed {sent_bytes} bytes of {body.description} to {address}.")
+                return True
+        logging.warning(f"Server: Stream of {body.description} to {address} stopped after {sent_bytes}/{body.length} bytes.")
+        return False
+
+    async def serve_streams(self, reader, writer, address):
+        """Protocol v3: read request frames and answer each in its own task (see multiplex.py)"""
+        mux = AsyncMuxConnection(writer)
+        tasks = set()
+        try:
+            while True:
+                try:
+                    if mux.streams:
+                        frame = await self.read_frame(reader)
+                    else:
+                        frame = await asyncio.wait_for(self.read_frame(reader), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logging.warning(f"Server: {address} idle for {IDLE_TIMEOUT}s, closing.")
+                    return
+                if frame is None:
+                    return
+
+                if frame.opcode == protocol_v2.OP_WINDOW_UPDATE:
+                    await mux.window_update(frame.request_id, frame.header)
+                    continue
+
+                if frame.payload_length or protocol_v2.OPCODES.get(frame.opcode) in (None, 'upload_stream'):
+                    # Uploads (and anything else carrying a payload) are read right here, in order
+                    response = await self.process_request(reader, address, frame)
+                    if response is None:
+                        return
+                    writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data))
+                    await writer.drain()
+                    continue
+
+                if len(mux.streams) >= MAX_CONCURRENT_STREAMS:
+                    response_dict = dict(status='ERROR', data=f'maksimal {MAX_CONCURRENT_STREAMS} request bersamaan per koneksi')
+                    writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response_dict))
+                    await writer.drain()
+                    continue
+
+                stream = mux.open_stream(frame.request_id)
+                task = asyncio.create_task(self.answer_stream(stream, address, frame))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ProtocolError, asyncio.IncompleteReadError) as e:
+            logging.warning(f"Server: Invalid v3 frame from {address}: {e}")
+        finally:
+            await mux.close()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def answer_stream(self, stream, address, frame):
+        """Task answering one v3 request: RESPONSE frame, then the body as DATA frames"""
+        mux = stream.mux
+        try:
+            command = protocol_v2.OPCODES[frame.opcode]
+            params = frame.header if isinstance(frame.header, list) else []
+            response = await self.run_blocking(fp.proses, command, params, address)
+            flags = protocol_v2.FLAG_MORE if response.body is not None else 0
+            mux.writer.write(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, 0, flags))
+            if response.body is not None:
+                if await self.send_body(stream, address, response.body):
+                    await stream.finish()
+                else:
+                    await stream.finish(dict(status='ERROR', data='body tidak terkirim lengkap'))
+            else:
+                await mux.writer.drain()
+        except (OSError, ProtocolError) as e:
+            logging.warning(f"Server: Stream {frame.request_id} to {address} stopped: {e}")
+        finally:
+            mux.close_stream(stream)
+
+    async def send_content(self, writer, address, file_path, offset, size):
+        """Send a range of a stored file from the cache, the chunk store or the disk, returns the bytes sent"""
+        cached = fp.file.cache.pin(file_path)
+        if cached is not None:
+            try:
+                if len(cached) >= offset + size:
+                    # Hot file, straight from memory without the disk executor. drain() returns
+                    # at once while the transport buffer is small, so runs of tiny files are
+                    # written out together
+                    await self.write_shaped(writer, address, cached[offset:offset + size])
+                    return size
+            finally:
+                fp.file.cache.unpin(cached)
+
+        if fp.file.store is not None:
+            # The file is a manifest, its content comes from the chunk files
+            segments = await self.run_blocking(fp.file.store.segments, file_path, offset, size)
+        else:
+            segments = [(file_path, offset, size)]
+        sent_bytes = 0
+        for segment_path, segment_offset, segment_size in segments:
+            n = await self.stream_range(writer, address, segment_path, segment_offset, segment_size)
+            sent_bytes += n
+            if n < segment_size:
+                break
+        return sent_bytes
+
+    async def stream_range(self, writer, address, file_path, offset, size):
+        """Send size bytes of file_path from offset, returns how many were sent"""
+        sent_bytes = 0
+        f = await self.run_blocking(open, file_path, 'rb')
+        try:
+            await self.run_blocking(f.seek, offset)
+            while sent_bytes < size:
+                chunk = await self.run_blocking(f.read, min(STREAM_BUFFER_SIZE, size - sent_bytes))
+                if not chunk:
+                    logging.warning(f"Server: File ended prematurely while streaming {file_path} to {address}. Expected {size}, sent {sent_bytes}.")
+                    break
+                await self.shape(address, len(chunk))
+                writer.write(chunk)
+                sent_bytes += len(chunk)
+                # Wait for the client to catch up instead of queueing the whole file in memory
+                await writer.drain()
+        finally:
+            await self.run_blocking(f.close)
+        return sent_bytes
+
+    async def receive_upload(self, reader, address, upload):
+        """
+        Write the response.Upload that follows the request. Returns the Response, or None if
+        the upload came up short. When the file can't be created (e.g. the disk is full) the
+        answer is an ERROR with keep_alive False: none of the file bytes were read.
+        """
+        filename = upload.filename
+        file_size = upload.size
+        file_path = await self.run_blocking(fp.file.path_for, filename, True)
+        logging.warning(f"Server: Receiving upload {file_path} ({file_size} bytes) from {address}")
+
+        received_bytes = 0
+        stored = False
+        fp.file.cache.invalidate(file_path)
+        try:
+            f = await self.run_blocking(fp.file.open_upload, file_path, file_size)
+        except OSError as e:
+            logging.error(f"Server: Can't store {file_path} from {address}: {e}")
+            return Response(dict(status='ERROR', data=f'upload gagal: {e.strerror or e}'), keep_alive=False)
+        try:
+            while received_bytes < file_size:
+                chunk = await reader.read(min(STREAM_BUFFER_SIZE, file_size - received_bytes))
+                if not chunk:
+                    break
+                await self.shape(address, len(chunk))
+                await self.run_blocking(f.write, chunk)
+                received_bytes += len(chunk)
+        finally:
+            try:
+                await self.run_blocking(f.close)
+                stored = True
+            except OSError as e:
+                logging.error(f"Server: Error while storing {file_path} from {address}: {e}")
+
+        if received_bytes != file_size:
+            # The upload went to a temporary file that is gone now, any previous version is untouched
+            logging.warning(f"Server: Upload of {file_path} incomplete. Received {received_bytes}/{file_size} bytes from {address}, discarded.")
+            return None
+        if not stored:
+            # Every byte arrived but fsync/rename failed, the client is waiting for the answer
+            return Response(dict(status='ERROR', data='upload gagal disimpan'))
+
+        fp.file.cache.invalidate(file_path)
+        await self.run_blocking(fp.file.index.update, os.path.basename(file_path))
+        logging.info(f"Server: Successfully received {received_bytes} bytes for {file_path} from {address}.")
+        return Response(dict(status='OK', data='File berhasil diupload', data_namafile=filename, data_filesize=received_bytes))
+
+    async def run(self):
+        logging.warning(f"Server starting on {self.ipinfo} with {self.max_workers} disk I/O threads")
+        server = await asyncio.start_server(self.handle_client, self.ipinfo[0], self.ipinfo[1], limit=READER_LIMIT, backlog=self.backlog, reuse_address=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            logging.warning("Server socket closed")
+
+
+def main():
+    # server with user-defined disk I/O thread count
+    io_worker = int(input("Enter number of disk I/O threads (default 10): ") or "10")
+    use_fsync_policy(input("Enter upload fsync policy (none/file/group, default group): ").strip().lower() or "group")
+    # no worker queue here (every connection is a coroutine), so only the backlog is tunable
+    backlog = int(input(f"Enter listen backlog (default {DEFAULT_BACKLOG}): ") or DEFAULT_BACKLOG)
+    # bandwidth limits, changeable while running with SHAPE
+    use_shaping(parse_rate(input("Enter global bandwidth limit in bytes/s, e.g. 100M (default unlimited): ")),
+                parse_rate(input("Enter per-client bandwidth limit in bytes/s (default unlimited): ")))
+    svr = Server(ipaddress='0.0.0.0', port=6666, max_workers=io_worker, backlog=backlog)
+    try:
+        logging.warning("Server is running. Press Ctrl+C to stop.")
+        asyncio.run(svr.run())
+    except KeyboardInterrupt:
+        logging.warning("SIGINT received, shutting down...")
+    logging.warning("Server shutdown completed.")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    main()
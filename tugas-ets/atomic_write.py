@@ -0,0 +1,214 @@
+import os
+import errno
+import logging
+import itertools
+import threading
+
+FSYNC_POLICIES = ('none', 'file', 'group')
+FALLOCATE_UNSUPPORTED = (errno.EOPNOTSUPP, errno.EINVAL) # the filesystem can't preallocate, only a missed optimization
+
+"""
+* upload ditulis ke file sementara (tersembunyi, di folder yang sama), lalu
+os.replace ke nama aslinya. GET yang berjalan bersamaan selalu melihat versi
+lama atau versi baru yang lengkap, tidak pernah file setengah jadi
+
+* kalau ukuran file sudah diketahui, tempatnya dialokasikan dulu dengan
+posix_fallocate supaya filesystem bisa memberi extent yang berurutan dan
+disk penuh ketahuan di awal, bukan di tengah upload: AtomicWriter langsung
+raise OSError (ENOSPC) dan client mendapat ERROR sebelum mengirim isinya
+
+* fsync policy:
+  none   tidak ada fsync, cepat tapi upload yang sudah dijawab OK bisa hilang
+         kalau mesin mati
+  file   fsync file lalu fsync folder untuk setiap upload
+  group  sama seperti file, tapi fsync dari upload yang selesai bersamaan
+         dikumpulkan (group commit): satu thread melakukan fsync untuk semua
+         file di batch itu dan setiap folder hanya di-fsync sekali per batch,
+         upload lain cukup menunggu batch-nya selesai
+"""
+
+
+_temporary_sequence = itertools.count() # next() is atomic, threads of one process never share a number
+
+
+def temporary_path(path):
+    # hidden and unique per writer, FileIndex ignores names starting with '.'.
+    # Thread idents are reused (asyncio_server's executor threads run many
+    # uploads), so a per-process counter keeps two writers apart.
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.{next(_temporary_sequence)}.tmp")
+
+
+def open_temporary(path, mode='wb'):
+    """(file, temporary path) of a new private file next to path, never one another writer has open"""
+    tmp_path = temporary_path(path)
+    return open(tmp_path, mode.replace('w', 'x')), tmp_path
+
+
+def fsync_directory(directory):
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Batch:
+    __slots__ = ('files', 'directories', 'errors', 'done')
+
+    def __init__(self):
+        self.files = [] # file descriptors
+        self.directories = set()
+        self.errors = {} # fd or directory -> OSError
+        self.done = False
+
+
+class GroupCommit:
+    """
+    Batches fsyncs of concurrent writers. The first writer to arrive while no
+    batch is being flushed flushes everything queued so far; writers arriving
+    meanwhile queue up for the next batch.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.current = _Batch()
+        self.flushing = False
+        self.batches = 0
+        self.syncs = 0
+
+    def sync(self, fd=None, directory=None):
+        """Return once fd and/or directory are on stable storage, raises the fsync error if any"""
+        with self.condition:
+            batch = self.current
+            if fd is not None:
+                batch.files.append(fd)
+            if directory is not None:
+                batch.directories.add(directory)
+            while not batch.done:
+                if self.flushing:
+                    self.condition.wait()
+                    continue
+                # Become the leader for this batch, new arrivals start the next one
+                self.flushing = True
+                self.current = _Batch()
+                self.lock.release()
+                try:
+                    self._flush(batch)
+                finally:
+                    self.lock.acquire()
+                    batch.done = True
+                    self.flushing = False
+                    self.batches += 1
+                    self.condition.notify_all()
+            error = batch.errors.get(fd) or batch.errors.get(directory)
+        if error is not None:
+            raise error
+
+    def _flush(self, batch):
+        for fd in batch.files:
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                batch.errors[fd] = e
+        for directory in batch.directories:
+            try:
+                fsync_directory(directory)
+            except OSError as e:
+                batch.errors[directory] = e
+        self.syncs += len(batch.files) + len(batch.directories)
+
+    def stats(self):
+        with self.lock:
+            return dict(batches=self.batches, fsyncs=self.syncs)
+
+
+group_commit = GroupCommit() # shared by every writer in this process
+
+
+def sync_file(f, policy):
+    """Flush f and make its content durable according to policy"""
+    f.flush()
+    if policy == 'file':
+        os.fsync(f.fileno())
+    elif policy == 'group':
+        group_commit.sync(fd=f.fileno())
+
+
+def sync_rename(path, policy):
+    """Make a rename into path's directory durable according to policy"""
+    directory = os.path.dirname(path)
+    if policy == 'file':
+        fsync_directory(directory)
+    elif policy == 'group':
+        group_commit.sync(directory=directory)
+
+
+def replace_durably(f, tmp_path, path, policy):
+    """Close the finished temporary file f and move it to path"""
+    try:
+        sync_file(f, policy)
+    finally:
+        f.close()
+    os.replace(tmp_path, path)
+    sync_rename(path, policy)
+
+
+class AtomicWriter:
+    """
+    File-like object for one upload: write() goes to a temporary file, close()
+    moves it to path. Nothing is visible under path unless exactly
+    expected_size bytes were written, so an interrupted upload leaves the
+    previous version in place.
+    """
+    def __init__(self, path, expected_size=None, policy='group'):
+        self.path = path
+        self.expected_size = expected_size
+        self.policy = policy
+        self.size = 0
+        self.closed = False
+        self.f, self.tmp_path = open_temporary(path)
+        if expected_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.f.fileno(), 0, expected_size)
+            except OSError as e:
+                if e.errno not in FALLOCATE_UNSUPPORTED:
+                    # ENOSPC and friends: fail now instead of halfway through the upload
+                    self.discard()
+                    raise
+                logging.debug(f"posix_fallocate on {self.tmp_path} failed: {e}")
+
+    def write(self, data):
+        n = self.f.write(data)
+        self.size += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.expected_size is not None and self.size != self.expected_size:
+            self.discard()
+            return
+        try:
+            replace_durably(self.f, self.tmp_path, self.path, self.policy)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        self.closed = True
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
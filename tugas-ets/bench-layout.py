@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import random
+import base64
+import shutil
+import logging
+import tempfile
+from statistics import median
+
+from file_interface import FileInterface
+from storage_layout import LAYOUTS, save_layout
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FILE_SIZE = 1024 # bytes per generated file
+OPERATIONS = 1000 # timed GET/UPLOAD/DELETE calls per layout and directory size
+
+"""
+* membandingkan latency GET/UPLOAD/DELETE di FileInterface antara layout flat
+dan sharded, untuk beberapa jumlah file (default 10k, 100k, 1M)
+
+* folder uji dibuat di bawah folder sekarang (atau argumen --dir=...) supaya
+filesystem-nya sama dengan files/, dan dihapus lagi setelah selesai
+
+usage: python3 bench-layout.py [--dir=PATH] [jumlah_file ...]
+"""
+
+
+def populate(root, layout_name, count):
+    save_layout(root, layout_name)
+    layout = LAYOUTS[layout_name](root)
+    payload = os.urandom(FILE_SIZE)
+    for i in range(count):
+        with open(layout.path_for(f"file_{i:07d}.bin", create=True), 'wb') as f:
+            f.write(payload)
+
+
+def timed(func, args_list):
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return median(durations) * 1e6, durations[int(len(durations) * 0.99) - 1] * 1e6
+
+
+def bench(base_dir, layout_name, count):
+    root = tempfile.mkdtemp(prefix=f"bench-{layout_name}-", dir=base_dir) + '/'
+    try:
+        start = time.perf_counter()
+        populate(root, layout_name, count)
+        populate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fi = FileInterface(root)
+        index_time = time.perf_counter() - start
+
+        def get(name):
+            result = fi.get([name])
+            with open(fi.path_for(name), 'rb') as f:
+                f.read(result.data['data_length'])
+
+        existing = [(f"file_{random.randrange(count):07d}.bin",) for i in range(OPERATIONS)]
+        content = base64.b64encode(os.urandom(FILE_SIZE)).decode()
+        new_files = [f"new_{i:07d}.bin" for i in range(OPERATIONS)]
+
+        results = dict(
+            GET=timed(get, existing),
+            UPLOAD=timed(lambda name: fi.upload([name, content]), [(name,) for name in new_files]),
+            DELETE=timed(lambda name: fi.delete([name]), [(name,) for name in new_files]),
+        )
+        return populate_time, index_time, results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    base_dir = '.'
+    counts = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--dir='):
+            base_dir = arg.split('=', 1)[1]
+        else:
+            counts.append(int(arg))
+    counts = counts or [10000, 100000, 1000000]
+
+    print(f"{'files':>9} {'layout':>8} {'index build':>12} {'op':>7} {'median us':>10} {'p99 us':>10}")
+    for count in counts:
+        for layout_name in LAYOUTS:
+            populate_time, index_time, results = bench(base_dir, layout_name, count)
+            for op, (med, p99) in results.items():
+                print(f"{count:>9} {layout_name:>8} {index_time:>11.2f}s {op:>7} {med:>10.1f} {p99:>10.1f}")
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
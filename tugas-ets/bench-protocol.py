@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import shlex
+import shutil
+import logging
+import tempfile
+
+from file_protocol import FileProtocol, tokenize
+
+# same level as the servers, so per-request logging costs what it costs there
+logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+
+FILE_COUNT = 1000 # small files in the test store
+FILE_SIZE = 1024
+DURATION = 1.0 # seconds per command and measurement
+
+"""
+* mengukur throughput FileProtocol.proses_string (parsing command + dispatch
++ FileInterface + JSON) untuk command yang umum di file server dengan banyak
+file kecil, dan membandingkan biaya parsing saja: shlex.split(line.lower())
+seperti sebelumnya vs tokenize()
+
+* store uji berisi FILE_COUNT file FILE_SIZE byte, dibuat di bawah folder
+sekarang (atau argumen --dir=...) dan dihapus lagi setelah selesai
+
+usage: python3 bench-protocol.py [--dir=PATH]
+"""
+
+COMMANDS = [
+    'GET file_0000123.bin',
+    'GET file_0000123.bin 100 200',
+    'GET "my file 0000123.bin"',
+    'STAT file_0000123.bin',
+    'MGET ' + ' '.join(f'file_{i:07d}.bin' for i in range(10)),
+    'LIST file_00000 "" 100',
+    'DELETE missing.bin',
+    'BOGUS command',
+]
+
+
+def populate(root):
+    payload = os.urandom(FILE_SIZE)
+    for i in range(FILE_COUNT):
+        for name in (f"file_{i:07d}.bin", f"my file {i:07d}.bin"):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(payload)
+
+
+def rate(func, arg):
+    """Calls per second of func(arg), run for DURATION seconds"""
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + DURATION
+    while True:
+        for _ in range(100):
+            func(arg)
+        calls += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls / (now - start)
+
+
+def main():
+    base_dir = '.'
+    for arg in sys.argv[1:]:
+        if arg.startswith('--dir='):
+            base_dir = arg.split('=', 1)[1]
+
+    root = tempfile.mkdtemp(prefix="bench-protocol-", dir=base_dir) + '/'
+    try:
+        populate(root)
+        fp = FileProtocol(root)
+        print(f"{'command':<32} {'proses_string/s':>16} {'us':>8} {'shlex us':>9} {'tokenize us':>12}")
+        for command in COMMANDS:
+            ops = rate(fp.proses_string, command)
+            shlex_us = 1e6 / rate(lambda line: shlex.split(line.lower()), command)
+            tokenize_us = 1e6 / rate(tokenize, command)
+            print(f"{command[:32]:<32} {ops:>16.0f} {1e6 / ops:>8.1f} {shlex_us:>9.2f} {tokenize_us:>12.2f}")
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+import json
+import hashlib
+import threading
+
+from atomic_write import open_temporary, replace_durably
+
+STORE_MARKER = '.store' # file in the storage root, containing 'chunked' when the chunk store is used
+CHUNKS_DIR = '.chunks'
+MANIFEST_MAGIC = 'chunked-v1'
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# Gear rolling hash: h = (h << 1) + GEAR[byte], 32 bits, so it only depends on the last
+# GEAR_WINDOW bytes. A boundary is placed where the top 14 bits are all zero, on average
+# every 16KB once a chunk is at least MIN_CHUNK_SIZE, so chunks are ~272KB. The hash runs
+# in Python, a short average gap keeps the bytes it has to visit per chunk small.
+GEAR_WINDOW = 32
+GEAR_MASK = 0xFFFFFFFF
+CHUNK_MASK = 0xFFFC0000
+# fixed pseudo-random table: boundaries must stay the same across runs and processes
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], 'big') for i in range(256)]
+
+"""
+* ChunkStore adalah backend penyimpanan opsional: isi file dipotong menjadi
+chunk berdasarkan isinya (content-defined chunking), setiap chunk disimpan
+satu kali di files/.chunks/<2 hex>/<sha256>, dan setiap nama file hanya berisi
+manifest JSON (ukuran + daftar chunk)
+
+* batas chunk ditentukan rolling hash (gear hash) dari GEAR_WINDOW byte
+terakhir: batas ada di tempat 14 bit teratas hash-nya nol, dibatasi
+MIN/MAX_CHUNK_SIZE. Batas hanya bergantung pada isi di sekitarnya, jadi
+kalau ada data yang disisipkan di tengah file (juga teks atau data yang
+banyak nol), batas chunk setelahnya tetap sama dan upload yang mirip tetap
+sebagian besar ter-dedup
+
+* hash hanya dihitung mulai MIN_CHUNK_SIZE - GEAR_WINDOW byte dari awal
+chunk (sebelumnya tidak mungkin ada batas), jadi loop Python hanya
+menyentuh ~1/16 data
+
+* upload yang isinya sudah pernah diupload hanya menghitung sha256 dan
+menulis manifest, chunk yang sudah ada tidak ditulis lagi
+
+* chunk tidak pernah dihapus saat DELETE/overwrite; migrate-store.py gc
+membuang chunk yang tidak dipakai manifest manapun (saat server mati)
+"""
+
+
+def is_manifest(path):
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64)
+    except OSError:
+        return False
+    return head.startswith(b'{"manifest": "' + MANIFEST_MAGIC.encode() + b'"')
+
+
+class ChunkWriter:
+    """
+    File-like object for one upload: write() the content, close() stores the new
+    chunks and the manifest. Nothing is visible under path unless exactly
+    expected_size bytes were written, so an interrupted upload leaves the
+    previous version in place.
+    """
+    def __init__(self, store, path, expected_size=None):
+        self.store = store
+        self.path = path
+        self.expected_size = expected_size
+        self.buffer = bytearray()
+        self.scanned = 0 # the rolling hash resumes here
+        self.hash = 0
+        self.size = 0
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        self._cut(final=False)
+        return len(data)
+
+    def _find_boundary(self):
+        """End of the first chunk in the buffer, None until the rolling hash finds one"""
+        if self.scanned < MIN_CHUNK_SIZE - GEAR_WINDOW:
+            # no boundary before MIN_CHUNK_SIZE, and the hash forgets everything older than GEAR_WINDOW
+            self.scanned = MIN_CHUNK_SIZE - GEAR_WINDOW
+            self.hash = 0
+        end = min(len(self.buffer), MAX_CHUNK_SIZE)
+        if self.scanned >= end:
+            return None
+        h = self.hash
+        pos = self.scanned
+        gear = GEAR
+        if pos < MIN_CHUNK_SIZE:
+            # fill the window first
+            for byte in self.buffer[pos:min(end, MIN_CHUNK_SIZE)]:
+                h = ((h << 1) + gear[byte]) & GEAR_MASK
+            pos = min(end, MIN_CHUNK_SIZE)
+        for byte in self.buffer[pos:end]:
+            h = ((h << 1) + gear[byte]) & GEAR_MASK
+            pos += 1
+            if not h & CHUNK_MASK:
+                return pos
+        self.scanned = pos
+        self.hash = h
+        return None
+
+    def _cut(self, final):
+        while True:
+            boundary = self._find_boundary()
+            if boundary is None and len(self.buffer) >= MAX_CHUNK_SIZE:
+                boundary = MAX_CHUNK_SIZE
+            if boundary is None:
+                if final and self.buffer:
+                    boundary = len(self.buffer)
+                else:
+                    return
+            self.chunks.append(self.store.put_chunk(self.buffer[:boundary]))
+            del self.buffer[:boundary]
+            self.scanned = 0
+            self.hash = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.expected_size is not None and self.size != self.expected_size:
+            return # incomplete, keep whatever was there before
+        self._cut(final=True)
+        self.store.write_manifest(self.path, self.size, self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+
+class ChunkStore:
+    def __init__(self, root):
+        self.root = root
+        self.chunks_dir = os.path.join(root, CHUNKS_DIR)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        self.fsync_policy = 'group' # see atomic_write.py
+        self.lock = threading.Lock()
+        self.chunks_written = 0
+        self.chunks_deduplicated = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def put_chunk(self, data):
+        """Store data unless a chunk with the same content exists. Returns [digest, length]."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            with self.lock:
+                self.chunks_deduplicated += 1
+                self.bytes_deduplicated += len(data)
+            return [digest, len(data)]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a private temporary name, two uploads may store the same chunk at once
+        f, tmp_path = open_temporary(path)
+        f.write(data)
+        replace_durably(f, tmp_path, path, self.fsync_policy)
+        with self.lock:
+            self.chunks_written += 1
+            self.bytes_written += len(data)
+        return [digest, len(data)]
+
+    def write_manifest(self, path, size, chunks):
+        f, tmp_path = open_temporary(path, 'w')
+        json.dump(dict(manifest=MANIFEST_MAGIC, size=size, chunks=chunks), f)
+        # chunks were made durable before, so the manifest never points at missing data
+        replace_durably(f, tmp_path, path, self.fsync_policy)
+
+    def read_manifest(self, path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get('manifest') != MANIFEST_MAGIC:
+            raise ValueError(f"{path} is not a chunk manifest")
+        return manifest
+
+    def logical_size(self, path):
+        return self.read_manifest(path)['size']
+
+    def writer(self, path, expected_size=None):
+        return ChunkWriter(self, path, expected_size)
+
+    def write_bytes(self, path, data):
+        with self.writer(path) as w:
+            w.write(data)
+
+    def segments(self, path, offset, length):
+        """
+        (chunk_path, offset_in_chunk, length) pieces that make up length bytes of the
+        file starting at offset, in order
+        """
+        result = []
+        position = 0
+        end = offset + length
+        for digest, chunk_length in self.read_manifest(path)['chunks']:
+            chunk_end = position + chunk_length
+            if chunk_end > offset and position < end:
+                start = max(offset, position)
+                result.append((self.chunk_path(digest), start - position, min(end, chunk_end) - start))
+            if chunk_end >= end:
+                break
+            position = chunk_end
+        return result
+
+    def iter_content(self, path):
+        """The reassembled file content, one chunk at a time"""
+        for digest, chunk_length in self.read_manifest(path)['chunks']:
+            with open(self.chunk_path(digest), 'rb') as f:
+                yield f.read()
+
+    def referenced_chunks(self, manifest_paths):
+        digests = set()
+        for path in manifest_paths:
+            digests.update(digest for digest, chunk_length in self.read_manifest(path)['chunks'])
+        return digests
+
+    def collect_garbage(self, manifest_paths):
+        """Remove chunks no manifest refers to. Only safe while nothing is uploading."""
+        referenced = self.referenced_chunks(manifest_paths)
+        removed = 0
+        for first in os.listdir(self.chunks_dir):
+            directory = os.path.join(self.chunks_dir, first)
+            for name in os.listdir(directory):
+                if name not in referenced:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
+
+    def stats(self):
+        with self.lock:
+            return dict(chunks_written=self.chunks_written, chunks_deduplicated=self.chunks_deduplicated,
+                        bytes_written=self.bytes_written, bytes_deduplicated=self.bytes_deduplicated)
+
+
+def load_store(root):
+    """ChunkStore when root is configured for it, otherwise None (plain files)"""
+    try:
+        with open(os.path.join(root, STORE_MARKER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if name != 'chunked':
+        raise ValueError(f"unknown storage backend '{name}' in {os.path.join(root, STORE_MARKER)}")
+    return ChunkStore(root)
+
+
+def save_store(root, chunked):
+    marker = os.path.join(root, STORE_MARKER)
+    if not chunked:
+        if os.path.exists(marker):
+            os.remove(marker)
+        return
+    with open(marker + '.tmp', 'w') as f:
+        f.write('chunked\n')
+    os.replace(marker + '.tmp', marker)
@@ -0,0 +1,564 @@
+import socket
+import threading
+import logging
+import os
+import select
+
+import protocol_v2
+from file_protocol import FileProtocol
+from response import Response, FileRange
+from transfer import send_file, send_buffers, recv_to_file, MAX_SEND_BUFFERS
+from framing import RequestReader, RequestTooLarge
+from protocol_v2 import ProtocolError
+from multiplex import MuxConnection, MAX_CONCURRENT_STREAMS
+from lanes import Lanes, LaneBusy
+from shaping import Shaper, ShapedConnection
+fp = FileProtocol()
+lanes = None # request lanes of this process, see use_lanes
+
+MAX_COMMAND_SIZE = 160 * 1024 * 1024 # legacy base64 UPLOAD carries the whole file (100MB test file) in the command
+IDLE_TIMEOUT = 15 # seconds a kept-alive connection may wait for its next command
+MAX_PENDING_BYTES = 1024 * 1024 # gathered body buffers are sent once this much is waiting
+
+"""
+* ProcessTheClient dipakai bersama oleh threadpool_server dan processpool_server
+
+* satu koneksi bisa dipakai untuk banyak command (keep-alive). Command diproses
+berurutan, jadi command yang dikirim sekaligus (pipelining) juga dijawab
+berurutan. Koneksi ditutup jika client menutup koneksi, tidak mengirim apa-apa
+selama IDLE_TIMEOUT detik, atau transfer file gagal di tengah jalan
+
+* command teks "HELLO 2" memindahkan koneksi ke protokol v2 (frame biner,
+lihat protocol_v2.py), dijawab oleh ProcessTheFrame dengan fungsi streaming
+yang sama. "HELLO 3" memakai frame yang sama, tetapi setiap request dijawab
+di thread sendiri dan body-nya dikirim sebagai frame DATA yang bergantian
+(ServeTheStreams, multiplex.py)
+
+* setelah use_lanes, setiap request dijalankan di lane meta atau bulk
+(lanes.py, RunInLane), jadi transfer besar tidak bisa menahan LIST/STAT/DELETE.
+Request bulk yang antriannya penuh dijawab BUSY lalu koneksinya ditutup,
+supaya client yang menunggu retry_after tidak memegang thread koneksi
+
+* body response dan UPLOAD_STREAM melewati Shaped(), yang menahan transfer
+sesuai limit bandwidth global dan per IP client (shaping.py, use_shaping)
+"""
+
+
+class LoadStats:
+    """Connections and transfer bytes currently in progress in this process"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.active_connections = 0
+        self.bytes_in_flight = 0
+
+    def add(self, connections=0, nbytes=0):
+        with self.lock:
+            self.active_connections += connections
+            self.bytes_in_flight += nbytes
+        self.changed.set()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(connections=self.active_connections, bytes=self.bytes_in_flight)
+
+load_stats = LoadStats()
+
+
+def use_shared_cache(shared_cache):
+    """
+    Process pool initializer: serve GETs from the cache shared by all workers
+    instead of a private one, and expect the other workers to change files/ too
+    """
+    fp.file.cache = shared_cache
+    fp.file.index.shared = True
+
+
+def use_fsync_policy(policy):
+    """How uploads are made durable: 'none', 'file' or 'group', see atomic_write.py"""
+    fp.file.set_fsync_policy(policy)
+
+
+def use_admission_stats(stats):
+    """Report the queue depth and BUSY rejections of the accepting process in STATS, see admission.py"""
+    fp.file.stats_sources['admission'] = stats.snapshot
+
+
+def use_lanes(threads, meta_workers=None, bulk_workers=None, shared=False):
+    """
+    Run requests in separate meta/bulk lanes, threads = connection threads of this
+    process, or the processes of a pool with shared=True (call before they are forked). See lanes.py
+    """
+    global lanes
+    lanes = Lanes(threads, meta_workers, bulk_workers, shared)
+    fp.file.stats_sources['lanes'] = lanes.snapshot
+    return lanes
+
+
+def use_shaping(global_rate=0, client_rate=0):
+    """Global and per-client bandwidth limits in bytes/s (0 = none), changeable later with SHAPE. Call before the workers are forked."""
+    fp.shaper = Shaper(global_rate, client_rate)
+    fp.file.stats_sources['shaping'] = fp.shaper.snapshot
+    return fp.shaper
+
+
+def Shaped(connection, address):
+    """connection paced by the bandwidth limits, see shaping.py"""
+    if fp.shaper is None:
+        return connection
+    return ShapedConnection(connection, fp.shaper, address)
+
+
+def RunInLane(command, params, fn, *args, bounded=True):
+    """fn(*args) in the lane of the parsed request, raises LaneBusy when that lane's queue is full"""
+    if lanes is None:
+        return fn(*args)
+    return lanes.lane_for(command, params).run(fn, *args, bounded=bounded)
+
+
+def ProcessTheClient(connection, address):
+    logging.warning(f"Handling connection from {address}")
+    reader = RequestReader(connection, max_size=MAX_COMMAND_SIZE)
+    commands_handled = 0
+    protocol = 1 # until a HELLO switches to v2
+    load_stats.add(connections=1)
+
+    try:
+        while True:
+            # Stage 1: Wait for the next command, bounded by the idle timeout
+            connection.settimeout(IDLE_TIMEOUT)
+            try:
+                if protocol == 2:
+                    request = protocol_v2.read_frame(reader)
+                else:
+                    request = reader.read_request()
+            except socket.timeout:
+                if reader.buffer:
+                    logging.error(f"Socket timeout with {address} in the middle of a command")
+                else:
+                    logging.warning(f"Server: {address} idle for {IDLE_TIMEOUT}s after {commands_handled} commands, closing.")
+                return
+            except RequestTooLarge as e:
+                logging.warning(f"Server: Command from {address} too large: {e}")
+                connection.sendall(Response(dict(status='ERROR', data='request terlalu besar')).json_header())
+                return
+            except ProtocolError as e:
+                # The next frame can't be found any more
+                logging.warning(f"Server: Invalid v2 frame from {address}: {e}")
+                return
+
+            if request is None:
+                # Client closed connection
+                if commands_handled == 0:
+                    logging.warning(f"Server: No command data received from {address}, closing.")
+                return # Exit
+
+            # Transfers may legitimately stall for longer than the idle timeout
+            connection.settimeout(None)
+            commands_handled += 1
+            if protocol == 2:
+                if not ProcessTheFrame(connection, reader, address, request):
+                    return
+                continue
+
+            response = ProcessTheCommand(connection, reader, address, request)
+            if response is None:
+                return
+            if response.protocol is not None:
+                # Answered a HELLO
+                protocol = response.protocol
+                if protocol == protocol_v2.MULTIPLEXED_VERSION:
+                    ServeTheStreams(connection, reader, address)
+                    return
+
+    except socket.timeout:
+        logging.error(f"Socket timeout with {address}")
+    except ConnectionResetError:
+        logging.warning(f"Connection reset by {address}")
+    except BrokenPipeError: # Client disconnected
+        logging.warning(f"Broken pipe with {address}, client likely disconnected during streaming.")
+    except Exception as e:
+        logging.error(f"Error handling client {address}: {str(e)}")
+    finally:
+        logging.warning(f"Closing connection from {address}")
+        connection.close()
+        load_stats.add(connections=-1)
+
+
+def ProcessTheCommand(connection, reader, address, command_bytes):
+    """Answer one v1 command. Returns its Response, or None when the connection can't carry another command."""
+    # Decoded only once the whole command is in, so split UTF-8 sequences are fine
+    c_request, params, error = fp.parse_request(command_bytes.decode())
+    try:
+        return RunInLane(c_request, params, AnswerTheCommand, connection, reader, address, c_request, params, error)
+    except LaneBusy as e:
+        logging.warning(f"Server: {e}, answering {c_request.upper()} from {address} BUSY")
+        # Closed after BUSY, an idle connection would hold the thread the lane keeps free
+        connection.sendall(Response(e.response_dict()).json_header())
+        return None
+
+
+def AnswerTheCommand(connection, reader, address, c_request, params, error):
+    """ProcessTheCommand once the request has its lane"""
+    response = fp.answer_request(c_request, params, error, address)
+
+    if response.upload is not None:
+        # The result is only known once the file bytes are on disk
+        response = ReceiveTheUpload(reader, address, response.upload)
+        if response is None:
+            return None # Client went away mid-upload, nobody to answer
+
+    # Send the JSON response (metadata) to the client
+    connection.sendall(response.json_header())
+    if not response.keep_alive:
+        return None
+
+    # Stage 2: Stream the body, if any
+    if response.body is not None and not SendTheBody(connection, address, response.body):
+        return None # The client can't tell where this body ends and the next response starts
+    return response
+
+
+def ProcessTheFrame(connection, reader, address, frame):
+    """Answer one v2 request frame. Returns False when the connection can't carry another request."""
+    try:
+        return RunInLane(*FrameCommand(frame), AnswerTheFrame, connection, reader, address, frame)
+    except LaneBusy as e:
+        logging.warning(f"Server: {e}, answering request {frame.request_id} from {address} BUSY")
+        # The payload is not wanted, its length is known so the next frame can still be found
+        if frame.payload_length and reader.skip(frame.payload_length) < frame.payload_length:
+            return False
+        connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, e.response_dict()))
+        return False # closed like a v1 connection answered BUSY
+
+
+def FrameCommand(frame):
+    """(command, params) of a v2/v3 request frame, command is None for an unknown opcode"""
+    return protocol_v2.OPCODES.get(frame.opcode), frame.header if isinstance(frame.header, list) else []
+
+
+def AnswerTheFrame(connection, reader, address, frame):
+    """ProcessTheFrame once the request has its lane"""
+    response = ProcessTheRequest(reader, address, frame)
+    if response is None:
+        return False
+
+    body = response.body
+    if body is None:
+        connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data))
+        return True
+
+    if body.length is None:
+        # Length not known up front (LIST_STREAM): every part becomes a DATA frame
+        connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, 0, protocol_v2.FLAG_MORE))
+        for part in body.parts:
+            if isinstance(part, FileRange):
+                connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id, None, part.length, protocol_v2.FLAG_MORE))
+                if StreamContent(Shaped(connection, address), address, part.path, part.offset, part.length) < part.length:
+                    return False
+            elif len(part):
+                connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id, None, len(part), protocol_v2.FLAG_MORE) + part)
+        connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_DATA, frame.request_id))
+        return True
+
+    # GET, MGET and ARCHIVE bodies are the response payload
+    connection.sendall(protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, body.length))
+    return SendTheBody(connection, address, body)
+
+
+def ProcessTheRequest(reader, address, frame):
+    """
+    Run the command of a v2/v3 request frame and consume its payload. Returns
+    the Response, or None when the connection broke mid-upload.
+    """
+    command, params = FrameCommand(frame)
+    if command is None:
+        response = Response(dict(status='ERROR', data='request tidak dikenali'))
+    elif command == 'upload_stream':
+        # The payload is the file, so its length is the file size
+        response = fp.proses(command, params[:1] + [frame.payload_length], address)
+    else:
+        response = fp.proses(command, params, address)
+
+    if response.upload is not None:
+        response = ReceiveTheUpload(reader, address, response.upload)
+        if response is None:
+            return None # Client went away mid-upload, nobody to answer
+        if not response.keep_alive and reader.skip(frame.payload_length) < frame.payload_length:
+            return None # the upload could not even start, its payload still has to go
+    elif frame.payload_length:
+        # Unexpected or rejected payload, its length is known so the next frame can still be found
+        if reader.skip(frame.payload_length) < frame.payload_length:
+            return None
+    return response
+
+
+def ServeTheStreams(connection, reader, address):
+    """
+    Protocol v3: read request frames and answer each in its own thread, so a
+    long transfer doesn't hold back the requests after it (see multiplex.py)
+    """
+    mux = MuxConnection(connection)
+    threads = []
+    # The socket is shared with the stream threads, so idle time is watched with select
+    connection.settimeout(None)
+    try:
+        while True:
+            if not reader.buffer and not mux.active_streams():
+                readable, _, _ = select.select([connection], [], [], IDLE_TIMEOUT)
+                if not readable:
+                    logging.warning(f"Server: {address} idle for {IDLE_TIMEOUT}s, closing.")
+                    return
+            frame = protocol_v2.read_frame(reader)
+            if frame is None:
+                return
+
+            if frame.opcode == protocol_v2.OP_WINDOW_UPDATE:
+                mux.window_update(frame.request_id, frame.header)
+                continue
+
+            if frame.payload_length or protocol_v2.OPCODES.get(frame.opcode) in (None, 'upload_stream'):
+                # Uploads (and anything else carrying a payload) are read right here, in order
+                try:
+                    response = RunInLane(*FrameCommand(frame), ProcessTheRequest, reader, address, frame)
+                except LaneBusy as e:
+                    if reader.skip(frame.payload_length) < frame.payload_length:
+                        return
+                    response = Response(e.response_dict())
+                if response is None:
+                    return
+                mux.send([protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data)], urgent=True)
+                continue
+
+            if mux.active_streams() >= MAX_CONCURRENT_STREAMS:
+                response_dict = dict(status='ERROR', data=f'maksimal {MAX_CONCURRENT_STREAMS} request bersamaan per koneksi')
+                mux.send([protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response_dict)], urgent=True)
+                continue
+
+            stream = mux.open_stream(frame.request_id)
+            thread = threading.Thread(target=AnswerTheStream, args=(stream, address, frame), daemon=True)
+            thread.start()
+            threads = [t for t in threads if t.is_alive()] + [thread]
+    except ProtocolError as e:
+        logging.warning(f"Server: Invalid v3 frame from {address}: {e}")
+    finally:
+        # Streams still sending stop at their next frame
+        mux.close()
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for thread in threads:
+            thread.join()
+
+
+def AnswerTheStream(stream, address, frame):
+    """Thread answering one v3 request: RESPONSE frame, then the body as DATA frames"""
+    mux = stream.mux
+    try:
+        # Stream threads are not connection threads, so they wait for their lane however long its queue is
+        RunInLane(*FrameCommand(frame), AnswerTheStreamRequest, stream, address, frame, bounded=False)
+    except (OSError, ProtocolError) as e:
+        logging.warning(f"Server: Stream {frame.request_id} to {address} stopped: {e}")
+    finally:
+        mux.close_stream(stream)
+
+
+def AnswerTheStreamRequest(stream, address, frame):
+    """AnswerTheStream once the request has its lane"""
+    mux = stream.mux
+    response = fp.proses(*FrameCommand(frame), address)
+    flags = protocol_v2.FLAG_MORE if response.body is not None else 0
+    mux.send([protocol_v2.pack_frame(protocol_v2.OP_RESPONSE, frame.request_id, response.data, 0, flags)], urgent=True)
+    if response.body is not None:
+        if SendTheBody(stream, address, response.body):
+            stream.finish()
+        else:
+            stream.finish(dict(status='ERROR', data='body tidak terkirim lengkap'))
+
+
+def StreamContent(connection, address, file_to_stream_path, file_to_stream_offset, file_to_stream_size):
+    """Send a range of a stored file from the cache, the chunk store or the disk, returns the bytes sent"""
+    sent_bytes = 0
+    cached = fp.file.cache.pin(file_to_stream_path)
+    try:
+        if cached is not None and len(cached) >= file_to_stream_offset + file_to_stream_size:
+            # Hot file, straight from memory without touching the filesystem
+            connection.sendall(cached[file_to_stream_offset:file_to_stream_offset + file_to_stream_size])
+            sent_bytes = file_to_stream_size
+        elif fp.file.store is not None:
+            # The file is a manifest, its content comes from the chunk files
+            sent_bytes = StreamChunks(connection, address, file_to_stream_path, file_to_stream_offset, file_to_stream_size)
+        elif not os.path.exists(file_to_stream_path) or file_to_stream_size < 0:
+            logging.error(f"Server: File {file_to_stream_path} not found or invalid size for streaming to {address}, although metadata was OK_STREAM.")
+        else:
+            sent_bytes = StreamFromDisk(connection, address, file_to_stream_path, file_to_stream_offset, file_to_stream_size)
+    except Exception as e:
+        logging.error(f"Server: Error during file streaming of {file_to_stream_path} to {address}: {e}")
+    finally:
+        if cached is not None:
+            fp.file.cache.unpin(cached)
+    return sent_bytes
+
+
+class PendingSend:
+    """
+    Small buffers (tar headers, padding) and pinned cached content waiting to go
+    out in order with one send_buffers call, see SendTheBody
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.buffers = []
+        self.pins = []
+        self.size = 0
+        self.sent_bytes = 0
+
+    def add(self, buffer, pinned=None):
+        self.buffers.append(buffer)
+        self.size += len(buffer)
+        if pinned is not None:
+            self.pins.append(pinned)
+        if len(self.buffers) >= MAX_SEND_BUFFERS or self.size >= MAX_PENDING_BYTES:
+            self.flush()
+
+    def flush(self):
+        try:
+            self.sent_bytes += send_buffers(self.connection, self.buffers)
+        finally:
+            self.buffers = []
+            self.size = 0
+            self.release()
+
+    def release(self):
+        for cached in self.pins:
+            fp.file.cache.unpin(cached)
+        self.pins = []
+
+
+def StreamOne(pending, address, part):
+    """
+    Queue a FileRange on pending when its file is cached, otherwise flush pending
+    and stream it with StreamContent. Returns False when the range came up short.
+    """
+    end = part.offset + part.length
+    cached = fp.file.cache.pin(part.path)
+    if cached is not None and len(cached) >= end:
+        pending.add(cached[part.offset:end], pinned=cached)
+        return True
+    if cached is not None:
+        fp.file.cache.unpin(cached)
+    pending.flush()
+    n = StreamContent(pending.connection, address, part.path, part.offset, part.length)
+    pending.sent_bytes += n
+    return n == part.length
+
+
+def SendTheBody(connection, address, body):
+    """
+    Send a response.Body to connection (a socket, or a multiplex.MuxStream in
+    v3). Buffers and runs of cached files are gathered into one send_buffers
+    call, other file ranges go out with sendfile. Returns False when the body
+    could not be sent completely.
+    """
+    logging.warning(f"Server: Starting stream of {body.description} ({body.length} bytes) to {address}")
+    pending = PendingSend(Shaped(connection, address))
+    in_flight = body.length or 0
+    complete = False
+    load_stats.add(nbytes=in_flight)
+    try:
+        for part in body.parts:
+            if isinstance(part, FileRange):
+                if not StreamOne(pending, address, part):
+                    break
+            else:
+                pending.add(part)
+        else:
+            pending.flush()
+            complete = True
+    finally:
+        pending.release()
+        load_stats.add(nbytes=-in_flight)
+
+    if complete and body.length in (None, pending.sent_bytes):
+        logging.info(f"Server: Successfully streamed {pending.sent_bytes} bytes of {body.description} to {address}.")
+        return True
+    logging.warning(f"Server: Stream of {body.description} to {address} stopped after {pending.sent_bytes}/{body.length} bytes.")
+    return False
+
+
+def StreamFromDisk(connection, address, file_to_stream_path, file_to_stream_offset, file_to_stream_size):
+    """Send a range of a file with sendfile, returns how many bytes reached the socket"""
+    sent_bytes = 0
+    with open(file_to_stream_path, 'rb') as f:
+        # For zero-byte files nothing is sent, which is correct.
+        try:
+            sent_bytes = send_file(connection, f, file_to_stream_offset, file_to_stream_size)
+            if sent_bytes < file_to_stream_size:
+                # This might happen if file size changed or was read incorrectly
+                logging.warning(f"Server: File ended prematurely while streaming {file_to_stream_path} to {address}. Expected {file_to_stream_size}, sent {sent_bytes}.")
+        except BrokenPipeError:
+            sent_bytes = f.tell() - file_to_stream_offset
+            logging.warning(f"Server: Broken pipe while streaming {file_to_stream_path} to {address}. Client likely disconnected.")
+        except ConnectionResetError:
+            sent_bytes = f.tell() - file_to_stream_offset
+            logging.warning(f"Server: Connection reset while streaming {file_to_stream_path} to {address}. Client likely disconnected.")
+        except socket.error as se:
+            sent_bytes = f.tell() - file_to_stream_offset
+            logging.error(f"Server: Socket error while streaming {file_to_stream_path} to {address}: {se}")
+    return sent_bytes
+
+
+def StreamChunks(connection, address, manifest_path, offset, size):
+    """Send a range of a chunk-store file, one sendfile per chunk it touches"""
+    sent_bytes = 0
+    for chunk_path, chunk_offset, length in fp.file.store.segments(manifest_path, offset, size):
+        n = StreamFromDisk(connection, address, chunk_path, chunk_offset, length)
+        sent_bytes += n
+        if n < length:
+            break
+    return sent_bytes
+
+
+def ReceiveTheUpload(reader, address, upload):
+    """
+    Write the response.Upload that follows the request. Returns the Response, or None if
+    the upload came up short. When the file can't be created (e.g. the disk is full) the
+    answer is an ERROR with keep_alive False: none of the file bytes were read.
+    """
+    filename = upload.filename
+    file_size = upload.size
+    file_path = fp.file.path_for(filename, create=True)
+    logging.warning(f"Server: Receiving upload {file_path} ({file_size} bytes) from {address}")
+
+    received_bytes = 0
+    stored = False
+    fp.file.cache.invalidate(file_path)
+    try:
+        f = fp.file.open_upload(file_path, file_size)
+    except OSError as e:
+        logging.error(f"Server: Can't store {file_path} from {address}: {e}")
+        return Response(dict(status='ERROR', data=f'upload gagal: {e.strerror or e}'), keep_alive=False)
+    load_stats.add(nbytes=file_size)
+    try:
+        with f:
+            # reader hands out the bytes that came in with the command first
+            received_bytes = recv_to_file(Shaped(reader, address), f, file_size)
+        stored = True
+    except Exception as e:
+        logging.error(f"Server: Error while receiving {file_path} from {address}: {e}")
+    finally:
+        load_stats.add(nbytes=-file_size)
+
+    if received_bytes != file_size:
+        # The upload went to a temporary file that is gone now, any previous version is untouched
+        logging.warning(f"Server: Upload of {file_path} incomplete. Received {received_bytes}/{file_size} bytes from {address}, discarded.")
+        return None
+    if not stored:
+        # Every byte arrived but fsync/rename failed, the client is waiting for the answer
+        return Response(dict(status='ERROR', data='upload gagal disimpan'))
+
+    # Drop anything a concurrent GET may have cached while the file was being written
+    fp.file.cache.invalidate(file_path)
+    fp.file.index.update(os.path.basename(file_path))
+    logging.info(f"Server: Successfully received {received_bytes} bytes for {file_path} from {address}.")
+    return Response(dict(status='OK', data='File berhasil diupload', data_namafile=filename, data_filesize=received_bytes))
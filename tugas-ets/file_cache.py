@@ -0,0 +1,116 @@
+import os
+import stat
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+"""
+* FileCache menyimpan isi file yang sering diminta (GET) di memory, dengan
+batas total bytes dan urutan LRU
+
+* isi file disimpan sebagai bytes (immutable) dan dibagikan sebagai memoryview,
+jadi streaming dari cache tidak menyalin data
+
+* entry dibuang saat UPLOAD/DELETE (invalidate), dan dicek ulang ke filesystem
+(size + mtime) paling sering setiap revalidate_interval detik
+"""
+
+
+class CacheEntry:
+    __slots__ = ('data', 'size', 'mtime_ns', 'checked_at')
+
+    def __init__(self, data, size, mtime_ns, checked_at):
+        self.data = data
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.checked_at = checked_at
+
+
+class FileCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entry_size=16 * 1024 * 1024, revalidate_interval=1.0):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict() # path -> CacheEntry, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _is_fresh(self, path, entry, now):
+        if now - entry.checked_at < self.revalidate_interval:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size != entry.size or st.st_mtime_ns != entry.mtime_ns:
+            return False
+        entry.checked_at = now
+        return True
+
+    def lookup(self, path):
+        """Return the cached content as a memoryview, or None. Counts as a hit/miss."""
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and not self._is_fresh(path, entry, time.monotonic()):
+                self._drop(path)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return memoryview(entry.data)
+
+    def pin(self, path):
+        """Cached content for streaming, without revalidating or touching the counters"""
+        with self.lock:
+            entry = self.entries.get(path)
+            return memoryview(entry.data) if entry is not None else None
+
+    def unpin(self, view):
+        # bytes are immutable and stay alive as long as the view, nothing to protect
+        pass
+
+    def load(self, path, st=None):
+        """Read path into the cache if it is small enough. Returns the memoryview or None."""
+        st = st or os.stat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_entry_size or st.st_size > self.max_bytes:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) != st.st_size:
+            return None # changed while reading, try again next time
+
+        with self.lock:
+            self._drop(path)
+            self.entries[path] = CacheEntry(data, len(data), st.st_mtime_ns, time.monotonic())
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                evicted_path, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                self.evictions += 1
+                logging.info(f"FileCache: evicted {evicted_path} ({evicted.size} bytes)")
+        return memoryview(data)
+
+    def invalidate(self, path):
+        with self.lock:
+            if path in self.entries:
+                self._drop(path)
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        invalidations=self.invalidations, entries=len(self.entries),
+                        bytes=self.total_bytes, max_bytes=self.max_bytes)
@@ -0,0 +1,234 @@
+import os
+import stat
+import time
+import bisect
+import hashlib
+import logging
+import threading
+
+"""
+* FileIndex menyimpan metadata (nama, size, mtime, hash opsional) semua file
+di folder files/, dibangun sekali dengan os.scandir lalu di-update saat
+UPLOAD/DELETE, jadi LIST/DELETE/GET/STAT tidak perlu glob/stat folder setiap request
+
+* lokasi file di disk ditentukan oleh layout (storage_layout.py). Index
+mencatat mtime setiap folder: kalau mtime sebuah folder berubah tanpa
+lewat index ini (process lain, atau diubah manual), hanya folder itu yang
+di-scan ulang. Dengan ShardedLayout itu hanya belasan file
+
+* shared=True (worker processpool_server): perubahan dari process ini juga
+membuat folder di-scan ulang, karena worker lain bisa mengubah folder yang
+sama di saat yang sama
+
+* file yang ditimpa di tempat tidak mengubah mtime folder, jadi entry juga
+dicek ulang ke filesystem paling sering setiap revalidate_interval detik
+(sama seperti FileCache)
+
+* dengan chunk store (chunk_store.py) file di disk hanya manifest, jadi size
+yang dicatat adalah ukuran isi file menurut manifest. Nama yang diawali '.'
+(file sementara, marker, folder chunk) tidak pernah masuk index
+"""
+
+
+class IndexEntry:
+    __slots__ = ('name', 'size', 'mtime_ns', 'st', 'checked_at', 'sha256')
+
+    def __init__(self, name, st, checked_at, size):
+        self.name = name
+        self.size = size # content size, differs from st.st_size for chunk manifests
+        self.mtime_ns = st.st_mtime_ns
+        self.st = st
+        self.checked_at = checked_at
+        self.sha256 = None # computed on demand, see FileIndex.sha256
+
+
+class FileIndex:
+    def __init__(self, layout, revalidate_interval=1.0, shared=False, store=None):
+        self.layout = layout
+        self.store = store
+        self.revalidate_interval = revalidate_interval
+        self.shared = shared
+        self.entries = {} # name -> IndexEntry
+        self.sorted_names = [] # same names in order, for prefix/cursor paging
+        self.dir_names = {} # directory -> set of names in it
+        self.dir_mtimes = {} # directory -> mtime_ns when it was last scanned
+        self.checked_all_at = 0
+        self.lock = threading.Lock()
+        self.rescans = 0
+        with self.lock:
+            for directory in self.layout.directories():
+                self._scan_dir(directory, keep_sorted=False)
+            self.sorted_names = sorted(self.entries)
+            self.checked_all_at = time.monotonic()
+
+    def _dir_mtime(self, directory):
+        try:
+            return os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _new_entry(self, name, st, now):
+        # None when name can't be served: not a regular file, or a broken manifest
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if self.store is None:
+            return IndexEntry(name, st, now, st.st_size)
+        try:
+            return IndexEntry(name, st, now, self.store.logical_size(self.layout.path_for(name)))
+        except (OSError, ValueError) as e:
+            logging.warning(f"FileIndex: skipping {name}, not a readable chunk manifest: {e}")
+            return None
+
+    def _scan_dir(self, directory, keep_sorted=True):
+        # Caller holds the lock. The directory mtime is taken first, so a change
+        # made during the scan shows up as a newer mtime on the next check.
+        mtime = self._dir_mtime(directory)
+        now = time.monotonic()
+        found = {}
+        if mtime is not None:
+            with os.scandir(directory) as it:
+                for dirent in it:
+                    # skips hidden files, the layout's own subdirectories and files that don't belong here
+                    if dirent.name.startswith('.') or self.layout.dir_for(dirent.name) != directory:
+                        continue
+                    try:
+                        st = dirent.stat()
+                    except FileNotFoundError:
+                        continue # deleted while scanning
+                    if stat.S_ISREG(st.st_mode):
+                        found[dirent.name] = st
+        for name in self.dir_names.get(directory, set()) - found.keys():
+            self._drop(name)
+        for name, st in list(found.items()):
+            entry = self.entries.get(name)
+            if entry is None or entry.st.st_size != st.st_size or entry.mtime_ns != st.st_mtime_ns:
+                new_entry = self._new_entry(name, st, now)
+                if new_entry is None:
+                    del found[name]
+                    self._drop(name)
+                    continue
+                if entry is None and keep_sorted:
+                    bisect.insort(self.sorted_names, name)
+                self.entries[name] = new_entry
+        self.dir_names[directory] = set(found)
+        self.dir_mtimes[directory] = mtime
+        self.rescans += 1
+
+    def _check_dir(self, directory):
+        # Caller holds the lock. One stat of the directory instead of a listing.
+        if self._dir_mtime(directory) != self.dir_mtimes.get(directory):
+            self._scan_dir(directory)
+
+    def _check_all(self):
+        # Caller holds the lock. With a single directory this is one stat, with
+        # thousands of shards it is only done once per revalidate_interval.
+        now = time.monotonic()
+        if len(self.dir_mtimes) > 1 and now - self.checked_all_at < self.revalidate_interval:
+            return
+        for directory in self.layout.directories():
+            self._check_dir(directory)
+        self.checked_all_at = now
+
+    def _changed_here(self, name):
+        # Caller holds the lock. This process changed name's directory and already
+        # updated the index, a rescan is only needed if others may have changed it too.
+        if not self.shared:
+            directory = self.layout.dir_for(name)
+            self.dir_mtimes[directory] = self._dir_mtime(directory)
+
+    def _stat_entry(self, name):
+        # Caller holds the lock. Re-reads one file's metadata into the index.
+        try:
+            st = os.stat(self.layout.path_for(name))
+        except FileNotFoundError:
+            st = None
+        entry = self.entries.get(name)
+        if st is not None and entry is not None and entry.st.st_size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+            entry.checked_at = time.monotonic()
+            return entry
+        new_entry = self._new_entry(name, st, time.monotonic()) if st is not None else None
+        if new_entry is None:
+            self._drop(name)
+            return None
+        if entry is None:
+            bisect.insort(self.sorted_names, name)
+            self.dir_names.setdefault(self.layout.dir_for(name), set()).add(name)
+        self.entries[name] = new_entry
+        return new_entry
+
+    def _drop(self, name):
+        # Caller holds the lock
+        if self.entries.pop(name, None) is not None:
+            i = bisect.bisect_left(self.sorted_names, name)
+            del self.sorted_names[i]
+            self.dir_names.get(self.layout.dir_for(name), set()).discard(name)
+
+    def lookup(self, name):
+        """IndexEntry for name, or None when there is no such regular file"""
+        with self.lock:
+            self._check_dir(self.layout.dir_for(name))
+            entry = self.entries.get(name)
+            if entry is not None and time.monotonic() - entry.checked_at >= self.revalidate_interval:
+                entry = self._stat_entry(name)
+            return entry
+
+    def names(self):
+        with self.lock:
+            self._check_all()
+            return list(self.sorted_names)
+
+    def page(self, prefix='', after=None, limit=1000):
+        """
+        Up to limit entries whose name starts with prefix, in name order, starting
+        after the name 'after'. Returns (entries, more).
+        """
+        with self.lock:
+            self._check_all()
+            start = bisect.bisect_left(self.sorted_names, prefix)
+            if after is not None:
+                start = max(start, bisect.bisect_right(self.sorted_names, after))
+            entries = []
+            i = start
+            while i < len(self.sorted_names) and len(entries) < limit:
+                name = self.sorted_names[i]
+                if not name.startswith(prefix):
+                    break
+                entries.append(self.entries[name])
+                i += 1
+            more = i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix)
+            return entries, more
+
+    def count(self):
+        with self.lock:
+            self._check_all()
+            return len(self.entries)
+
+    def update(self, name):
+        """Call after name was written in this process"""
+        with self.lock:
+            entry = self._stat_entry(name)
+            self._changed_here(name)
+            return entry
+
+    def remove(self, name):
+        """Call after name was deleted in this process"""
+        with self.lock:
+            self._drop(name)
+            self._changed_here(name)
+
+    def sha256(self, name):
+        """Hex digest of name's content, computed once per version of the file"""
+        entry = self.lookup(name)
+        if entry is None:
+            return None
+        if entry.sha256 is None:
+            digest = hashlib.sha256()
+            if self.store is not None:
+                for chunk in self.store.iter_content(self.layout.path_for(name)):
+                    digest.update(chunk)
+            else:
+                with open(self.layout.path_for(name), 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+            entry.sha256 = digest.hexdigest()
+        return entry.sha256
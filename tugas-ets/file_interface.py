@@ -1,24 +1,113 @@
 import os
 import json
 import base64
-from glob import glob
+
+from file_cache import FileCache
+from file_index import FileIndex
+from storage_layout import load_layout
+from chunk_store import load_store
+from atomic_write import AtomicWriter, FSYNC_POLICIES, group_commit
+from tar_stream import archive_size, archive_parts
+from response import Response, Body, FileRange, Upload
+
+LIST_PAGE_SIZE = 1000 # names per LIST page when no limit is given
+MAX_LIST_PAGE_SIZE = 10000
+MAX_MGET_FILES = 1000 # names per MGET command
 
 
 class FileInterface:
-    def __init__(self):
-        self.file_path = 'files/'
+    def __init__(self, file_path='files/'):
+        self.file_path = file_path
         if not os.path.exists(self.file_path):
             os.makedirs(self.file_path)
         # os.chdir('files/')
+        # flat or hash-sharded placement under files/, see storage_layout.py
+        self.layout = load_layout(self.file_path)
+        # None for plain files, or the deduplicating chunk store, see chunk_store.py
+        self.store = load_store(self.file_path)
+        # when an upload reaches the disk, see atomic_write.py
+        self.fsync_policy = 'group'
+        # hot files served by GET are kept in memory, see file_cache.py
+        self.cache = FileCache()
+        # name/size/mtime of every file, so requests don't list or stat the directory
+        self.index = FileIndex(self.layout, store=self.store)
+        # name -> callable, server-level numbers added to STATS (e.g. admission control)
+        self.stats_sources = {}
+
+    def path_for(self, filename, create=False):
+        """Where a protocol file name lives on disk, create=True for writing"""
+        return self.layout.path_for(os.path.basename(filename), create=create) # Sanitize filename
+
+    def set_fsync_policy(self, policy):
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {', '.join(FSYNC_POLICIES)}")
+        self.fsync_policy = policy
+        if self.store is not None:
+            self.store.fsync_policy = policy
+
+    def open_upload(self, path, size):
+        """
+        File-like object an upload of size bytes is written to. The new version only
+        replaces the old one once all size bytes arrived and close() is called.
+        """
+        if self.store is not None:
+            return self.store.writer(path, size)
+        return AtomicWriter(path, size, self.fsync_policy)
+
+    @staticmethod
+    def _listed(name):
+        # same names glob('*.*') used to return: no hidden files, only names with an extension
+        return '.' in name and not name.startswith('.')
 
     def list(self,params=[]):
+        # LIST: every name at once. LIST <prefix> [cursor] [limit]: one page of names
+        # starting with prefix ("" for all), continue with the returned next_cursor.
         try:
-            filelist = glob(os.path.join(self.file_path, '*.*'))
-            filelist = [os.path.basename(f) for f in filelist]  # Get only filenames
-            return dict(status='OK',data=filelist)
+            if len(params) == 0:
+                filelist = [name for name in self.index.names() if self._listed(name)]
+                return dict(status='OK',data=filelist)
+
+            prefix = params[0]
+            # the cursor is the hex-encoded last name of the previous page, so names
+            # with spaces, quotes or non-ASCII characters stay one plain token
+            after = bytes.fromhex(params[1]).decode() if len(params) > 1 and params[1] else None
+            limit = int(params[2]) if len(params) > 2 else LIST_PAGE_SIZE
+            if limit <= 0 or limit > MAX_LIST_PAGE_SIZE:
+                return dict(status='ERROR', data=f'limit harus antara 1 dan {MAX_LIST_PAGE_SIZE}')
+            entries, more = self.index.page(prefix, after, limit)
+            filelist = [entry.name for entry in entries if self._listed(entry.name)]
+            next_cursor = entries[-1].name.encode().hex() if more else None
+            return dict(status='OK', data=filelist, next_cursor=next_cursor)
+        except ValueError:
+            return dict(status='ERROR', data='cursor atau limit tidak valid')
         except Exception as e:
             return dict(status='ERROR',data=str(e))
 
+    def list_stream(self, params=[]):
+        # LIST_STREAM [prefix]: 'OK_STREAM', the listing follows this response
+        # as newline-delimited JSON entries, see listing_chunks
+        prefix = params[0] if len(params) > 0 else ''
+        return Response(dict(status='OK_STREAM', data_prefix=prefix),
+                        body=Body(self.listing_chunks(prefix), description=f'listing of {prefix!r}', blocking=True))
+
+    def listing_chunks(self, prefix=''):
+        """
+        Body of a LIST_STREAM: one JSON object per line per file, one bytes chunk per
+        index page, ended by an empty line. Only one page is held in memory at a time.
+        """
+        after = None
+        more = True
+        while more:
+            entries, more = self.index.page(prefix, after, LIST_PAGE_SIZE)
+            if not entries:
+                break
+            after = entries[-1].name
+            lines = [json.dumps(dict(name=entry.name, size=entry.size, mtime=entry.mtime_ns / 1e9))
+                     for entry in entries if self._listed(entry.name)]
+            if lines:
+                yield ('\n'.join(lines) + '\n').encode()
+        yield b'\n'
+
     def get(self,params=[]):
         try:
             filename = params[0]
@@ -26,52 +115,173 @@ class FileInterface:
                 # Return an error dictionary consistent with other methods
                 return dict(status='ERROR', data='Filename cannot be empty')
 
-            file_path_full = os.path.join(self.file_path, os.path.basename(filename)) # Sanitize filename
+            file_path_full = self.path_for(filename)
             
-            if not os.path.exists(file_path_full) or not os.path.isfile(file_path_full):
+            entry = self.index.lookup(os.path.basename(filename))
+            if entry is None:
                 return dict(status='ERROR',data='File not found or is not a file')
+            filesize = entry.size
+            if self.store is None and self.cache.lookup(file_path_full) is None:
+                # small enough files are read into the cache here and streamed from memory
+                # (chunked files are streamed from their chunks instead)
+                self.cache.load(file_path_full, entry.st)
+
+            # Optional byte range: GET <name> <offset> [length], length defaults to the rest of the file
+            offset = int(params[1]) if len(params) > 1 else 0
+            if offset < 0 or offset > filesize:
+                return dict(status='ERROR', data='offset di luar ukuran file')
+            length = int(params[2]) if len(params) > 2 else filesize - offset
+            if length < 0:
+                return dict(status='ERROR', data='panjang range tidak valid')
+            length = min(length, filesize - offset)
 
-            filesize = os.path.getsize(file_path_full)
             # Return metadata for streaming.
             # 'OK_STREAM' is a new status to indicate that raw file data will follow the JSON response.
-            return dict(status='OK_STREAM', data_namafile=filename, data_filesize=filesize)
+            # data_length bytes starting at data_offset follow, data_filesize is the size of the whole file.
+            return Response(dict(status='OK_STREAM', data_namafile=filename, data_filesize=filesize, data_offset=offset, data_length=length),
+                            body=Body([FileRange(file_path_full, offset, length)], length, description=file_path_full))
+        except ValueError:
+            return dict(status='ERROR', data='range tidak valid')
         except Exception as e:
             return dict(status='ERROR',data=str(e))
 
+
+    def mget(self, params=[]):
+        # MGET <name1> <name2> ...: one header with every file's size/status, then the content
+        # of the OK files back to back in the same order, data_length bytes in total
+        if len(params) == 0:
+            return dict(status='ERROR', data='MGET butuh minimal satu nama file')
+        if len(params) > MAX_MGET_FILES:
+            return dict(status='ERROR', data=f'maksimal {MAX_MGET_FILES} file per MGET')
+        files = []
+        parts = []
+        total = 0
+        for filename in params:
+            entry = self.index.lookup(os.path.basename(filename)) if filename != '' else None
+            if entry is None:
+                files.append(dict(namafile=filename, status='ERROR', data='File not found or is not a file'))
+                continue
+            file_path_full = self.path_for(filename)
+            if self.store is None and self.cache.lookup(file_path_full) is None:
+                self.cache.load(file_path_full, entry.st)
+            files.append(dict(namafile=filename, status='OK', filesize=entry.size))
+            parts.append(FileRange(file_path_full, 0, entry.size))
+            total += entry.size
+        return Response(dict(status='OK_STREAM', data_files=files, data_length=total),
+                        body=Body(parts, total, description=f'{len(parts)} files (MGET)'))
+
+    def archive(self, params=[]):
+        # ARCHIVE <prefix|*>: every file whose name starts with prefix as one tar stream
+        # of data_length bytes after this response, see tar_stream.py. data_files lists
+        # the members in archive order, their sizes are fixed by this snapshot.
+        prefix = params[0] if len(params) > 0 else '*'
+        if prefix == '*':
+            prefix = ''
+        try:
+            files = []
+            after = None
+            more = True
+            while more:
+                entries, more = self.index.page(prefix, after, LIST_PAGE_SIZE)
+                if not entries:
+                    break
+                after = entries[-1].name
+                files.extend(dict(namafile=entry.name, filesize=entry.size, mtime=entry.mtime_ns // 10**9)
+                             for entry in entries if self._listed(entry.name))
+            members = [(f['namafile'], f['filesize'], f['mtime']) for f in files]
+            total = archive_size(members)
+            return Response(dict(status='OK_STREAM', data_prefix=prefix, data_files=files, data_length=total),
+                            body=Body(archive_parts(members, self.path_for), total, description=f'archive of {len(files)} files'))
+        except Exception as e:
+            return dict(status='ERROR', data=str(e))
         
     def upload(self, params=[]):
         try:
             filename = params[0]
-            filename = os.path.join(self.file_path, os.path.basename(filename))  # Sanitize filename
             if (filename == ''):
                 return dict(status='ERROR', data='Nama file tidak boleh kosong')
-            fp = open(filename, 'wb')
-            fp.write(base64.b64decode(params[1]))
+            filename = self.path_for(filename, create=True)
+            content = base64.b64decode(params[1])
+            with self.open_upload(filename, len(content)) as fp:
+                fp.write(content)
+            self.cache.invalidate(filename)
+            self.index.update(os.path.basename(filename))
             return dict(status='OK', data='File berhasil diupload')
         except Exception as e:
             return dict(status='ERROR', data=str(e))
     
+    def upload_stream(self, params=[]):
+        try:
+            filename = params[0]
+            if (filename == ''):
+                return dict(status='ERROR', data='Nama file tidak boleh kosong')
+            if len(params) < 2:
+                return dict(status='ERROR', data='parameter tidak lengkap')
+            filesize = int(params[1])
+            if filesize < 0:
+                return dict(status='ERROR', data='Ukuran file tidak valid')
+            # Only validates the request. 'OK_STREAM' with an Upload tells the server that filesize
+            # raw bytes follow the command and have to be written to data_namafile.
+            filename = os.path.basename(filename)
+            return Response(dict(status='OK_STREAM', data_namafile=filename, data_filesize=filesize),
+                            upload=Upload(filename, filesize))
+        except ValueError:
+            return dict(status='ERROR', data='Ukuran file tidak valid')
+        except Exception as e:
+            return dict(status='ERROR', data=str(e))
+
     def delete(self, params=[]):
         try:
-            filelist = glob(os.path.join(self.file_path, '*.*'))
-            before_sum = len(filelist)
+            before_sum = self.index.count()
 
             filename = params[0]
             if (filename == ''):
                 return None
-            if not os.path.exists(os.path.join(self.file_path, filename)):
+            name = os.path.basename(filename) # Sanitize filename
+            if self.index.lookup(name) is None:
                 return dict(status='ERROR',data='file tidak ditemukan')
             elif before_sum == 0:
                 return dict(status='ERROR',data='tidak ada file di server')
-            os.remove(os.path.join(self.file_path, filename))
+            try:
+                os.remove(self.path_for(name))
+            except FileNotFoundError:
+                # deleted by another worker process since the index last looked
+                self.index.remove(name)
+                return dict(status='ERROR',data='file tidak ditemukan')
+            self.cache.invalidate(self.path_for(name))
+            self.index.remove(name)
+
+            return dict(status='OK',data_namafile=filename, sum=(before_sum, before_sum - 1))
+        except Exception as e:
+            return dict(status='ERROR',data=str(e))
 
-            filelist = glob(os.path.join(self.file_path, '*.*'))
-            after_sum = len(filelist)
 
-            return dict(status='OK',data_namafile=filename, sum=(before_sum, after_sum))
+    def stat(self, params=[]):
+        # STAT <name> [hash]: metadata of one file without transferring it
+        try:
+            filename = params[0]
+            if (filename == ''):
+                return dict(status='ERROR', data='Nama file tidak boleh kosong')
+            name = os.path.basename(filename)
+            entry = self.index.lookup(name)
+            if entry is None:
+                return dict(status='ERROR',data='File not found or is not a file')
+            result = dict(status='OK', data_namafile=filename, data_filesize=entry.size, data_mtime=entry.mtime_ns / 1e9)
+            if len(params) > 1 and params[1].lower() == 'hash':
+                result['data_sha256'] = self.index.sha256(name)
+            return result
         except Exception as e:
             return dict(status='ERROR',data=str(e))
 
+    def stats(self, params=[]):
+        # hit/miss/eviction counters of the GET cache in this server process
+        data = self.cache.stats()
+        data['fsync'] = dict(policy=self.fsync_policy, **group_commit.stats())
+        if self.store is not None:
+            data['chunk_store'] = self.store.stats()
+        for name, source in self.stats_sources.items():
+            data[name] = source()
+        return dict(status='OK', data=data)
 
 
 if __name__=='__main__':
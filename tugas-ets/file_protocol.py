@@ -1,8 +1,34 @@
+import re
 import json
 import logging
-import shlex
+import ipaddress
 
 from file_interface import FileInterface
+from response import Response
+from protocol_v2 import handshake_response
+from shaping import parse_rate
+
+# verb -> (FileInterface method, min params, max params), None = no upper limit
+COMMANDS = {
+    'list': ('list', 0, 3),
+    'list_stream': ('list_stream', 0, 1),
+    'get': ('get', 1, 3),
+    'mget': ('mget', 1, None),
+    'archive': ('archive', 0, 1),
+    'upload': ('upload', 2, 2),
+    'upload_stream': ('upload_stream', 2, 2),
+    'delete': ('delete', 1, 1),
+    'stat': ('stat', 1, 2),
+    'stats': ('stats', 0, 0),
+}
+LOCAL_ONLY = {'shape'} # change server-wide settings when given parameters, only loopback peers may do that
+
+_VERB = re.compile(r'\S*')
+_QUOTING = re.compile(r'["\'\\]')
+# one piece of a word: plain text, '...', "...", a backslash escape, or whitespace between words.
+# Anything else left over is an unclosed quote or a backslash at the very end.
+_PIECE = re.compile(r'''([^\s"'\\]+)|'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)|(\s+)|(.)''', re.S)
+_DOUBLE_QUOTED_ESCAPE = re.compile(r'\\(["\\])')
 
 """
 * class FileProtocol bertugas untuk memproses 
@@ -14,38 +40,147 @@ pada akhirnya akan diproses dalam bentuk string
 
 * class FileProtocol akan memproses data yang masuk dalam bentuk
 string
+
+* hasilnya adalah Response (response.py): status/metadata ditambah body,
+upload atau pergantian protokol yang harus dijalankan server, jadi server
+tidak perlu membaca ulang JSON atau mencocokkan nama command
+
+* command dicari di tabel COMMANDS, jadi hanya command protokol yang bisa
+dipanggil (bukan sembarang atribut FileInterface) dan jumlah parameternya
+sudah dicek sebelum FileInterface dipanggil. Hanya nama command yang
+di-lower-case, nama file dan parameter lain dipakai apa adanya
+
+* parse_request dan answer_request adalah dua bagian proses_request, server
+memakainya terpisah untuk memilih lane request di antaranya (lanes.py)
+
+* command di LOCAL_ONLY (SHAPE) dengan parameter mengubah setting seluruh
+server, jadi hanya diterima dari client di mesin yang sama (loopback).
+Tanpa parameter (hanya membaca) boleh dari mana saja. Server memberikan
+alamat client (peer) ke proses/answer_request
+
+* parameter dipisah oleh tokenize(), aturannya sama dengan shlex.split:
+'...' dan "..." untuk nama dengan spasi (juga "" untuk string kosong),
+backslash untuk satu karakter. Baris tanpa quote/backslash cukup str.split()
 """
 
 
+def tokenize(line):
+    """Words of a command line, quoted like shlex.split does. Raises ValueError on an unclosed quote."""
+    if _QUOTING.search(line) is None:
+        return line.split()
+    words = []
+    word = None # None between words, so '' stays an (empty) word
+    for match in _PIECE.finditer(line):
+        plain, single, double, escaped, space, stray = match.groups()
+        if space is not None:
+            if word is not None:
+                words.append(word)
+                word = None
+            continue
+        if stray is not None:
+            raise ValueError("No closing quotation" if stray in '"\'' else "No escaped character")
+        if double is not None:
+            piece = _DOUBLE_QUOTED_ESCAPE.sub(r'\1', double) if '\\' in double else double
+        else:
+            piece = plain if plain is not None else single if single is not None else escaped
+        word = piece if word is None else word + piece
+    if word is not None:
+        words.append(word)
+    return words
+
+
+def is_local(peer):
+    """True when peer, a (host, port, ...) address, is a loopback address. None (unknown) is not."""
+    try:
+        address = ipaddress.ip_address(peer[0])
+    except (TypeError, IndexError, ValueError):
+        return False
+    if getattr(address, 'ipv4_mapped', None) is not None:
+        address = address.ipv4_mapped # ::ffff:127.0.0.1 from a dual-stack socket
+    return address.is_loopback
+
 
 class FileProtocol:
-    def __init__(self):
-        self.file = FileInterface()
+    def __init__(self, file_path='files/'):
+        self.file = FileInterface(file_path)
+        # verb -> (handler, min params, max params)
+        self.commands = {verb: (getattr(self.file, method), low, high) for verb, (method, low, high) in COMMANDS.items()}
+        self.commands['hello'] = (self.hello, 1, 1)
+        self.commands['shape'] = (self.shape, 0, 2)
+        self.shaper = None # shaping.Shaper of the server, see client_handler.use_shaping
+
     def proses_string(self,string_datamasuk=''):
-        logging.warning(f"string diproses: {string_datamasuk[:100]}...")  # Log first 100 characters
-
-        c = ""
-        params = []
-        parts = string_datamasuk.split(' ', 1)
-        c_request = parts[0].strip().lower()
-
-        if c_request != 'upload':
-            c = shlex.split(string_datamasuk.lower())
-            c_request = c[0].strip()
-            params = [x for x in c[1:]]
-        else: # upload protocol
-            parts = string_datamasuk.split(' ', 2)
-            c_request = parts[0].strip().lower()
-            filename = parts[1].strip()
-            content = parts[2].strip()
-            params = [filename, content]
+        return json.dumps(self.proses_request(string_datamasuk).data)
+
+    def proses_request(self,string_datamasuk='', peer=None):
+        # command teks v1, hasilnya Response
+        return self.answer_request(*self.parse_request(string_datamasuk), peer=peer)
+
+    def parse_request(self, string_datamasuk=''):
+        # command teks v1 -> (nama command, parameter, error). error adalah
+        # Response kalau baris tidak bisa dipisah, parameternya None
+        logging.debug("string diproses: %.100s...", string_datamasuk)  # Log first 100 characters
+
+        line = string_datamasuk.strip()
+        verb = _VERB.match(line)
+        c_request = verb.group().lower()
+        rest = line[verb.end():]
+
+        try:
+            if c_request == 'upload': # upload protocol, the base64 content is never tokenized
+                return c_request, rest.split(None, 1), None
+            return c_request, tokenize(rest), None
+        except ValueError as e:
+            return c_request, None, Response(dict(status='ERROR', data=f'command tidak valid: {e}'))
+
+    def answer_request(self, c_request, params, error=None, peer=None):
+        # menjalankan hasil parse_request
+        response = error if error is not None else self.proses(c_request, params, peer)
+        if c_request == 'upload_stream' and response.upload is None:
+            # Rejected, the file bytes after the command are never read so the next command can't be found
+            response.keep_alive = False
+        return response
+
+    def proses(self, c_request, params, peer=None):
+        # request yang sudah dipisah menjadi nama command + parameter (v1 dari
+        # proses_request, v2 langsung dari frame). FileInterface mengembalikan
+        # dict, atau Response kalau ada body/upload. peer adalah alamat client
+        command = self.commands.get(c_request)
+        if command is None:
+            return Response(dict(status='ERROR',data='request tidak dikenali'))
+        handler, low, high = command
+        if len(params) < low or (high is not None and len(params) > high):
+            expected = f'{low}' if low == high else f'minimal {low}' if high is None else f'{low} sampai {high}'
+            return Response(dict(status='ERROR', data=f'{c_request.upper()} butuh {expected} parameter'))
+        if c_request in LOCAL_ONLY and params and not is_local(peer):
+            logging.warning(f"Refused {c_request.upper()} {params} from {peer}")
+            return Response(dict(status='ERROR', data=f'{c_request.upper()} dengan parameter hanya boleh dari localhost'))
         try:
-            logging.warning(f"memproses request: {c_request}")
-            cl = getattr(self.file,c_request)(params)
-            logging.warning(f"hasil request: {cl}")
-            return json.dumps(cl)
+            logging.debug("memproses request: %s", c_request)
+            cl = handler(params)
+            logging.debug("hasil request: %s", cl)
+            return cl if isinstance(cl, Response) else Response(cl)
         except Exception:
-            return json.dumps(dict(status='ERROR',data='request tidak dikenali'))
+            return Response(dict(status='ERROR',data='request tidak dikenali'))
+
+    def hello(self, params):
+        # HELLO <version>: the connection switches protocol after the answer
+        data = handshake_response(params)
+        return Response(data, protocol=data.get('version'))
+
+    def shape(self, params):
+        # SHAPE [global [per_client]]: bandwidth limits in byte/detik (10M, 512K, 0 = tanpa limit),
+        # tanpa parameter hanya menampilkan limit dan throttle wait, lihat shaping.py.
+        # Perubahan limit hanya sampai di sini dari loopback, lihat proses
+        if self.shaper is None:
+            return dict(status='ERROR', data='bandwidth shaping tidak aktif di server ini')
+        try:
+            rates = [parse_rate(param) for param in params]
+        except ValueError as e:
+            return dict(status='ERROR', data=f'limit tidak valid: {e}')
+        if rates:
+            self.shaper.set_limits(*rates)
+        return dict(status='OK', data=self.shaper.snapshot())
 
 
 if __name__=='__main__':
@@ -0,0 +1,142 @@
+import time
+import threading
+import logging
+import multiprocessing
+
+from admission import RETRY_AFTER
+
+META = 'meta'
+BULK = 'bulk'
+BULK_COMMANDS = {'get', 'mget', 'archive', 'upload', 'upload_stream', 'list_stream'} # hold a worker for the whole transfer
+DEFAULT_META_SHARE = 4 # without a configured size, 1 in 4 connection threads is kept for metadata requests
+
+# slots in the counters of a lane
+ACTIVE, QUEUED, STARTED, REJECTED, WAIT_TOTAL, WAIT_MAX = range(6)
+
+"""
+* satu thread koneksi menjalankan semua request di koneksinya. Kalau semua
+thread sedang streaming GET/UPLOAD 100MB, LIST/DELETE/STAT yang datang
+harus menunggu sampai transfer selesai, bisa bermenit-menit
+
+* setelah header request diparse, request diklasifikasi (lane_for):
+transfer (BULK_COMMANDS, juga STAT ... hash yang membaca seluruh file)
+masuk lane bulk, sisanya lane meta. Setiap lane punya jumlah worker
+sendiri, request menunggu di lane-nya sampai ada worker yang bebas
+
+* request tetap dijalankan di thread koneksinya sendiri (socket tidak
+berpindah thread), jadi request yang menunggu di antrian lane juga memegang
+thread koneksinya. Karena itu lane bulk dibatasi bersama antriannya: yang
+jalan + yang menunggu paling banyak threads - meta_workers. Request bulk
+berikutnya langsung dijawab {"status": "BUSY", "retry_after": ...} dan
+koneksinya ditutup (client yang mundur tidak memegang thread), jadi selalu
+ada meta_workers thread yang tidak bisa dipakai transfer
+
+* koneksi keep-alive yang sedang diam (menunggu command berikutnya) tetap
+memegang thread di luar lane mana pun, itu dibatasi IDLE_TIMEOUT
+
+* di processpool mode pool setiap process melayani satu koneksi, jadi lane
+dihitung bersama oleh semua process (shared=True): counter di shared
+memory, dijaga multiprocessing.Condition
+
+* waktu tunggu di antrian setiap lane (rata-rata, maksimum) dan jumlah
+request yang sedang jalan/menunggu/ditolak dilaporkan di STATS ("lanes")
+"""
+
+
+class LaneBusy(Exception):
+    """The queue of the lane is full, the request should be answered BUSY"""
+    def __init__(self, lane):
+        Exception.__init__(self, f"lane {lane.name} is full")
+        self.lane = lane
+
+    def response_dict(self):
+        return dict(status='BUSY', retry_after=RETRY_AFTER, data=f'server sibuk ({self.lane.name}), coba lagi nanti')
+
+
+class Lane:
+    """
+    At most `workers` requests of one kind at a time, the others wait in order.
+    shared=True counts the requests of all processes forked after it is made.
+    """
+    def __init__(self, name, workers, max_queued=None, shared=False):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued # None = no limit
+        if shared:
+            self.condition = multiprocessing.Condition()
+            self.counters = multiprocessing.Array('d', 6, lock=False)
+        else:
+            self.condition = threading.Condition()
+            self.counters = [0.0] * 6
+
+    def acquire(self, bounded=True):
+        """Wait for a free worker slot, False when the queue is already full (and bounded)"""
+        start = time.monotonic()
+        counters = self.counters
+        with self.condition:
+            if counters[ACTIVE] >= self.workers:
+                if bounded and self.max_queued is not None and counters[QUEUED] >= self.max_queued:
+                    counters[REJECTED] += 1
+                    return False
+                counters[QUEUED] += 1
+                while counters[ACTIVE] >= self.workers:
+                    self.condition.wait()
+                counters[QUEUED] -= 1
+            counters[ACTIVE] += 1
+            wait = time.monotonic() - start
+            counters[STARTED] += 1
+            counters[WAIT_TOTAL] += wait
+            counters[WAIT_MAX] = max(counters[WAIT_MAX], wait)
+        return True
+
+    def release(self):
+        with self.condition:
+            self.counters[ACTIVE] -= 1
+            self.condition.notify()
+
+    def run(self, fn, *args, bounded=True):
+        """
+        fn(*args) once a slot of this lane is free, raises LaneBusy when the queue
+        is full. bounded=False waits anyway, for callers that don't hold a connection thread.
+        """
+        if not self.acquire(bounded):
+            raise LaneBusy(self)
+        try:
+            return fn(*args)
+        finally:
+            self.release()
+
+    def snapshot(self):
+        with self.condition:
+            active, queued, started, rejected, wait_total, wait_max = self.counters[:]
+        return dict(workers=self.workers, active=int(active), queued=int(queued), max_queued=self.max_queued,
+                    started=int(started), rejected=int(rejected),
+                    wait_avg_ms=round(1000 * wait_total / started, 3) if started else 0.0,
+                    wait_max_ms=round(1000 * wait_max, 3))
+
+
+class Lanes:
+    """
+    The meta and bulk lanes of one process (or of the whole pool, shared=True).
+    Of threads connection threads, bulk transfers running or waiting never hold
+    more than threads - meta_workers, the rest of the bulk requests get BUSY.
+    """
+    def __init__(self, threads, meta_workers=None, bulk_workers=None, shared=False):
+        meta_workers = meta_workers or max(1, threads // DEFAULT_META_SHARE)
+        bulk_threads = max(1, threads - meta_workers) # a single thread can't be reserved for anything
+        if bulk_workers and bulk_workers > bulk_threads:
+            logging.warning(f"{bulk_workers} bulk lane workers leave less than {meta_workers} of {threads} threads for metadata requests, using {bulk_threads}")
+        bulk_workers = min(bulk_workers or bulk_threads, bulk_threads)
+        self.meta = Lane(META, meta_workers, shared=shared)
+        self.bulk = Lane(BULK, bulk_workers, max_queued=bulk_threads - bulk_workers, shared=shared)
+
+    def lane_for(self, command, params):
+        """Lane of a parsed request, command is the lower-case command name"""
+        if command in BULK_COMMANDS:
+            return self.bulk
+        if command == 'stat' and params and len(params) > 1 and str(params[1]).lower() == 'hash':
+            return self.bulk # hashes the whole file
+        return self.meta
+
+    def snapshot(self):
+        return {META: self.meta.snapshot(), BULK: self.bulk.snapshot()}
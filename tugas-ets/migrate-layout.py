@@ -0,0 +1,77 @@
+import os
+import sys
+import stat
+import logging
+
+from storage_layout import LAYOUTS, FlatLayout, load_layout, save_layout
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+* memindahkan isi files/ dari layout yang sekarang ke layout lain (flat <-> sharded)
+dengan os.rename, jadi tidak ada data yang disalin
+
+* jalankan saat server mati. Layout baru baru dicatat di files/.layout setelah
+semua file dipindah; kalau terhenti di tengah jalan, jalankan lagi perintah
+yang sama untuk menyelesaikannya
+
+usage: python3 migrate-layout.py [sharded|flat] [root]
+"""
+
+
+def remove_empty_shards(root):
+    for first in os.listdir(root):
+        top = os.path.join(root, first)
+        if len(first) != 2 or not stat.S_ISDIR(os.stat(top).st_mode):
+            continue
+        for second in os.listdir(top):
+            try:
+                os.rmdir(os.path.join(top, second))
+            except OSError:
+                pass # not empty
+        try:
+            os.rmdir(top)
+        except OSError:
+            pass
+
+
+def migrate(root, target_name):
+    source = load_layout(root)
+    target = LAYOUTS[target_name](root)
+    if source.name == target.name:
+        logging.info(f"{root} already uses the {target.name} layout")
+        return
+
+    logging.info(f"Migrating {root} from {source.name} to {target.name} layout...")
+    moved = 0
+    skipped = 0
+    # collected first, the move itself changes the directories being walked
+    for name, path in list(source.files()):
+        new_path = target.path_for(name, create=True)
+        if new_path == path:
+            continue
+        if os.path.exists(new_path):
+            logging.warning(f"  {new_path} already exists, leaving {path} in place")
+            skipped += 1
+            continue
+        os.rename(path, new_path)
+        moved += 1
+        if moved % 10000 == 0:
+            logging.info(f"  Progress: {moved} files moved")
+
+    if target.name == FlatLayout.name:
+        remove_empty_shards(root)
+    save_layout(root, target.name)
+    logging.info(f"Moved {moved} files, {skipped} skipped. {root} now uses the {target.name} layout")
+
+
+def main():
+    target_name = sys.argv[1] if len(sys.argv) > 1 else 'sharded'
+    root = sys.argv[2] if len(sys.argv) > 2 else 'files/'
+    if target_name not in LAYOUTS:
+        print(f"usage: python3 migrate-layout.py [{'|'.join(LAYOUTS)}] [root]")
+        sys.exit(1)
+    migrate(root, target_name)
+
+if __name__ == "__main__":
+    main()
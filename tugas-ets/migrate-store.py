@@ -0,0 +1,77 @@
+import sys
+import logging
+
+from storage_layout import load_layout
+from chunk_store import ChunkStore, load_store, save_store, is_manifest
+from atomic_write import AtomicWriter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+"""
+* mengubah files/ antara file biasa dan chunk store (chunk_store.py):
+  chunked  isi setiap file dipotong menjadi chunk, file diganti manifest
+  plain    setiap manifest diganti lagi dengan isi file lengkap
+  gc       hapus chunk yang tidak dipakai manifest manapun
+
+* jalankan saat server mati. Setiap file diganti dengan os.replace, jadi kalau
+terhenti di tengah jalan, jalankan lagi perintah yang sama untuk menyelesaikannya
+(file yang sudah diubah dikenali dan dilewati)
+
+usage: python3 migrate-store.py [chunked|plain|gc] [root]
+"""
+
+
+def to_chunked(root):
+    layout = load_layout(root)
+    store = ChunkStore(root)
+    converted = 0
+    for name, path in list(layout.files()):
+        if is_manifest(path):
+            continue
+        with open(path, 'rb') as f, store.writer(path) as w:
+            for data in iter(lambda: f.read(1024 * 1024), b''):
+                w.write(data)
+        converted += 1
+    save_store(root, True)
+    stats = store.stats()
+    logging.info(f"Converted {converted} files into {stats['chunks_written']} chunks "
+                 f"({stats['bytes_deduplicated']} of {stats['bytes_written'] + stats['bytes_deduplicated']} bytes deduplicated)")
+
+
+def to_plain(root):
+    layout = load_layout(root)
+    store = ChunkStore(root)
+    restored = 0
+    for name, path in list(layout.files()):
+        if not is_manifest(path):
+            continue
+        with AtomicWriter(path) as f:
+            for data in store.iter_content(path):
+                f.write(data)
+        restored += 1
+    save_store(root, False)
+    removed = store.collect_garbage([])
+    logging.info(f"Restored {restored} files, removed {removed} chunks")
+
+
+def collect_garbage(root):
+    store = load_store(root)
+    if store is None:
+        logging.info(f"{root} does not use the chunk store")
+        return
+    manifests = [path for name, path in load_layout(root).files() if is_manifest(path)]
+    removed = store.collect_garbage(manifests)
+    logging.info(f"Removed {removed} unreferenced chunks")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else ''
+    root = sys.argv[2] if len(sys.argv) > 2 else 'files/'
+    actions = dict(chunked=to_chunked, plain=to_plain, gc=collect_garbage)
+    if action not in actions:
+        print("usage: python3 migrate-store.py [chunked|plain|gc] [root]")
+        sys.exit(1)
+    actions[action](root)
+
+if __name__ == "__main__":
+    main()
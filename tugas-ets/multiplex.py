@@ -0,0 +1,315 @@
+import asyncio
+import threading
+
+from protocol_v2 import (ClientConnection, ProtocolError, read_frame, pack_frame,
+                         MULTIPLEXED_VERSION, FLAG_MORE, OP_RESPONSE, OP_DATA, OP_WINDOW_UPDATE)
+from transfer import send_buffers
+
+MAX_DATA_FRAME_SIZE = 64 * 1024 # body bytes per DATA frame, bounds how long other streams wait for the socket
+INITIAL_STREAM_WINDOW = 256 * 1024 # DATA bytes one stream may send before the client grants more
+INITIAL_CONNECTION_WINDOW = 1024 * 1024 # the same for all streams of a connection together
+MAX_WINDOW = 2 ** 31 - 1
+MAX_CONCURRENT_STREAMS = 8 # requests answered at once per connection, more are refused
+
+"""
+* protokol v3 (HELLO 3): frame sama dengan v2 (protocol_v2.py), tetapi satu
+koneksi membawa banyak request sekaligus. Client boleh mengirim request baru
+tanpa menunggu jawaban sebelumnya, setiap request (stream, dikenali dari
+request id) dijawab di thread/task sendiri, jadi jawaban bisa datang tidak
+berurutan. Request ke-MAX_CONCURRENT_STREAMS+1 langsung dijawab ERROR
+
+* jawaban: frame RESPONSE berisi metadata tanpa payload (FLAG_MORE kalau ada
+body), lalu body sebagai frame DATA berukuran maksimal MAX_DATA_FRAME_SIZE.
+Frame DATA dari beberapa stream bergantian di socket yang sama, frame DATA
+terakhir sebuah stream tidak memakai FLAG_MORE (metadatanya dict ERROR kalau
+body terputus di tengah jalan)
+
+* flow control: payload DATA yang dikirim server dibatasi window stream dan
+window koneksi. Client menambah window dengan frame WINDOW_UPDATE (request id
+0 untuk koneksi, metadata = jumlah byte) setelah datanya diproses, jadi
+client yang lambat menahan server, bukan memenuhi memory/socket buffer
+
+* frame RESPONSE tidak dibatasi window dan didahulukan di atas frame DATA
+yang menunggu giliran menulis ke socket, jadi LIST/STAT tetap cepat
+walaupun ada GET 100MB yang sedang berjalan di koneksi yang sama
+
+* upload_stream tetap seperti v2: payload langsung setelah frame request,
+dibaca oleh pembaca koneksi sebelum frame berikutnya
+"""
+
+
+def _check_increment(increment):
+    if not isinstance(increment, int) or increment <= 0 or increment > MAX_WINDOW:
+        raise ProtocolError(f"invalid window increment {increment!r}")
+
+
+class MuxStream:
+    """
+    Socket-like body of one stream for the streaming functions of client_handler:
+    sendall/sendmsg/sendfile turn into flow-controlled DATA frames
+    """
+    def __init__(self, mux, request_id):
+        self.mux = mux
+        self.request_id = request_id
+        self.window = INITIAL_STREAM_WINDOW
+
+    def _frame_header(self, length):
+        return pack_frame(OP_DATA, self.request_id, None, length, FLAG_MORE)
+
+    def sendall(self, data):
+        self.sendmsg([data])
+
+    def sendmsg(self, buffers):
+        # several small buffers (cached files, tar headers) share one DATA frame
+        views = [memoryview(b) for b in buffers if len(b)]
+        sent_bytes = 0
+        while views:
+            n = self.mux.reserve(self, sum(len(view) for view in views))
+            parts = []
+            left = n
+            while left:
+                view = views[0]
+                take = min(left, len(view))
+                parts.append(view[:take])
+                if take == len(view):
+                    views.pop(0)
+                else:
+                    views[0] = view[take:]
+                left -= take
+            self.mux.send([self._frame_header(n)] + parts)
+            sent_bytes += n
+        return sent_bytes
+
+    def sendfile(self, f, offset, count):
+        sent_bytes = 0
+        while sent_bytes < count:
+            n = self.mux.reserve(self, count - sent_bytes)
+            self.mux.send_file(self._frame_header(n), f, offset + sent_bytes, n)
+            sent_bytes += n
+        return sent_bytes
+
+    def finish(self, error=None):
+        """Last, empty DATA frame of the body, error is a dict when the body is incomplete"""
+        self.mux.send([pack_frame(OP_DATA, self.request_id, error)], urgent=True)
+
+
+class MuxConnection:
+    """Write side of a v3 connection, shared by the threads answering its streams"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.condition = threading.Condition()
+        self.window = INITIAL_CONNECTION_WINDOW
+        self.streams = {} # request id -> MuxStream
+        self.writing = False
+        self.urgent_waiting = 0
+        self.closed = False
+
+    def open_stream(self, request_id):
+        with self.condition:
+            if request_id in self.streams:
+                raise ProtocolError(f"request id {request_id} is already in use")
+            stream = MuxStream(self, request_id)
+            self.streams[request_id] = stream
+            return stream
+
+    def close_stream(self, stream):
+        with self.condition:
+            self.streams.pop(stream.request_id, None)
+
+    def active_streams(self):
+        with self.condition:
+            return len(self.streams)
+
+    def window_update(self, request_id, increment):
+        _check_increment(increment)
+        with self.condition:
+            if request_id == 0:
+                self.window = min(MAX_WINDOW, self.window + increment)
+            elif request_id in self.streams:
+                stream = self.streams[request_id]
+                stream.window = min(MAX_WINDOW, stream.window + increment)
+            self.condition.notify_all()
+
+    def reserve(self, stream, wanted):
+        """Wait until stream may send DATA, returns how many bytes (at most wanted) it may send now"""
+        with self.condition:
+            while not self.closed and (self.window <= 0 or stream.window <= 0):
+                self.condition.wait()
+            if self.closed:
+                raise BrokenPipeError("multiplexed connection closed")
+            n = min(wanted, self.window, stream.window, MAX_DATA_FRAME_SIZE)
+            self.window -= n
+            stream.window -= n
+            return n
+
+    def _begin_write(self, urgent):
+        # One frame at a time on the socket, urgent (RESPONSE) frames go before waiting DATA frames
+        with self.condition:
+            if urgent:
+                self.urgent_waiting += 1
+            try:
+                while not self.closed and (self.writing or (not urgent and self.urgent_waiting)):
+                    self.condition.wait()
+            finally:
+                if urgent:
+                    self.urgent_waiting -= 1
+            if self.closed:
+                raise BrokenPipeError("multiplexed connection closed")
+            self.writing = True
+
+    def _end_write(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+    def send(self, buffers, urgent=False):
+        """Write one whole frame (header, metadata and payload buffers)"""
+        self._begin_write(urgent)
+        try:
+            send_buffers(self.connection, buffers)
+        except BaseException:
+            # part of a frame may be out, nothing after it can be understood
+            self.close()
+            raise
+        finally:
+            self._end_write()
+
+    def send_file(self, frame_header, f, offset, count):
+        """Write one DATA frame whose payload is count bytes of f, sent with sendfile"""
+        self._begin_write(False)
+        try:
+            self.connection.sendall(frame_header)
+            if self.connection.sendfile(f, offset, count) < count:
+                raise BrokenPipeError(f"file ended inside a DATA frame of {count} bytes")
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            self._end_write()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class AsyncMuxStream:
+    """
+    Writer-like body of one stream for the streaming coroutines of asyncio_server:
+    write() queues, drain() sends the queue as flow-controlled DATA frames
+    """
+    def __init__(self, mux, request_id):
+        self.mux = mux
+        self.request_id = request_id
+        self.window = INITIAL_STREAM_WINDOW
+        self.pending = []
+
+    def write(self, data):
+        if len(data):
+            self.pending.append(memoryview(data))
+
+    async def drain(self):
+        while self.pending:
+            view = self.pending[0]
+            n = await self.mux.reserve(self, len(view))
+            # one write() per frame, so frames of other streams never end up inside it
+            self.mux.writer.write(pack_frame(OP_DATA, self.request_id, None, n, FLAG_MORE) + view[:n])
+            if n == len(view):
+                self.pending.pop(0)
+            else:
+                self.pending[0] = view[n:]
+            await self.mux.writer.drain()
+
+    async def finish(self, error=None):
+        self.mux.writer.write(pack_frame(OP_DATA, self.request_id, error))
+        await self.mux.writer.drain()
+
+
+class AsyncMuxConnection:
+    """Write side of a v3 connection in asyncio_server, shared by the tasks answering its streams"""
+    def __init__(self, writer):
+        self.writer = writer
+        self.condition = asyncio.Condition()
+        self.window = INITIAL_CONNECTION_WINDOW
+        self.streams = {} # request id -> AsyncMuxStream
+        self.closed = False
+
+    def open_stream(self, request_id):
+        if request_id in self.streams:
+            raise ProtocolError(f"request id {request_id} is already in use")
+        stream = AsyncMuxStream(self, request_id)
+        self.streams[request_id] = stream
+        return stream
+
+    def close_stream(self, stream):
+        self.streams.pop(stream.request_id, None)
+
+    async def window_update(self, request_id, increment):
+        _check_increment(increment)
+        async with self.condition:
+            if request_id == 0:
+                self.window = min(MAX_WINDOW, self.window + increment)
+            elif request_id in self.streams:
+                stream = self.streams[request_id]
+                stream.window = min(MAX_WINDOW, stream.window + increment)
+            self.condition.notify_all()
+
+    async def reserve(self, stream, wanted):
+        async with self.condition:
+            while not self.closed and (self.window <= 0 or stream.window <= 0):
+                await self.condition.wait()
+            if self.closed:
+                raise BrokenPipeError("multiplexed connection closed")
+            n = min(wanted, self.window, stream.window, MAX_DATA_FRAME_SIZE)
+            self.window -= n
+            stream.window -= n
+            return n
+
+    async def close(self):
+        async with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class MuxClient(ClientConnection):
+    """
+    Blocking v3 client: send_request() as often as needed, then responses()
+    yields (request_id, metadata, body) as each stream completes, granting
+    window back as the data is read
+    """
+    version = MULTIPLEXED_VERSION
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unacknowledged = {0: 0} # request id (0 = connection) -> bytes read but not granted back
+
+    def _consumed(self, request_id, n):
+        for key, window in ((request_id, INITIAL_STREAM_WINDOW), (0, INITIAL_CONNECTION_WINDOW)):
+            self.unacknowledged[key] = self.unacknowledged.get(key, 0) + n
+            if self.unacknowledged[key] >= window // 2:
+                self.sock.sendall(pack_frame(OP_WINDOW_UPDATE, key, self.unacknowledged[key]))
+                self.unacknowledged[key] = 0
+
+    def responses(self, count):
+        """Read until count streams completed, yielding each as (request_id, metadata, body)"""
+        metadata = {}
+        bodies = {}
+        while count:
+            frame = read_frame(self.reader)
+            if frame is None:
+                raise ProtocolError("connection closed with streams in progress")
+            if frame.opcode == OP_RESPONSE:
+                metadata[frame.request_id] = frame.header
+                bodies[frame.request_id] = []
+            elif frame.opcode != OP_DATA or frame.request_id not in bodies:
+                raise ProtocolError(f"unexpected frame {frame.opcode:#x} for request {frame.request_id}")
+            if frame.payload_length:
+                bodies[frame.request_id].append(self.read_payload(frame.payload_length))
+                self._consumed(frame.request_id, frame.payload_length)
+            if frame.flags & FLAG_MORE:
+                continue
+            if frame.opcode == OP_DATA and frame.header is not None:
+                metadata[frame.request_id] = frame.header # the body broke off
+            self.unacknowledged.pop(frame.request_id, None)
+            count -= 1
+            yield frame.request_id, metadata.pop(frame.request_id), b''.join(bodies.pop(frame.request_id))
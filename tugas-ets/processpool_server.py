@@ -6,119 +6,30 @@ import time
 import sys
 import multiprocessing
 import signal
-import json # Added for parsing the response from FileProtocol
-import os   # Added for joining paths
-from concurrent.futures import ProcessPoolExecutor
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from file_protocol import FileProtocol
-fp = FileProtocol()
+from client_handler import ProcessTheClient, load_stats, use_shared_cache, use_fsync_policy, use_admission_stats, use_lanes, use_shaping
+from shared_cache import SharedFileCache
+from admission import AdmissionControl, DEFAULT_BACKLOG, DEFAULT_MAX_QUEUED
+from lanes import DEFAULT_META_SHARE
+from shaping import parse_rate
 
 running = True
-STREAM_BUFFER_SIZE = 65536 # 64KB, tune as needed
+LOAD_REPORT_INTERVAL = 0.05 # seconds, how often a dispatch worker may report its load
+LOAD_LOG_INTERVAL = 10 # seconds between per-worker load log lines of the dispatcher
 
-def ProcessTheClient(connection, address):
-    logging.warning(f"Handling connection from {address}")
-    data_received = ""
-    file_to_stream_path = None
-    file_to_stream_size = 0
+def init_pool_worker(shared_cache, admission_stats):
+    """Process pool initializer: shared GET cache, and the accepting process' admission counters for STATS"""
+    use_shared_cache(shared_cache)
+    use_admission_stats(admission_stats)
 
-    try:
-        initial_command_received = False
-        # Stage 1: Receive the client's command and send metadata response
-        while not initial_command_received:
-            data = connection.recv(1024 * 1024) # Buffer for the command string
-            if data:
-                d = data.decode()
-                data_received += d
-                if data_received.endswith("\r\n\r\n"): # Standard command terminator
-                    command_to_process = data_received[:-4].strip() # Get the actual command
-                    data_received = "" # Reset
-                    initial_command_received = True
-
-                    # Get the JSON response string from FileProtocol
-                    json_response_string = fp.proses_string(command_to_process)
-                    
-                    # Send this JSON response (metadata) to the client
-                    connection.sendall(json_response_string.encode() + b"\r\n\r\n")
-
-                    # Now, check if this was a GET command that requires file streaming
-                    try:
-                        response_dict = json.loads(json_response_string)
-                        if command_to_process.upper().startswith("GET") and response_dict.get('status') == 'OK_STREAM':
-                            filename_to_stream = response_dict.get('data_namafile')
-                            file_to_stream_size = response_dict.get('data_filesize')
-
-                            if filename_to_stream and isinstance(file_to_stream_size, int):
-                                # Construct the full path to the file on the server
-                                # fp.file.file_path is 'files/' from FileInterface
-                                file_to_stream_path = os.path.join(fp.file.file_path, os.path.basename(filename_to_stream))
-                                logging.info(f"Server: Preparing to stream {file_to_stream_path} ({file_to_stream_size} bytes) for {address}")
-                            else:
-                                logging.error(f"Server: Invalid metadata for streaming to {address}. Filename: {filename_to_stream}, Size: {file_to_stream_size}")
-                                file_to_stream_path = None # Prevent streaming attempt
-                        elif response_dict.get('status') != 'OK_STREAM' and command_to_process.upper().startswith("GET"):
-                             logging.info(f"Server: GET for {address} resulted in status {response_dict.get('status')}, no file streaming.")
-
-
-                    except json.JSONDecodeError as je:
-                        logging.error(f"Server: Could not parse FileProtocol response as JSON: {je}")
-                        file_to_stream_path = None # Safety
-            else:
-                # No data from client, or client closed connection
-                logging.warning(f"Server: No command data received from {address}, closing.")
-                return # Exit
-
-        # Stage 2: Stream the raw file data if everything is set for it
-        if file_to_stream_path and os.path.exists(file_to_stream_path) and file_to_stream_size >= 0:
-            logging.warning(f"Server: Starting stream of {file_to_stream_path} ({file_to_stream_size} bytes) to {address}")
-            sent_bytes = 0
-            try:
-                with open(file_to_stream_path, 'rb') as f:
-                    while sent_bytes < file_to_stream_size:
-                        # For zero-byte files, this loop won't run, which is correct.
-                        # f.read() will return b'' if at EOF.
-                        try:
-                            chunk = f.read(STREAM_BUFFER_SIZE)
-                            if not chunk:
-                                # This might happen if file size changed or was read incorrectly
-                                logging.warning(f"Server: File ended prematurely while streaming {file_to_stream_path} to {address}. Expected {file_to_stream_size}, sent {sent_bytes}.")
-                                break
-                            connection.sendall(chunk)
-                            sent_bytes += len(chunk)
-                        except BrokenPipeError:
-                            logging.warning(f"Server: Broken pipe while streaming {file_to_stream_path} to {address}. Client likely disconnected.")
-                            break
-                        except ConnectionResetError:
-                            logging.warning(f"Server: Connection reset while streaming {file_to_stream_path} to {address}. Client likely disconnected.")
-                            break
-                        except socket.error as se:
-                            logging.error(f"Server: Socket error while streaming {file_to_stream_path} to {address}: {se}")
-                            break
-                    
-                if sent_bytes == file_to_stream_size:
-                    logging.info(f"Server: Successfully streamed {sent_bytes} bytes for {file_to_stream_path} to {address}.")
-                else:
-                    logging.warning(f"Server: Streaming finished for {file_to_stream_path}. Sent {sent_bytes}/{file_to_stream_size} bytes to {address}.")
-            except Exception as e:
-                logging.error(f"Server: Error during file streaming of {file_to_stream_path} to {address}: {e}")
-        elif file_to_stream_path: # Path was set, but file not found or size is invalid
-            logging.error(f"Server: File {file_to_stream_path} not found or invalid size for streaming to {address}, although metadata was OK_STREAM.")
-
-    except socket.timeout:
-        logging.error(f"Socket timeout with {address}")
-    except ConnectionResetError:
-        logging.warning(f"Connection reset by {address}")
-    except BrokenPipeError: # Client disconnected
-        logging.warning(f"Broken pipe with {address}, client likely disconnected during streaming.")
-    except Exception as e:
-        logging.error(f"Error handling client {address}: {str(e)}")
-    finally:
-        logging.warning(f"Closing connection from {address}")
-        connection.close()
 class Server(multiprocessing.Process):
-    def __init__(self, ipaddress='0.0.0.0', port=8889, max_workers=10):
+    def __init__(self, ipaddress='0.0.0.0', port=8889, max_workers=10, backlog=DEFAULT_BACKLOG, max_queued=DEFAULT_MAX_QUEUED):
         self.ipinfo = (ipaddress, port)
         self.max_workers = max_workers
+        self.backlog = backlog
+        self.max_queued = max_queued
         self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.running = True  # Local running flag
@@ -139,25 +50,30 @@ class Server(multiprocessing.Process):
     
     def run(self):
         global running
-        logging.warning(f"Server starting on {self.ipinfo} with {self.max_workers} workers")
+        logging.warning(f"Server starting on {self.ipinfo} with {self.max_workers} workers, {self.max_queued} queued connections, backlog {self.backlog}")
+        # One copy of the hot files for all workers instead of one cache per worker
+        shared_cache = SharedFileCache()
+        # connections beyond max_workers + max_queued are answered BUSY, see admission.py
+        admission = AdmissionControl(self.max_workers, self.max_queued)
         try:
             self.my_socket.bind(self.ipinfo)
-            self.my_socket.listen(64)
+            self.my_socket.listen(self.backlog)
             
             # Set a timeout so we can check running flag periodically
             self.my_socket.settimeout(1.0)
             
             # create process pool
-            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_pool_worker, initargs=(shared_cache, admission.stats)) as executor:
                 while running and self.running:
                     try:
                         connection, client_address = self.my_socket.accept()
                         logging.warning(f"connection from {client_address}")
                         
-                        # Submit the client connection to the process pool
-                        executor.submit(ProcessTheClient, connection, client_address)
+                        # Submit the client connection to the process pool, unless too many are waiting
+                        admission.submit(executor, ProcessTheClient, connection, client_address)
                     except socket.timeout:
                         # This allows us to check the running flag periodically
+                        admission.sweep()
                         continue
                     except Exception as e:
                         logging.error(f"Error accepting connection: {str(e)}")
@@ -169,6 +85,284 @@ class Server(multiprocessing.Process):
             logging.error(f"Error in server: {e}")
         finally:
             self.my_socket.close()
+            admission.close()
+            shared_cache.close(unlink=True)
+            logging.warning("Server socket closed")
+
+class PreforkWorker(multiprocessing.Process):
+    """
+    Long-lived worker process with its own SO_REUSEPORT listener on the shared
+    port. The kernel spreads incoming connections over all workers' listeners,
+    and each worker serves its connections with a local thread pool, so no
+    socket ever has to be passed between processes.
+    """
+    def __init__(self, worker_id, ipinfo, threads_per_worker, stop_event, shared_cache=None, backlog=DEFAULT_BACKLOG, max_queued=DEFAULT_MAX_QUEUED):
+        self.worker_id = worker_id
+        self.ipinfo = ipinfo
+        self.threads_per_worker = threads_per_worker
+        self.stop_event = stop_event
+        self.shared_cache = shared_cache
+        self.backlog = backlog
+        self.max_queued = max_queued
+        multiprocessing.Process.__init__(self)
+
+    def run(self):
+        if self.shared_cache is not None:
+            use_shared_cache(self.shared_cache)
+        admission = AdmissionControl(self.threads_per_worker, self.max_queued)
+        use_admission_stats(admission.stats)
+        my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            my_socket.bind(self.ipinfo)
+            my_socket.listen(self.backlog)
+            my_socket.settimeout(1.0)
+            logging.warning(f"Prefork worker {self.worker_id} (pid {self.pid}) listening on {self.ipinfo} with {self.threads_per_worker} threads")
+
+            with ThreadPoolExecutor(max_workers=self.threads_per_worker) as executor:
+                while running and not self.stop_event.is_set():
+                    try:
+                        connection, client_address = my_socket.accept()
+                        logging.warning(f"worker {self.worker_id}: connection from {client_address}")
+                        admission.submit(executor, ProcessTheClient, connection, client_address)
+                    except socket.timeout:
+                        admission.sweep()
+                        continue
+                    except Exception as e:
+                        logging.error(f"worker {self.worker_id}: Error accepting connection: {str(e)}")
+        except Exception as e:
+            logging.error(f"worker {self.worker_id}: Error in server: {e}")
+        finally:
+            my_socket.close()
+            admission.close()
+            logging.warning(f"Prefork worker {self.worker_id} stopped")
+
+class PreforkServer:
+    def __init__(self, ipaddress='0.0.0.0', port=8889, num_workers=4, threads_per_worker=10, backlog=DEFAULT_BACKLOG, max_queued=DEFAULT_MAX_QUEUED):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform, use the process pool mode")
+        self.ipinfo = (ipaddress, port)
+        self.stop_event = multiprocessing.Event()
+        self.shared_cache = SharedFileCache()
+        # backlog and max_queued apply to every worker's own listener and thread pool
+        self.workers = [PreforkWorker(i, self.ipinfo, threads_per_worker, self.stop_event, self.shared_cache, backlog, max_queued) for i in range(num_workers)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """Method to gracefully stop the server"""
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        for worker in self.workers:
+            worker.join(timeout=timeout)
+        self.shared_cache.close(unlink=True)
+
+class DispatchWorker(multiprocessing.Process):
+    """
+    Long-lived worker that receives accepted sockets from the dispatcher over a
+    Unix socket (SCM_RIGHTS) and reports its load back on the same channel.
+    """
+    def __init__(self, worker_id, channel, threads_per_worker, shared_cache=None, max_queued=DEFAULT_MAX_QUEUED, inherited=()):
+        self.worker_id = worker_id
+        self.channel = channel
+        self.inherited = inherited # channel ends of the dispatcher and the other workers, closed at start
+        self.threads_per_worker = threads_per_worker
+        self.shared_cache = shared_cache
+        self.max_queued = max_queued
+        self.received = 0 # connections taken off the channel, so every hand-off is acknowledged
+        multiprocessing.Process.__init__(self)
+
+    def report_load(self):
+        last_report = None
+        while True:
+            # Report right after a change, but at most every LOAD_REPORT_INTERVAL
+            load_stats.changed.wait()
+            load_stats.changed.clear()
+            report = dict(load_stats.snapshot(), received=self.received)
+            if report != last_report:
+                self.channel.sendall(json.dumps(report).encode() + b"\n")
+                last_report = report
+            time.sleep(LOAD_REPORT_INTERVAL)
+
+    def run(self):
+        logging.warning(f"Dispatch worker {self.worker_id} (pid {self.pid}) started with {self.threads_per_worker} threads")
+        # Only this worker may hold its channel end, so the dispatcher sees EOF when it dies
+        for end in self.inherited:
+            end.close()
+        if self.shared_cache is not None:
+            use_shared_cache(self.shared_cache)
+        admission = AdmissionControl(self.threads_per_worker, self.max_queued)
+        use_admission_stats(admission.stats)
+        threading.Thread(target=self.report_load, daemon=True).start()
+        # Timeout so we can check running flag periodically
+        self.channel.settimeout(1.0)
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads_per_worker) as executor:
+                while running:
+                    try:
+                        msg, fds, flags, addr = socket.recv_fds(self.channel, 16, 1)
+                    except socket.timeout:
+                        admission.sweep()
+                        continue
+                    if not msg:
+                        break # dispatcher closed the channel
+                    for fd in fds:
+                        self.received += 1
+                        load_stats.changed.set()
+                        connection = socket.socket(fileno=fd)
+                        try:
+                            address = connection.getpeername()
+                        except OSError as e:
+                            # The client reset before the hand-off, only this connection is lost
+                            logging.warning(f"Dispatch worker {self.worker_id}: dropping a connection that is already gone: {e}")
+                            connection.close()
+                            continue
+                        admission.submit(executor, ProcessTheClient, connection, address)
+        except Exception as e:
+            logging.error(f"Dispatch worker {self.worker_id}: {e}")
+        finally:
+            self.channel.close()
+            admission.close()
+            logging.warning(f"Dispatch worker {self.worker_id} stopped")
+
+class DispatchServer(threading.Thread):
+    """
+    Accepts in this process and hands every connection to the persistent worker
+    with the least work in flight: fewest bytes still to transfer (policy 'bytes')
+    or fewest open connections (policy 'connections').
+    """
+    def __init__(self, ipaddress='0.0.0.0', port=8889, num_workers=4, threads_per_worker=10, policy='bytes', backlog=DEFAULT_BACKLOG, max_queued=DEFAULT_MAX_QUEUED):
+        self.ipinfo = (ipaddress, port)
+        self.policy = policy
+        self.backlog = backlog
+        self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.running = True
+        self.workers = []
+        self.loads = []
+        self.loads_lock = threading.Lock()
+        self.shared_cache = SharedFileCache()
+        self.channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM) for i in range(num_workers)]
+        for i, (parent_end, child_end) in enumerate(self.channels):
+            inherited = [end for pair in self.channels for end in pair if end is not child_end]
+            # every worker bounds its own queue, see admission.py
+            self.workers.append(DispatchWorker(i, child_end, threads_per_worker, self.shared_cache, max_queued, inherited))
+            # dispatched - received = connections handed over that the worker hasn't taken yet
+            self.loads.append(dict(connections=0, bytes=0, dispatched=0, received=0, alive=True))
+        threading.Thread.__init__(self)
+
+    def start(self):
+        for i, worker in enumerate(self.workers):
+            worker.start()
+            parent_end, child_end = self.channels[i]
+            child_end.close()
+            threading.Thread(target=self.read_reports, args=(i, parent_end), daemon=True).start()
+        threading.Thread.start(self)
+
+    def read_reports(self, worker_id, channel):
+        try:
+            for line in channel.makefile('rb'):
+                report = json.loads(line)
+                with self.loads_lock:
+                    self.loads[worker_id].update(report)
+        except (OSError, ValueError) as e:
+            logging.error(f"Lost the load reports of worker {worker_id}: {e}")
+        if self.running:
+            # The channel only closes when the worker is gone
+            self.drop_worker(worker_id)
+
+    def drop_worker(self, worker_id):
+        """Take a worker that can't receive connections any more out of the rotation"""
+        with self.loads_lock:
+            if not self.loads[worker_id]['alive']:
+                return
+            self.loads[worker_id]['alive'] = False
+            remaining = sum(load['alive'] for load in self.loads)
+        logging.error(f"Dispatch worker {worker_id} is gone, {remaining} workers left")
+
+    def load_snapshot(self):
+        """Per-worker load as last reported, for logging/monitoring"""
+        with self.loads_lock:
+            return [dict(worker=i, pending=self.pending(i), **load) for i, load in enumerate(self.loads)]
+
+    def pending(self, worker_id):
+        # Caller holds loads_lock
+        load = self.loads[worker_id]
+        return load['dispatched'] - load['received']
+
+    def pick_worker(self):
+        """Least loaded live worker, None when every worker is gone"""
+        with self.loads_lock:
+            if self.policy == 'connections':
+                key = lambda i: (self.loads[i]['connections'] + self.pending(i), self.loads[i]['bytes'])
+            else:
+                key = lambda i: (self.loads[i]['bytes'], self.loads[i]['connections'] + self.pending(i))
+            alive = [i for i, load in enumerate(self.loads) if load['alive']]
+            if not alive:
+                return None
+            worker_id = min(alive, key=key)
+            self.loads[worker_id]['dispatched'] += 1
+            return worker_id
+
+    def stop(self):
+        """Method to gracefully stop the server"""
+        global running
+        running = False
+        self.running = False
+
+    def join(self, timeout=None):
+        threading.Thread.join(self, timeout=timeout)
+        for worker in self.workers:
+            worker.join(timeout=timeout)
+        self.shared_cache.close(unlink=True)
+
+    def dispatch(self, connection, client_address):
+        """Hand connection to the least loaded worker, a worker that can't take it is dropped and the next one tried"""
+        while True:
+            worker_id = self.pick_worker()
+            if worker_id is None:
+                logging.error(f"No dispatch worker left for {client_address}, closing")
+                return
+            logging.warning(f"connection from {client_address} -> worker {worker_id}")
+            try:
+                socket.send_fds(self.channels[worker_id][0], [b"C"], [connection.fileno()])
+                return
+            except OSError as e:
+                logging.error(f"Error passing connection to worker {worker_id}: {e}")
+                self.drop_worker(worker_id)
+
+    def run(self):
+        global running
+        logging.warning(f"Dispatcher starting on {self.ipinfo} with {len(self.workers)} workers, policy {self.policy}")
+        last_log = time.time()
+        try:
+            self.my_socket.bind(self.ipinfo)
+            self.my_socket.listen(self.backlog)
+            self.my_socket.settimeout(1.0)
+            while running and self.running:
+                if time.time() - last_log >= LOAD_LOG_INTERVAL:
+                    logging.warning(f"Dispatcher worker load: {self.load_snapshot()}")
+                    last_log = time.time()
+                try:
+                    connection, client_address = self.my_socket.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    self.dispatch(connection, client_address)
+                finally:
+                    # The worker holds its own duplicate of the descriptor now
+                    connection.close()
+            logging.warning("Dispatcher loop ended")
+        except Exception as e:
+            logging.error(f"Error in dispatcher: {e}")
+        finally:
+            self.my_socket.close()
+            for parent_end, child_end in self.channels:
+                parent_end.close()
             logging.warning("Server socket closed")
 
 # Signal handler for keyboard interrupt
@@ -181,9 +375,45 @@ def main():
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     
-    # server with user-defined worker count
-    process_worker = int(input("Enter number of processes to handle clients (default 10): ") or "10")
-    svr = Server(ipaddress='0.0.0.0', port=6666, max_workers=process_worker)
+    mode = input("Enter server mode (pool/prefork/dispatch, default pool): ").strip().lower() or "pool"
+    if mode == 'dispatch':
+        # one accepting process passing sockets to persistent workers by load
+        process_worker = int(input(f"Enter number of worker processes (default {multiprocessing.cpu_count()}): ") or multiprocessing.cpu_count())
+        thread_worker = int(input("Enter number of threads per worker process (default 10): ") or "10")
+        policy = input("Balance by (bytes/connections, default bytes): ").strip().lower() or "bytes"
+    elif mode == 'prefork':
+        # N accepting processes sharing port 6666 through SO_REUSEPORT
+        process_worker = int(input(f"Enter number of worker processes (default {multiprocessing.cpu_count()}): ") or multiprocessing.cpu_count())
+        thread_worker = int(input("Enter number of threads per worker process (default 10): ") or "10")
+    else:
+        # server with user-defined worker count
+        process_worker = int(input("Enter number of processes to handle clients (default 10): ") or "10")
+    # set before the workers are forked, they inherit it
+    use_fsync_policy(input("Enter upload fsync policy (none/file/group, default group): ").strip().lower() or "group")
+    # per worker process in prefork/dispatch mode
+    max_queued = int(input(f"Enter max queued connections before BUSY (default {DEFAULT_MAX_QUEUED}): ") or DEFAULT_MAX_QUEUED)
+    backlog = int(input(f"Enter listen backlog (default {DEFAULT_BACKLOG}): ") or DEFAULT_BACKLOG)
+    if mode in ('dispatch', 'prefork'):
+        # per worker process, inherited like the fsync policy
+        lanes = use_lanes(thread_worker,
+                          int(input(f"Enter metadata lane workers per process (default {max(1, thread_worker // DEFAULT_META_SHARE)}): ") or 0),
+                          int(input("Enter bulk transfer lane workers per process (default the remaining threads): ") or 0))
+    else:
+        # a pool process serves one connection at a time, so the lanes are shared by the whole pool
+        lanes = use_lanes(process_worker,
+                          int(input(f"Enter metadata lane processes (default {max(1, process_worker // DEFAULT_META_SHARE)}): ") or 0),
+                          int(input("Enter bulk transfer lane processes (default the remaining processes): ") or 0),
+                          shared=True)
+    logging.warning(f"Request lanes: {lanes.snapshot()}")
+    # bandwidth limits shared by all worker processes, changeable while running with SHAPE
+    use_shaping(parse_rate(input("Enter global bandwidth limit in bytes/s, e.g. 100M (default unlimited): ")),
+                parse_rate(input("Enter per-client bandwidth limit in bytes/s (default unlimited): ")))
+    if mode == 'dispatch':
+        svr = DispatchServer(ipaddress='0.0.0.0', port=6666, num_workers=process_worker, threads_per_worker=thread_worker, policy=policy, backlog=backlog, max_queued=max_queued)
+    elif mode == 'prefork':
+        svr = PreforkServer(ipaddress='0.0.0.0', port=6666, num_workers=process_worker, threads_per_worker=thread_worker, backlog=backlog, max_queued=max_queued)
+    else:
+        svr = Server(ipaddress='0.0.0.0', port=6666, max_workers=process_worker, backlog=backlog, max_queued=max_queued)
     svr.start()
 
     try:
@@ -194,7 +424,7 @@ def main():
         # Signal the server to stop
         svr.stop()
         
-        # Wait for the server process to finish
+        # Wait for the server process(es) to finish
         svr.join(timeout=5)
         logging.warning("Server shutdown completed.")
     except Exception as e:
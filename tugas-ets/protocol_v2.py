@@ -0,0 +1,293 @@
+import json
+import socket
+import struct
+
+from framing import RequestReader, REQUEST_DELIMITER
+
+PROTOCOL_VERSION = 2 # binary frames, v1 is the text/JSON protocol
+MULTIPLEXED_VERSION = 3 # the same frames, many requests at once on one connection, see multiplex.py
+FRAME_HEADER = struct.Struct('!BBIIQ') # opcode, flags, request id, header length, payload length
+MAX_FRAME_HEADER_SIZE = 1024 * 1024 # metadata of one frame, payloads have no limit
+
+FLAG_MORE = 0x01 # the body continues in DATA frames with the same request id
+
+OP_RESPONSE = 0x80
+OP_DATA = 0x81
+OP_WINDOW_UPDATE = 0x82 # v3 only, see multiplex.py
+
+# request opcodes and the FileInterface command each one runs
+OPCODES = {
+    0x01: 'list',
+    0x02: 'get',
+    0x03: 'upload_stream',
+    0x04: 'delete',
+    0x05: 'stat',
+    0x06: 'stats',
+    0x07: 'mget',
+    0x08: 'archive',
+    0x09: 'list_stream',
+    0x0A: 'shape',
+}
+COMMAND_OPCODES = {command: opcode for opcode, command in OPCODES.items()}
+
+"""
+* protokol v2: setiap pesan adalah frame dengan header biner berukuran tetap
+(18 byte, network byte order):
+
+  opcode          1 byte   command (OPCODES) atau OP_RESPONSE / OP_DATA
+  flags           1 byte   FLAG_MORE: body berlanjut di frame DATA berikutnya
+  request id      4 byte   dipilih client, dibalas dengan id yang sama
+  header length   4 byte   panjang metadata setelah header frame
+  payload length  8 byte   panjang bytes mentah setelah metadata
+
+  lalu metadata (encode_value, lihat di bawah) dan payload. Pembaca cukup
+  membaca 18 byte, lalu tahu persis berapa byte lagi milik frame ini, tidak
+  ada delimiter yang harus dicari dan payload tidak pernah di-escape
+
+* request: metadata berisi list parameter (string, nama file apa adanya,
+tidak di-lower-case), payload hanya dipakai upload_stream (isi file,
+payload length = ukuran file). Respons: frame OP_RESPONSE, metadata berisi
+dict yang sama dengan JSON v1, payload berisi body (isi file GET, MGET,
+ARCHIVE). Body yang panjangnya belum diketahui (LIST_STREAM) dikirim
+sebagai frame OP_DATA dengan FLAG_MORE, diakhiri frame DATA tanpa flag
+
+* metadata: setiap value diawali 1 byte tipe
+  N None, T True, F False, i int64, d float64,
+  s string (4 byte panjang + UTF-8), b bytes (4 byte panjang + isi),
+  l list (4 byte jumlah + value), m dict (4 byte jumlah + pasangan string/value)
+
+* handshake: client v2 mengirim command teks "HELLO 2\r\n\r\n" sebagai
+command pertama. Server menjawab JSON {"status": "OK", "version": 2} lalu
+koneksi memakai frame v2. Server lama menjawab "request tidak dikenali",
+client lalu tetap memakai v1. Client v1 tidak berubah sama sekali
+
+* "HELLO 3" meminta v3: frame yang sama, tetapi request dijawab bersamaan
+dan body dikirim sebagai frame DATA dengan flow control (multiplex.py).
+Server menjawab dengan versi tertinggi yang dimengerti kedua pihak
+"""
+
+_U32 = struct.Struct('!I')
+_I64 = struct.Struct('!q')
+_F64 = struct.Struct('!d')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _encode(value, out):
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i' + _I64.pack(value)
+    elif isinstance(value, float):
+        out += b'd' + _F64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8', 'surrogateescape')
+        out += b's' + _U32.pack(len(data)) + data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out += b'b' + _U32.pack(len(value)) + value
+    elif isinstance(value, (list, tuple)):
+        out += b'l' + _U32.pack(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out += b'm' + _U32.pack(len(value))
+        for key, item in value.items():
+            _encode(str(key), out)
+            _encode(item, out)
+    else:
+        raise TypeError(f"can't encode {type(value).__name__} in v2 metadata")
+
+
+def encode_value(value):
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+
+def _decode(data, pos):
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b'N':
+        return None, pos
+    if tag == b'T':
+        return True, pos
+    if tag == b'F':
+        return False, pos
+    if tag == b'i':
+        return _I64.unpack_from(data, pos)[0], pos + 8
+    if tag == b'd':
+        return _F64.unpack_from(data, pos)[0], pos + 8
+    if tag in (b's', b'b', b'l', b'm'):
+        n = _U32.unpack_from(data, pos)[0]
+        pos += 4
+        if tag == b's':
+            if pos + n > len(data):
+                raise ValueError("truncated string")
+            return bytes(data[pos:pos + n]).decode('utf-8', 'surrogateescape'), pos + n
+        if tag == b'b':
+            if pos + n > len(data):
+                raise ValueError("truncated bytes")
+            return bytes(data[pos:pos + n]), pos + n
+        if tag == b'l':
+            items = []
+            for _ in range(n):
+                item, pos = _decode(data, pos)
+                items.append(item)
+            return items, pos
+        result = {}
+        for _ in range(n):
+            key, pos = _decode(data, pos)
+            result[key], pos = _decode(data, pos)
+        return result, pos
+    raise ValueError(f"unknown metadata type {tag!r}")
+
+
+def decode_value(data):
+    """Inverse of encode_value, raises ProtocolError for malformed metadata"""
+    try:
+        value, pos = _decode(data, 0)
+    except (ValueError, struct.error, UnicodeDecodeError, TypeError) as e:
+        raise ProtocolError(f"malformed metadata: {e}")
+    if pos != len(data):
+        raise ProtocolError(f"{len(data) - pos} bytes after the metadata")
+    return value
+
+
+class Frame:
+    __slots__ = ('opcode', 'flags', 'request_id', 'header', 'payload_length')
+
+    def __init__(self, opcode, flags, request_id, header, payload_length):
+        self.opcode = opcode
+        self.flags = flags
+        self.request_id = request_id
+        self.header = header # decoded metadata, None when the frame has none
+        self.payload_length = payload_length
+
+
+def pack_frame(opcode, request_id, header=None, payload_length=0, flags=0):
+    """Frame header plus encoded metadata, the payload_length payload bytes have to follow"""
+    metadata = encode_value(header) if header is not None else b''
+    return FRAME_HEADER.pack(opcode, flags, request_id, len(metadata), payload_length) + metadata
+
+
+def unpack_frame_header(data):
+    """(opcode, flags, request_id, header_length, payload_length) of a FRAME_HEADER.size bytes header"""
+    fields = FRAME_HEADER.unpack(data)
+    if fields[3] > MAX_FRAME_HEADER_SIZE:
+        raise ProtocolError(f"frame metadata of {fields[3]} bytes exceeds {MAX_FRAME_HEADER_SIZE}")
+    return fields
+
+
+def read_frame(reader):
+    """
+    Next frame from a framing.RequestReader, its payload is left in the reader.
+    None when the connection closed cleanly between frames.
+    """
+    data = reader.read_exact(FRAME_HEADER.size)
+    if data is None:
+        if reader.buffer:
+            raise ProtocolError("connection closed in the middle of a frame header")
+        return None
+    opcode, flags, request_id, header_length, payload_length = unpack_frame_header(data)
+    header = None
+    if header_length:
+        metadata = reader.read_exact(header_length)
+        if metadata is None:
+            raise ProtocolError("connection closed in the middle of frame metadata")
+        header = decode_value(metadata)
+    return Frame(opcode, flags, request_id, header, payload_length)
+
+
+def handshake_response(params):
+    """Answer to 'HELLO <version>' (params = ['<version>']): the highest version both sides speak"""
+    try:
+        requested = int(params[0])
+    except (IndexError, ValueError):
+        return dict(status='ERROR', data='versi protokol tidak valid')
+    if requested < 1:
+        return dict(status='ERROR', data='versi protokol tidak valid')
+    return dict(status='OK', version=min(requested, MULTIPLEXED_VERSION))
+
+
+class ClientConnection:
+    """
+    Blocking v2 client for one connection: connect() does the handshake, call()
+    sends one request and returns (metadata, body bytes). Raises ProtocolError
+    when the server only speaks v1.
+    """
+    version = PROTOCOL_VERSION
+
+    def __init__(self, server_address=('localhost', 6666), timeout=120):
+        self.server_address = server_address
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.next_request_id = 1
+
+    def connect(self):
+        self.sock = socket.create_connection(self.server_address, timeout=self.timeout)
+        self.reader = RequestReader(self.sock)
+        self.sock.sendall(f"HELLO {self.version}".encode() + REQUEST_DELIMITER)
+        answer = self.reader.read_request()
+        if answer is None:
+            raise ProtocolError("connection closed during the handshake")
+        answer = json.loads(answer)
+        if answer.get('status') != 'OK' or answer.get('version') != self.version:
+            self.close()
+            raise ProtocolError(f"server does not speak protocol v{self.version}: {answer}")
+        return self
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def send_request(self, command, params=(), body_file=None, body_length=0):
+        """Send one request, body_file (opened 'rb') is sent as its payload. Returns the request id."""
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self.sock.sendall(pack_frame(COMMAND_OPCODES[command], request_id, list(params), body_length))
+        if body_file is not None and body_length:
+            self.sock.sendfile(body_file, 0, body_length)
+        return request_id
+
+    def read_payload(self, length):
+        data = self.reader.read_exact(length) if length else b''
+        if data is None:
+            raise ProtocolError("connection closed in the middle of a payload")
+        return data
+
+    def read_response(self):
+        """(metadata, body) of the next response, DATA frames of a continued body are joined"""
+        frame = read_frame(self.reader)
+        if frame is None or frame.opcode != OP_RESPONSE:
+            raise ProtocolError("expected a response frame")
+        metadata = frame.header
+        body = [self.read_payload(frame.payload_length)]
+        while frame.flags & FLAG_MORE:
+            frame = read_frame(self.reader)
+            if frame is None or frame.opcode != OP_DATA:
+                raise ProtocolError("expected a data frame")
+            body.append(self.read_payload(frame.payload_length))
+        return metadata, b''.join(body)
+
+    def call(self, command, *params):
+        self.send_request(command, params)
+        return self.read_response()
+
+    def upload(self, filename, f, size):
+        """Upload size bytes of f (opened 'rb') as filename"""
+        self.send_request('upload_stream', [filename], f, size)
+        return self.read_response()
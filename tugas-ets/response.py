@@ -0,0 +1,69 @@
+import json
+
+"""
+* Response adalah hasil FileProtocol untuk satu request: dict yang sama
+dengan JSON v1 (status, data_...) ditambah hal-hal yang perlu dilakukan
+server dengan koneksinya, jadi server tidak perlu mem-parse ulang JSON atau
+mencocokkan nama command:
+  body       Body yang dikirim setelah header respons (GET, MGET, ARCHIVE,
+             LIST_STREAM)
+  upload     Upload yang harus diterima dulu, respons sebenarnya baru ada
+             setelah isi file tersimpan (UPLOAD_STREAM)
+  keep_alive False kalau koneksi tidak bisa dipakai lagi (UPLOAD_STREAM v1
+             yang ditolak: isi filenya tidak dibaca)
+  protocol   versi protokol koneksi setelah respons ini (HELLO)
+
+* Body berisi part-part yang dikirim berurutan: buffer (bytes/memoryview)
+atau FileRange (potongan file yang dikirim dari cache, chunk store atau
+sendfile). parts boleh berupa generator, jadi ARCHIVE dan LIST_STREAM
+dibuat sambil dikirim. length adalah total byte, None kalau belum diketahui
+"""
+
+
+class FileRange:
+    __slots__ = ('path', 'offset', 'length')
+
+    def __init__(self, path, offset, length):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+
+class Body:
+    __slots__ = ('parts', 'length', 'description', 'blocking')
+
+    def __init__(self, parts, length=None, description='body', blocking=False):
+        self.parts = parts
+        self.length = length
+        self.description = description # for logging, e.g. the file name
+        self.blocking = blocking # producing the next part touches the disk/index, asyncio_server does it in the executor
+
+
+class Upload:
+    __slots__ = ('filename', 'size')
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+
+
+class Response:
+    __slots__ = ('data', 'body', 'upload', 'keep_alive', 'protocol')
+
+    def __init__(self, data, body=None, upload=None, keep_alive=True, protocol=None):
+        self.data = data
+        self.body = body
+        self.upload = upload
+        self.keep_alive = keep_alive
+        self.protocol = protocol
+
+    @property
+    def status(self):
+        return self.data.get('status')
+
+    def json_header(self):
+        """The v1 response: the data as JSON plus the terminator, serialized once"""
+        return json.dumps(self.data).encode() + b"\r\n\r\n"
+
+    def __repr__(self):
+        return f"Response({self.data!r}, body={self.body.description if self.body else None})"
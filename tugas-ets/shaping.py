@@ -0,0 +1,213 @@
+import re
+import time
+import zlib
+import multiprocessing
+
+SHAPE_CHUNK = 256 * 1024 # bytes sent or received between two bucket checks while a limit is set
+BURST_SECONDS = 0.25 # a full bucket holds this many seconds of its rate (at least one SHAPE_CHUNK)
+CLIENT_SLOTS = 4096 # per-client buckets in shared memory, client IPs are hashed onto them
+TOP_CLIENTS = 10 # most throttled clients listed in STATS
+MIN_RATE = 64 * 1024 # lowest limit accepted, below it one SHAPE_CHUNK would hold a thread for seconds
+
+"""
+* satu client yang melakukan banyak GET paralel bisa menghabiskan bandwidth
+NIC dan disk server, client lain ikut lambat. Shaper membatasi kecepatan
+body response (GET, MGET, ARCHIVE, LIST_STREAM) dan UPLOAD_STREAM dengan
+token bucket: satu bucket global dan satu bucket per IP client
+
+* setiap SHAPE_CHUNK byte yang dikirim/diterima mengambil token dari kedua
+bucket. Kalau token kurang, thread menunggu (time.sleep, atau asyncio.sleep
+di asyncio_server) sampai bucket terisi lagi sesuai rate-nya. Token boleh
+minus, jadi beberapa koneksi dari IP yang sama bersama-sama tetap mendapat
+rate per client, bukan rate per koneksi
+
+* limit dan bucket ada di shared memory (seperti counter admission.py), jadi
+limit global dan per client berlaku untuk semua worker process sekaligus.
+IP di-hash ke CLIENT_SLOTS bucket, dua IP yang kebetulan sama slot-nya
+berbagi satu bucket
+
+* limit bisa diubah saat server berjalan dengan command
+
+  SHAPE <global> <per_client>
+
+  dalam byte/detik, boleh dengan akhiran K/M/G (1024), 0 = tanpa limit,
+  selain 0 minimal MIN_RATE. Mengubah limit hanya boleh dari loopback
+  (localhost), lihat file_protocol.py: client lain bisa memperlambat semua
+  transfer server. SHAPE tanpa parameter hanya menampilkan limit dan
+  statistiknya, boleh dari mana saja. Limit baru
+  langsung berlaku untuk chunk berikutnya dari transfer yang sudah dibatasi,
+  range file yang sudah dikirim utuh tanpa limit (sendfile) tidak ikut
+
+* waktu menunggu karena limit (throttle wait) dilaporkan di STATS
+("shaping"): total karena limit global, total per client, dan client yang
+paling lama ditahan. Kalau angkanya naik, shaping yang membatasi throughput
+"""
+
+# slots in the shared limits array
+GLOBAL_RATE, CLIENT_RATE = range(2)
+# fields of one bucket in the shared state array, bucket 0 is the global one
+_TOKENS, _LAST, _WAIT, _THROTTLED = range(4)
+_FIELDS = 4
+
+_RATE = re.compile(r'(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?')
+_RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_rate(text):
+    """
+    Bytes per second of '100M', '512k', '1.5G' or plain '65536', '' = 0 (no limit).
+    Raises ValueError, also for a limit below MIN_RATE.
+    """
+    text = str(text).strip().lower()
+    if not text:
+        return 0
+    match = _RATE.fullmatch(text)
+    if match is None:
+        raise ValueError(f"invalid rate {text!r}")
+    rate = int(float(match.group(1)) * _RATE_UNITS[match.group(2)])
+    if 0 < rate < MIN_RATE:
+        raise ValueError(f"rate {text!r} is below the minimum of {MIN_RATE // 1024}K/s")
+    return rate
+
+
+def _take(state, bucket, rate, nbytes, now):
+    """Refill one bucket up to now and take nbytes from it, returns the seconds until it is out of debt"""
+    i = bucket * _FIELDS
+    burst = max(SHAPE_CHUNK, rate * BURST_SECONDS)
+    if state[i + _LAST] == 0:
+        tokens = burst # first use
+    else:
+        tokens = min(burst, state[i + _TOKENS] + (now - state[i + _LAST]) * rate)
+    tokens -= nbytes
+    state[i + _TOKENS] = tokens
+    state[i + _LAST] = now
+    return -tokens / rate if tokens < 0 else 0.0
+
+
+class Shaper:
+    """Global and per-client token buckets, shared with the worker processes forked after it is made"""
+    def __init__(self, global_rate=0, client_rate=0):
+        self.limits = multiprocessing.Array('d', 2)
+        self.state = multiprocessing.Array('d', (1 + CLIENT_SLOTS) * _FIELDS)
+        self.clients = {} # bucket -> client IP, as far as this process has seen them
+        self.set_limits(global_rate, client_rate)
+
+    def set_limits(self, global_rate=None, client_rate=None):
+        """Change the limits (bytes per second, 0 = none) in every process, None keeps a limit as it is"""
+        with self.limits.get_lock():
+            if global_rate is not None:
+                self.limits[GLOBAL_RATE] = global_rate
+            if client_rate is not None:
+                self.limits[CLIENT_RATE] = client_rate
+
+    def active(self):
+        """True when a global or a per-client limit is set"""
+        global_rate, client_rate = self.limits[:]
+        return bool(global_rate or client_rate)
+
+    def bucket_for(self, address):
+        ip = address[0] if isinstance(address, tuple) else str(address)
+        bucket = 1 + zlib.crc32(ip.encode()) % CLIENT_SLOTS # hash() differs per process
+        self.clients[bucket] = ip
+        return bucket
+
+    def reserve(self, address, nbytes):
+        """Take nbytes from the global bucket and the client's, returns the seconds to wait before going on"""
+        global_rate, client_rate = self.limits[:]
+        if not (global_rate or client_rate) or nbytes <= 0:
+            return 0.0
+        bucket = self.bucket_for(address)
+        now = time.monotonic() # system wide, so the same clock in every process
+        with self.state.get_lock():
+            state = self.state.get_obj()
+            global_wait = _take(state, 0, global_rate, nbytes, now) if global_rate else 0.0
+            client_wait = _take(state, bucket, client_rate, nbytes, now) if client_rate else 0.0
+            wait = max(global_wait, client_wait)
+            if global_wait > 0:
+                state[_WAIT] += global_wait
+                state[_THROTTLED] += 1
+            if wait > 0:
+                state[bucket * _FIELDS + _WAIT] += wait
+                state[bucket * _FIELDS + _THROTTLED] += 1
+        return wait
+
+    def throttle(self, address, nbytes):
+        """reserve() and sleep for as long as it says, returns the seconds slept"""
+        wait = self.reserve(address, nbytes)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def snapshot(self):
+        global_rate, client_rate = self.limits[:]
+        with self.state.get_lock():
+            state = self.state.get_obj()[:]
+        waits = state[_FIELDS + _WAIT::_FIELDS]
+        throttled = state[_FIELDS + _THROTTLED::_FIELDS]
+        top = sorted(((state[bucket * _FIELDS + _WAIT], ip, bucket) for bucket, ip in list(self.clients.items())), reverse=True)
+        clients = {ip: dict(wait_s=round(wait, 3), throttled=int(state[bucket * _FIELDS + _THROTTLED]))
+                   for wait, ip, bucket in top[:TOP_CLIENTS] if wait > 0}
+        return dict(global_limit=int(global_rate), client_limit=int(client_rate),
+                    global_wait_s=round(state[_WAIT], 3), global_throttled=int(state[_THROTTLED]),
+                    client_wait_s=round(sum(waits), 3), client_throttled=int(sum(throttled)),
+                    clients=clients)
+
+
+class ShapedConnection:
+    """
+    Socket-like wrapper (sendall, sendmsg, sendfile, recv_into) pacing one
+    client's transfer with a Shaper. Without limits every call goes straight
+    through, in one piece.
+    """
+    def __init__(self, connection, shaper, address):
+        self.connection = connection
+        self.shaper = shaper
+        self.address = address
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def sendall(self, data):
+        if not self.shaper.active():
+            return self.connection.sendall(data)
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), SHAPE_CHUNK):
+            piece = view[start:start + SHAPE_CHUNK]
+            self.shaper.throttle(self.address, len(piece))
+            self.connection.sendall(piece)
+
+    def sendmsg(self, buffers):
+        if not self.shaper.active():
+            return self.connection.sendmsg(buffers)
+        # at most SHAPE_CHUNK bytes per call, the caller sends the rest next time
+        views = []
+        size = 0
+        for buffer in buffers:
+            view = memoryview(buffer).cast('B')[:SHAPE_CHUNK - size]
+            views.append(view)
+            size += len(view)
+            if size >= SHAPE_CHUNK:
+                break
+        self.shaper.throttle(self.address, size)
+        return self.connection.sendmsg(views)
+
+    def sendfile(self, f, offset=0, count=None):
+        if not self.shaper.active() or count is None:
+            return self.connection.sendfile(f, offset, count)
+        sent_bytes = 0
+        while sent_bytes < count:
+            n = min(SHAPE_CHUNK, count - sent_bytes)
+            self.shaper.throttle(self.address, n)
+            sent = self.connection.sendfile(f, offset + sent_bytes, n)
+            sent_bytes += sent
+            if sent < n:
+                break
+        return sent_bytes
+
+    def recv_into(self, view, nbytes=0):
+        nbytes = nbytes or len(view)
+        if self.shaper.active():
+            nbytes = min(nbytes, SHAPE_CHUNK)
+        n = self.connection.recv_into(view, nbytes)
+        self.shaper.throttle(self.address, n)
+        return n
@@ -0,0 +1,288 @@
+import os
+import stat
+import time
+import zlib
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+"""
+* SharedFileCache adalah versi FileCache yang dipakai bersama oleh semua worker
+process (processpool_server). Isi file disimpan satu kali di satu segment
+multiprocessing.shared_memory, bukan sekali per process
+
+* index nama -> (offset, length, mtime, pins, ...) juga ada di shared memory:
+tabel slot berukuran tetap (multiprocessing.Array) dengan open addressing
+per hash nama file, nama file-nya di Array kedua. Counter dan posisi alokasi
+di Array ketiga, semuanya dijaga satu Lock. Lookup/pin/unpin hanya membaca
+dan menulis memory, tanpa round trip IPC ke process Manager
+
+* segment dipakai sebagai ring buffer: file baru ditulis setelah file terakhir,
+entry lama yang tertimpa dibuang (eviction). Urutan eviction adalah urutan
+ring (file yang paling lama di-load duluan), BUKAN LRU: file yang sering
+dibaca tetap tertimpa kalau gilirannya tiba. Entry yang sedang di-stream
+(di-pin) tidak boleh tertimpa, jadi file baru tidak di-cache kalau tempatnya
+masih dipakai. Kalau tabel slot penuh, entry tertua yang tidak di-pin dibuang
+
+* nama file lebih panjang dari KEY_BYTES tidak di-cache
+"""
+
+DEFAULT_SLOTS = 8192 # entries in the shared index
+KEY_BYTES = 256 # longest cached path, utf-8 encoded
+
+# slots in the shared counters array
+HITS, MISSES, EVICTIONS, INVALIDATIONS, HEAD, USED, NEXT_TOKEN = range(7)
+# fields of one slot in the shared index
+_STATE, _HASH, _OFFSET, _LENGTH, _MTIME, _TOKEN, _PINS, _KEYLEN = range(8)
+_FIELDS = 8
+# slot states, RETIRED = invalidated while pinned, freed at the last unpin
+EMPTY, DELETED, LOADING, READY, RETIRED = range(5)
+
+
+class SharedFileCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entry_size=16 * 1024 * 1024, revalidate_interval=1.0, slots=DEFAULT_SLOTS):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.revalidate_interval = revalidate_interval
+        self.slots = slots
+        self.segment = shared_memory.SharedMemory(create=True, size=max_bytes)
+        self.index = multiprocessing.Array('q', slots * _FIELDS, lock=False)
+        self.keys = multiprocessing.Array('c', slots * KEY_BYTES, lock=False)
+        self.counters = multiprocessing.Array('q', 7, lock=False)
+        self.lock = multiprocessing.Lock()
+        self._init_local()
+
+    def _init_local(self):
+        # per-process state, never pickled
+        self.checked_at = {}  # path -> monotonic time of the last stat in this process
+        self.pinned = {}      # id(memoryview) -> (slot, token)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('checked_at', 'pinned'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def close(self, unlink=False):
+        self.segment.close()
+        if unlink:
+            self.segment.unlink()
+
+    def _get(self, slot, field):
+        return self.index[slot * _FIELDS + field]
+
+    def _set(self, slot, field, value):
+        self.index[slot * _FIELDS + field] = value
+
+    def _view(self, slot):
+        offset = self._get(slot, _OFFSET)
+        return self.segment.buf[offset:offset + self._get(slot, _LENGTH)]
+
+    def _find(self, key, key_hash):
+        # Caller holds the lock. Slot of the loading or ready entry of key, or None.
+        for n in range(self.slots):
+            slot = (key_hash + n) % self.slots
+            state = self._get(slot, _STATE)
+            if state == EMPTY:
+                return None
+            if state in (LOADING, READY) and self._get(slot, _HASH) == key_hash and self._key(slot) == key:
+                return slot
+        return None
+
+    def _key(self, slot):
+        start = slot * KEY_BYTES
+        return self.keys[start:start + self._get(slot, _KEYLEN)]
+
+    def _free_slot(self, key_hash):
+        # Caller holds the lock. First reusable slot on the probe path of key_hash, the oldest unpinned entry when full.
+        for n in range(self.slots):
+            slot = (key_hash + n) % self.slots
+            if self._get(slot, _STATE) in (EMPTY, DELETED):
+                return slot
+        states = self.index[_STATE::_FIELDS]
+        pins = self.index[_PINS::_FIELDS]
+        tokens = self.index[_TOKEN::_FIELDS]
+        candidates = [slot for slot in range(self.slots) if states[slot] == READY and pins[slot] == 0]
+        if not candidates:
+            return None
+        slot = min(candidates, key=tokens.__getitem__) # loaded first, like the ring
+        self._evict(slot)
+        return slot
+
+    def _release(self, slot):
+        # Caller holds the lock. Turn the slot into a tombstone, or EMPTY when it ends a probe chain.
+        self.counters[USED] -= self._get(slot, _LENGTH)
+        self._set(slot, _STATE, DELETED)
+        if self._get((slot + 1) % self.slots, _STATE) != EMPTY:
+            return
+        while self._get(slot, _STATE) == DELETED:
+            self._set(slot, _STATE, EMPTY)
+            slot = (slot - 1) % self.slots
+
+    def _evict(self, slot):
+        self.counters[EVICTIONS] += 1
+        logging.info(f"SharedFileCache: evicted {self._key(slot).decode(errors='replace')} ({self._get(slot, _LENGTH)} bytes)")
+        self._release(slot)
+
+    def _retire(self, slot):
+        # Caller holds the lock. A pinned entry keeps its region until the last unpin.
+        if self._get(slot, _PINS) > 0:
+            self._set(slot, _STATE, RETIRED)
+        else:
+            self._release(slot)
+
+    def _allocate(self, length):
+        # Caller holds the lock. Returns an offset in the ring, evicting what is in the way.
+        start = self.counters[HEAD]
+        if start + length > self.max_bytes:
+            start = 0
+        end = start + length
+        states = self.index[_STATE::_FIELDS]
+        offsets = self.index[_OFFSET::_FIELDS]
+        lengths = self.index[_LENGTH::_FIELDS]
+        in_the_way = [slot for slot in range(self.slots)
+                      if states[slot] in (LOADING, READY, RETIRED)
+                      and offsets[slot] < end and start < offsets[slot] + lengths[slot]]
+        if any(self._get(slot, _PINS) > 0 for slot in in_the_way):
+            return None
+        for slot in in_the_way:
+            self._evict(slot)
+        self.counters[HEAD] = end
+        return start
+
+    def _is_fresh(self, path, slot):
+        now = time.monotonic()
+        if now - self.checked_at.get(path, 0) < self.revalidate_interval:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size != self._get(slot, _LENGTH) or st.st_mtime_ns != self._get(slot, _MTIME):
+            return False
+        self.checked_at[path] = now
+        return True
+
+    @staticmethod
+    def _key_of(path):
+        key = os.fsencode(path)
+        return key, zlib.crc32(key) # hash() differs per process
+
+    def lookup(self, path):
+        """
+        Return the cached content as a memoryview, or None. Counts as a hit/miss.
+        The view is only guaranteed to stay intact while pinned, see pin().
+        """
+        key, key_hash = self._key_of(path)
+        with self.lock:
+            slot = self._find(key, key_hash)
+            if slot is not None and self._get(slot, _STATE) == READY and not self._is_fresh(path, slot):
+                self._retire(slot)
+                self.counters[INVALIDATIONS] += 1
+                slot = None
+            if slot is None or self._get(slot, _STATE) != READY:
+                self.counters[MISSES] += 1
+                return None
+            self.counters[HITS] += 1
+            return self._view(slot)
+
+    def pin(self, path):
+        """Return the cached content and protect it from eviction until unpin(view)"""
+        key, key_hash = self._key_of(path)
+        with self.lock:
+            slot = self._find(key, key_hash)
+            if slot is None or self._get(slot, _STATE) != READY:
+                return None
+            self._set(slot, _PINS, self._get(slot, _PINS) + 1)
+            token = self._get(slot, _TOKEN)
+            view = self._view(slot)
+        self.pinned[id(view)] = (slot, token)
+        return view
+
+    def unpin(self, view):
+        slot, token = self.pinned.pop(id(view), (None, None))
+        view.release()
+        if slot is None:
+            return
+        with self.lock:
+            self._unpin_locked(slot, token)
+
+    def _unpin_locked(self, slot, token):
+        # A slot keeps its token until it is released, and it can't be released while pinned
+        if self._get(slot, _TOKEN) != token or self._get(slot, _STATE) not in (LOADING, READY, RETIRED):
+            return
+        pins = self._get(slot, _PINS) - 1
+        self._set(slot, _PINS, pins)
+        if pins == 0 and self._get(slot, _STATE) == RETIRED:
+            self._release(slot)
+
+    def load(self, path, st=None):
+        """Copy path into the shared segment if it is small enough. Returns the memoryview or None."""
+        st = st or os.stat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0 or st.st_size > self.max_entry_size or st.st_size > self.max_bytes:
+            return None
+        key, key_hash = self._key_of(path)
+        if len(key) > KEY_BYTES:
+            return None
+
+        with self.lock:
+            existing = self._find(key, key_hash)
+            if existing is not None:
+                if self._get(existing, _STATE) == LOADING or self._get(existing, _MTIME) == st.st_mtime_ns:
+                    return None # another worker is loading it or it is already there
+                self._retire(existing)
+            offset = self._allocate(st.st_size)
+            if offset is None:
+                return None # the space is being streamed from right now
+            # after _allocate, which may free slots on the probe path
+            slot = self._free_slot(key_hash)
+            if slot is None:
+                return None # every entry is pinned
+            token = self.counters[NEXT_TOKEN] = self.counters[NEXT_TOKEN] + 1
+            for field, value in ((_HASH, key_hash), (_OFFSET, offset), (_LENGTH, st.st_size), (_MTIME, st.st_mtime_ns),
+                                 (_TOKEN, token), (_PINS, 1), (_KEYLEN, len(key)), (_STATE, LOADING)):
+                self._set(slot, field, value)
+            self.keys[slot * KEY_BYTES:slot * KEY_BYTES + len(key)] = key
+            self.counters[USED] += st.st_size
+
+        # Read outside the lock, the entry is reserved and invisible until ready
+        view = self.segment.buf[offset:offset + st.st_size]
+        with open(path, 'rb') as f:
+            n = f.readinto(view)
+        view.release()
+
+        with self.lock:
+            if self._get(slot, _STATE) == RETIRED:
+                # Invalidated while loading, drop our reservation
+                self._unpin_locked(slot, token)
+                return None
+            if n != st.st_size:
+                # The file changed under us
+                self._release(slot)
+                return None
+            self._set(slot, _PINS, self._get(slot, _PINS) - 1)
+            self._set(slot, _STATE, READY)
+            view = self._view(slot)
+        self.checked_at[path] = time.monotonic()
+        return view
+
+    def invalidate(self, path):
+        key, key_hash = self._key_of(path)
+        with self.lock:
+            slot = self._find(key, key_hash)
+            if slot is not None:
+                self._retire(slot)
+                self.counters[INVALIDATIONS] += 1
+        self.checked_at.pop(path, None)
+
+    def stats(self):
+        with self.lock:
+            states = self.index[_STATE::_FIELDS]
+            return dict(hits=self.counters[HITS], misses=self.counters[MISSES], evictions=self.counters[EVICTIONS],
+                        invalidations=self.counters[INVALIDATIONS],
+                        entries=sum(state in (LOADING, READY) for state in states), slots=self.slots,
+                        bytes=self.counters[USED], max_bytes=self.max_bytes, segment=self.segment.name)
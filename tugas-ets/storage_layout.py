@@ -0,0 +1,96 @@
+import os
+import hashlib
+
+LAYOUT_MARKER = '.layout' # file in the storage root naming its layout, missing means flat
+
+"""
+* layout menentukan di mana sebuah file disimpan di dalam folder files/. Nama
+file di protokol tetap datar (pokijan.jpg), hanya lokasi di disk yang berbeda
+
+* FlatLayout: semua file langsung di files/ (seperti semula)
+
+* ShardedLayout: file disimpan di files/<2 hex>/<2 hex>/nama, diambil dari md5
+nama file. 65536 subfolder, jadi satu folder tetap kecil walaupun ada jutaan
+file dan lookup/create/remove di ext4 tidak melambat
+
+* layout yang dipakai dicatat di files/.layout oleh migrate-layout.py, semua
+worker process membaca file yang sama jadi selalu sepakat
+"""
+
+
+class FlatLayout:
+    name = 'flat'
+
+    def __init__(self, root):
+        self.root = root
+
+    def dir_for(self, name):
+        return self.root
+
+    def path_for(self, name, create=False):
+        """Path of name on disk, create=True makes sure its directory exists"""
+        return os.path.join(self.dir_for(name), name)
+
+    def directories(self):
+        """Every directory that can hold files"""
+        return [self.root]
+
+    def files(self):
+        """(name, path) of every regular file stored in this layout, hidden files excluded"""
+        for directory in self.directories():
+            with os.scandir(directory) as it:
+                for dirent in it:
+                    if (not dirent.name.startswith('.') and self.dir_for(dirent.name) == directory
+                            and dirent.is_file(follow_symlinks=False)):
+                        yield dirent.name, dirent.path
+
+
+class ShardedLayout(FlatLayout):
+    name = 'sharded'
+
+    def dir_for(self, name):
+        digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def path_for(self, name, create=False):
+        directory = self.dir_for(name)
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def directories(self):
+        # Shard directories are created on first use, so only existing ones are listed
+        result = []
+        with os.scandir(self.root) as top:
+            for first in top:
+                if not (first.is_dir() and len(first.name) == 2):
+                    continue
+                with os.scandir(first.path) as second:
+                    result.extend(os.path.join(self.root, first.name, d.name)
+                                  for d in second if d.is_dir() and len(d.name) == 2)
+        return result
+
+
+LAYOUTS = {layout.name: layout for layout in (FlatLayout, ShardedLayout)}
+
+
+def load_layout(root):
+    try:
+        with open(os.path.join(root, LAYOUT_MARKER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        name = FlatLayout.name
+    if name not in LAYOUTS:
+        raise ValueError(f"unknown storage layout '{name}' in {os.path.join(root, LAYOUT_MARKER)}")
+    return LAYOUTS[name](root)
+
+
+def save_layout(root, name):
+    marker = os.path.join(root, LAYOUT_MARKER)
+    if name == FlatLayout.name:
+        if os.path.exists(marker):
+            os.remove(marker)
+        return
+    with open(marker + '.tmp', 'w') as f:
+        f.write(name + '\n')
+    os.replace(marker + '.tmp', marker)
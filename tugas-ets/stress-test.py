@@ -1,14 +1,20 @@
 import socket
 import json
-import base64
 import logging
 import csv
 import os
+import io
 import time
+import queue
+import threading
 import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from statistics import mean, median
 
+CLIENT_STREAM_BUFFER_SIZE = 65536 # 64KB, can be tuned
+LIST_PAGE_SIZE = 1000 # names per LIST request
+MAX_BUSY_RETRIES = 10 # BUSY answers waited out (retry_after seconds each) before a request counts as failed
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -18,9 +24,43 @@ logging.basicConfig(
     ]
 )
 
+class ServerBusy(Exception):
+    # the server answered BUSY instead of running the command, see admission.py
+    def __init__(self, retry_after):
+        Exception.__init__(self, f"server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class RangeWriter:
+    # file-like write()/tell() that puts a downloaded range at its own offset with pwrite,
+    # so several stripes can write into one file without sharing a file position
+    lock = threading.Lock() # only needed where os.pwrite doesn't exist
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.position = offset
+
+    def write(self, data):
+        if hasattr(os, 'pwrite'):
+            written = 0
+            while written < len(data):
+                written += os.pwrite(self.fd, memoryview(data)[written:], self.position + written)
+        else:
+            with RangeWriter.lock:
+                os.lseek(self.fd, self.position, os.SEEK_SET)
+                written = 0
+                while written < len(data):
+                    written += os.write(self.fd, memoryview(data)[written:])
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
 class Client:
-    def __init__(self, server_address=('localhost', 6666)):
+    def __init__(self, server_address=('localhost', 6666), download_stripes=1, download_chunk_size=8 * 1024 * 1024):
         self.server_address = server_address
+        # GET over more than one stripe uses record_get_parallel (ranged GETs on parallel connections)
+        self.download_stripes = download_stripes
+        self.download_chunk_size = download_chunk_size
         self.results = {
             'upload' : [],
             'get' : [],
@@ -54,16 +94,46 @@ class Client:
         self.server_config['worker_pool_size'] = int(input("Enter Server's worker pool size: ").strip())
 
 
-    def send_command(self, command_str):
+    def set_download_config(self):
+        self.download_stripes = int(input("Enter number of parallel connections per GET (default 1): ").strip() or "1")
+        self.download_chunk_size = int(input("Enter GET chunk size in MB (default 8): ").strip() or "8") * 1024 * 1024
+
+
+    def send_command(self, command_str, body_file=None):
         # base command to be sent to server, not actual interface to send command
+        # body_file (opened 'rb') is streamed as raw bytes right after the command, used by UPLOAD_STREAM.
+        # A BUSY answer is waited out for retry_after seconds and the command sent again
+        for busy in range(MAX_BUSY_RETRIES + 1):
+            if body_file is not None:
+                body_file.seek(0)
+            hasil = self.send_command_once(command_str, body_file)
+            if hasil.get('status') != 'BUSY':
+                break
+            logging.warning(f"Server busy, retrying in {hasil.get('retry_after', 1)}s ({busy + 1}/{MAX_BUSY_RETRIES})")
+            time.sleep(hasil.get('retry_after', 1))
+        return hasil
+
+    def connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(120) # 10 minutes timeout
-        
+        start_connect = time.time()
         try:
-            start_connect = time.time()
             sock.connect(self.server_address)
-            connect_time = time.time() - start_connect
-            logging.debug(f"Connection established in {connect_time:.2f}s")
+        except Exception:
+            sock.close()
+            raise
+        connect_time = time.time() - start_connect
+        logging.debug(f"Connection established in {connect_time:.2f}s")
+        return sock
+
+    def send_command_once(self, command_str, body_file=None, sock=None):
+        # sock: an open keep-alive connection to reuse, left open afterwards. Without it
+        # the command gets a connection of its own.
+        own_sock = sock is None
+
+        try:
+            if own_sock:
+                sock = self.connect()
 
             chunks = [command_str[i:i+65536] for i in range(0, len(command_str), 65536)]
             for chunk in chunks:
@@ -71,6 +141,13 @@ class Client:
 
             sock.sendall('\r\n\r\n'.encode())
 
+            if body_file is not None:
+                try:
+                    sock.sendfile(body_file)
+                except (BrokenPipeError, ConnectionResetError) as e:
+                    # a BUSY server closes before the body is sent, its answer is still readable
+                    logging.debug(f"Body not sent completely: {e}")
+
             data_received = ""
             while True:
                 try:
@@ -103,24 +180,47 @@ class Client:
             logging.error(f"Error during data receiving: {str(e)}")
             return {'status': 'ERROR', 'data': str(e)}
         finally:
-            sock.close()
-            logging.debug("Socket closed")
+            if own_sock and sock is not None:
+                sock.close()
+                logging.debug("Socket closed")
     
 
 
     def record_list(self, worker_id):
         start_time = time.time()
+        sock = None
 
         try:
-            command_str = "LIST"
-            # dont send \r\n\r\n, because send_command will handle technicals
-            result = self.send_command(command_str)
+            # page through the listing instead of receiving every name in one response,
+            # all pages over one keep-alive connection
+            file_count = 0
+            cursor = ''
+            busy = 0
+            while True:
+                if sock is None:
+                    sock = self.connect()
+                command_str = f'LIST "" "{cursor}" {LIST_PAGE_SIZE}'
+                # dont send \r\n\r\n, because send_command_once will handle technicals
+                result = self.send_command_once(command_str, sock=sock)
+                if result['status'] == 'BUSY' and busy < MAX_BUSY_RETRIES:
+                    # the server closes a connection it answered BUSY, wait and reconnect
+                    busy += 1
+                    sock.close()
+                    sock = None
+                    logging.warning(f"Server busy, retrying in {result.get('retry_after', 1)}s ({busy}/{MAX_BUSY_RETRIES})")
+                    time.sleep(result.get('retry_after', 1))
+                    continue
+                if result['status'] != 'OK':
+                    break
+                file_count += len(result['data'])
+                cursor = result.get('next_cursor')
+                if not cursor:
+                    break
 
             end_time = time.time()
             duration = end_time - start_time
 
             if result['status'] == 'OK':
-                file_count = len(result['data'])
                 logging.info(f"Worker {worker_id} - LIST command successful, {file_count} files found")
                 self.success_count['list'] += 1
             else:
@@ -145,15 +245,65 @@ class Client:
                 'status' : 'ERROR',
                 'message' : str(e)
             }
+        finally:
+            if sock is not None:
+                sock.close()
     
 
 
-    def record_get(self, filename, worker_id):
+    def fetch_range(self, sock, filename, f, offset, worker_id, length=None):
+        # Stage 1 + 2 of a (ranged) GET on an already connected socket: send the command,
+        # read the JSON metadata and write the body into f at its current position.
+        # On timeout/disconnect f.tell() tells how far the body got.
+        if offset or length is not None:
+            command_str = f"GET {filename} {offset}" + (f" {length}" if length is not None else "") + "\r\n\r\n"
+        else:
+            command_str = f"GET {filename}\r\n\r\n" # Command with terminator
+        sock.sendall(command_str.encode('utf-8'))
+        logging.debug(f"Worker {worker_id}: Sent command: {command_str.strip()}")
+
+        # Receive metadata response (JSON ending with \r\n\r\n)
+        metadata_buffer = bytearray()
+        while True:
+            part = sock.recv(4096) # Read in chunks for metadata
+            if not part:
+                logging.error(f"Worker {worker_id}: Connection closed by server while waiting for metadata for {filename}.")
+                raise ConnectionAbortedError("Server closed connection (metadata reception)")
+            metadata_buffer.extend(part)
+            if b"\r\n\r\n" in metadata_buffer:
+                # Extract the JSON part before the terminator, anything after it is already file data
+                json_response_bytes, body_start = bytes(metadata_buffer).split(b"\r\n\r\n", 1)
+                break
+
+        json_response_str = json_response_bytes.decode('utf-8')
+        logging.debug(f"Worker {worker_id}: Received metadata string: {json_response_str}")
+        metadata_result = json.loads(json_response_str)
+        if metadata_result.get('status') == 'BUSY':
+            raise ServerBusy(metadata_result.get('retry_after', 1))
+        if metadata_result.get('status') != 'OK_STREAM':
+            return metadata_result
+
+        # data_length is the number of bytes following, older servers only send data_filesize
+        range_length = metadata_result.get('data_length', metadata_result.get('data_filesize'))
+        if not isinstance(range_length, int) or range_length < 0:
+            logging.error(f"Worker {worker_id}: Invalid file size '{range_length}' in metadata for {filename}.")
+            raise ValueError("Invalid file size from server metadata")
+
+        # Stage 2: Receive raw file data stream
+        bytes_received = len(body_start[:range_length])
+        f.write(body_start[:range_length])
+        while bytes_received < range_length:
+            # Calculate how much more to read, up to buffer size
+            chunk = sock.recv(min(CLIENT_STREAM_BUFFER_SIZE, range_length - bytes_received))
+            if not chunk:
+                logging.error(f"Worker {worker_id}: Connection closed by server during file data transfer of {filename}. Downloaded {offset + bytes_received}/{offset + range_length} bytes.")
+                raise ConnectionAbortedError("Server closed connection (file data reception)")
+            f.write(chunk)
+            bytes_received += len(chunk)
+        return metadata_result
+
+    def record_get(self, filename, worker_id, max_retries=3):
         start_time = time.time() # Overall start time
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Set a timeout for socket operations. This needs to be long enough for large file transfers.
-        # Consider making this configurable or dynamically adjusting based on expected file size.
-        sock.settimeout(120)  # Scale timeout with file size, but cap sensibly
 
         # Ensure downloads directory exists
         downloads_dir = os.path.abspath('downloads')
@@ -163,71 +313,54 @@ class Client:
         
         actual_file_size = 0
         throughput = 0
-        CLIENT_STREAM_BUFFER_SIZE = 65536 # 64KB, can be tuned
+        bytes_downloaded = 0
+        attempt = 0
+        busy = 0
+        sock = None
 
         try:
             logging.info(f"Worker {worker_id}: Attempting GET for {filename}")
-
-            # Stage 1: Connect, send command, and receive JSON metadata
-            connect_start_time = time.time()
-            sock.connect(self.server_address)
-            logging.debug(f"Worker {worker_id}: Connected in {time.time() - connect_start_time:.3f}s")
-
-            command_str = f"GET {filename}\r\n\r\n" # Command with terminator
-            sock.sendall(command_str.encode('utf-8'))
-            logging.debug(f"Worker {worker_id}: Sent command: {command_str.strip()}")
-
-            # Receive metadata response (JSON ending with \r\n\r\n)
-            metadata_buffer = bytearray()
-            while True:
-                part = sock.recv(4096) # Read in chunks for metadata
-                if not part:
-                    logging.error(f"Worker {worker_id}: Connection closed by server while waiting for metadata for {filename}.")
-                    raise ConnectionAbortedError("Server closed connection (metadata reception)")
-                metadata_buffer.extend(part)
-                if b"\r\n\r\n" in metadata_buffer:
-                    # Extract the JSON part before the terminator
-                    json_response_str = metadata_buffer.split(b"\r\n\r\n", 1)[0].decode('utf-8')
-                    break
-            
-            logging.debug(f"Worker {worker_id}: Received metadata string: {json_response_str}")
-            metadata_result = json.loads(json_response_str)
+            with open(download_path, 'wb') as f:
+                while True:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    # Set a timeout for socket operations. This needs to be long enough for large file transfers.
+                    sock.settimeout(120)
+                    try:
+                        # Stage 1: Connect, send command, and receive JSON metadata
+                        connect_start_time = time.time()
+                        sock.connect(self.server_address)
+                        logging.debug(f"Worker {worker_id}: Connected in {time.time() - connect_start_time:.3f}s")
+                        metadata_result = self.fetch_range(sock, filename, f, bytes_downloaded, worker_id)
+                        bytes_downloaded = f.tell()
+                        break
+                    except (socket.timeout, ConnectionAbortedError, ConnectionResetError) as e:
+                        # Keep what already arrived and only ask for the missing tail
+                        bytes_downloaded = f.tell()
+                        if attempt >= max_retries:
+                            raise
+                        attempt += 1
+                        logging.warning(f"Worker {worker_id}: GET {filename} interrupted ({e}) after {bytes_downloaded} bytes, resuming (retry {attempt}/{max_retries})")
+                    except ServerBusy as e:
+                        if busy >= MAX_BUSY_RETRIES:
+                            raise
+                        busy += 1
+                        logging.warning(f"Worker {worker_id}: GET {filename}: {e} ({busy}/{MAX_BUSY_RETRIES})")
+                        time.sleep(e.retry_after)
+                    finally:
+                        logging.debug(f"Worker {worker_id}: Closing socket for GET {filename}.")
+                        sock.close()
 
             if metadata_result.get('status') == 'OK_STREAM':
                 actual_file_size = metadata_result.get('data_filesize')
                 server_filename = metadata_result.get('data_namafile') # For logging/verification
 
-                if not isinstance(actual_file_size, int) or actual_file_size < 0:
-                    logging.error(f"Worker {worker_id}: Invalid file size '{actual_file_size}' in metadata for {filename}.")
-                    raise ValueError("Invalid file size from server metadata")
-
-                logging.info(f"Worker {worker_id}: Metadata OK for {server_filename}. Expecting {actual_file_size} bytes. Saving to {download_path}")
-
-                # Stage 2: Receive raw file data stream
-                bytes_downloaded = 0
-                file_receive_start_time = time.time()
-                with open(download_path, 'wb') as f:
-                    while bytes_downloaded < actual_file_size:
-                        # Calculate how much more to read, up to buffer size
-                        bytes_to_read = min(CLIENT_STREAM_BUFFER_SIZE, actual_file_size - bytes_downloaded)
-                        if bytes_to_read == 0: # Should not happen if actual_file_size > 0
-                            break 
-                        chunk = sock.recv(bytes_to_read)
-                        if not chunk:
-                            logging.error(f"Worker {worker_id}: Connection closed by server during file data transfer of {server_filename}. Downloaded {bytes_downloaded}/{actual_file_size} bytes.")
-                            raise ConnectionAbortedError("Server closed connection (file data reception)")
-                        f.write(chunk)
-                        bytes_downloaded += len(chunk)
-                
-                file_receive_duration = time.time() - file_receive_start_time
-                
                 if bytes_downloaded != actual_file_size:
                     logging.error(f"Worker {worker_id}: File download incomplete for {server_filename}. Expected {actual_file_size}, got {bytes_downloaded}.")
                     status = 'ERROR'
                     message = 'Incomplete file transfer'
                     self.fail_count['get'] += 1
                 else:
-                    logging.info(f"Worker {worker_id}: Successfully downloaded {bytes_downloaded} bytes for {server_filename} in {file_receive_duration:.2f}s (data transfer phase).")
+                    logging.info(f"Worker {worker_id}: Successfully downloaded {bytes_downloaded} bytes for {server_filename} to {download_path} ({attempt} resumes).")
                     status = 'OK'
                     message = f"File {server_filename} streamed successfully"
                     self.success_count['get'] += 1
@@ -242,7 +375,8 @@ class Client:
                 return {
                     'worker_id': worker_id, 'operation': 'GET', 'filename': server_filename, 
                     'filesize': actual_file_size, 'duration': duration, 
-                    'throughput': throughput, 'status': status, 'message': message
+                    'throughput': throughput, 'status': status, 'message': message,
+                    'retries': attempt
                 }
 
             else: # Metadata status was not OK_STREAM (e.g., ERROR from server)
@@ -275,12 +409,141 @@ class Client:
             logging.error(f"Worker {worker_id}: General error during GET for {filename}: {e}")
             self.fail_count['get'] += 1
             return {'worker_id': worker_id, 'operation': 'GET', 'filename': filename, 'filesize': actual_file_size, 'duration': duration, 'throughput': throughput, 'status': 'ERROR', 'message': str(e)}
-        finally:
-            logging.debug(f"Worker {worker_id}: Closing socket for GET {filename}.")
-            sock.close()
         
 
 
+    def record_get_parallel(self, filename, worker_id, stripes=None, chunk_size=None, max_retries=3):
+        # Download one file over several connections at once: the file is cut into
+        # chunk_size ranges, `stripes` connections pull ranges from a shared queue and
+        # write them with pwrite into a preallocated file
+        stripes = stripes or self.download_stripes
+        chunk_size = chunk_size or self.download_chunk_size
+        start_time = time.time()
+
+        downloads_dir = os.path.abspath('downloads')
+        if not os.path.exists(downloads_dir):
+            os.makedirs(downloads_dir)
+        download_path = os.path.join(downloads_dir, f"worker_{worker_id}_{os.path.basename(filename)}")
+        actual_file_size = 0
+
+        try:
+            logging.info(f"Worker {worker_id}: Attempting parallel GET for {filename} ({stripes} stripes, {chunk_size} byte chunks)")
+
+            # Zero-length range just to learn the file size
+            for busy in range(MAX_BUSY_RETRIES + 1):
+                try:
+                    with socket.create_connection(self.server_address, timeout=120) as sock:
+                        metadata_result = self.fetch_range(sock, filename, io.BytesIO(), 0, worker_id, length=0)
+                    break
+                except ServerBusy as e:
+                    if busy >= MAX_BUSY_RETRIES:
+                        raise
+                    logging.warning(f"Worker {worker_id}: GET {filename}: {e} ({busy + 1}/{MAX_BUSY_RETRIES})")
+                    time.sleep(e.retry_after)
+            if metadata_result.get('status') != 'OK_STREAM':
+                error_message = metadata_result.get('data', 'Unknown error from server (metadata stage)')
+                logging.error(f"Worker {worker_id}: parallel GET failed for {filename}. Server response: {metadata_result.get('status')} - {error_message}")
+                self.fail_count['get'] += 1
+                return {
+                    'worker_id': worker_id, 'operation': 'GET', 'filename': filename,
+                    'filesize': 0, 'duration': time.time() - start_time,
+                    'throughput': 0, 'status': 'ERROR', 'message': error_message
+                }
+            actual_file_size = metadata_result.get('data_filesize')
+
+            ranges = queue.Queue()
+            for offset in range(0, actual_file_size, chunk_size):
+                ranges.put((offset, min(chunk_size, actual_file_size - offset), 0))
+
+            fd = os.open(download_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                # Preallocate so the stripes can write anywhere without extending the file
+                if hasattr(os, 'posix_fallocate') and actual_file_size > 0:
+                    os.posix_fallocate(fd, 0, actual_file_size)
+                else:
+                    os.ftruncate(fd, actual_file_size)
+
+                errors = []
+                def stripe(stripe_id):
+                    sock = None
+                    busy = 0
+                    while not errors:
+                        try:
+                            offset, length, attempt = ranges.get_nowait()
+                        except queue.Empty:
+                            break
+                        writer = RangeWriter(fd, offset)
+                        try:
+                            if sock is None:
+                                # The server keeps the connection open, one connect per stripe
+                                sock = socket.create_connection(self.server_address, timeout=120)
+                            result = self.fetch_range(sock, filename, writer, offset, worker_id, length=length)
+                            # An ERROR or a different range means the file was deleted, replaced or
+                            # truncated meanwhile: the preallocated zeros would pass for content
+                            if result.get('status') != 'OK_STREAM':
+                                errors.append(f"range {offset}+{length}: {result.get('status')} - {result.get('data')}")
+                                break
+                            if (result.get('data_offset'), result.get('data_length'), result.get('data_filesize')) != (offset, length, actual_file_size):
+                                errors.append(f"range {offset}+{length}: server sent {result.get('data_offset')}+{result.get('data_length')} of {result.get('data_filesize')} bytes, the file changed")
+                                break
+                            if writer.tell() - offset != length:
+                                errors.append(f"range {offset}+{length}: only {writer.tell() - offset} bytes arrived")
+                                break
+                        except ServerBusy as e:
+                            # the connection was refused before the range started, try it again later
+                            sock.close()
+                            sock = None
+                            if busy >= MAX_BUSY_RETRIES:
+                                errors.append(f"range {offset}+{length}: {e}")
+                                break
+                            busy += 1
+                            ranges.put((offset, length, attempt))
+                            time.sleep(e.retry_after)
+                        except (socket.timeout, ConnectionError, OSError) as e:
+                            if sock is not None:
+                                sock.close()
+                                sock = None
+                            done = writer.tell() - offset
+                            if attempt >= max_retries:
+                                errors.append(f"range {offset}+{length}: {e}")
+                                break
+                            logging.warning(f"Worker {worker_id}: stripe {stripe_id} lost range {offset}+{length} after {done} bytes ({e}), requeueing the rest")
+                            ranges.put((offset + done, length - done, attempt + 1))
+                    if sock is not None:
+                        sock.close()
+
+                with ThreadPoolExecutor(max_workers=stripes) as stripe_executor:
+                    list(stripe_executor.map(stripe, range(stripes)))
+            finally:
+                os.close(fd)
+
+            duration = time.time() - start_time
+            throughput = actual_file_size / duration if duration > 0 and actual_file_size > 0 else 0
+            if errors:
+                logging.error(f"Worker {worker_id}: parallel GET of {filename} failed: {errors[0]}")
+                self.fail_count['get'] += 1
+                return {
+                    'worker_id': worker_id, 'operation': 'GET', 'filename': filename,
+                    'filesize': actual_file_size, 'duration': duration,
+                    'throughput': 0, 'status': 'ERROR', 'message': errors[0]
+                }
+
+            logging.info(f"Worker {worker_id}: Successfully downloaded {actual_file_size} bytes for {filename} over {stripes} stripes in {duration:.2f}s - aggregate {throughput/1024/1024:.2f} MB/s")
+            self.success_count['get'] += 1
+            return {
+                'worker_id': worker_id, 'operation': 'GET', 'filename': filename,
+                'filesize': actual_file_size, 'duration': duration,
+                'throughput': throughput, 'status': 'OK', 'stripes': stripes,
+                'message': f"File {filename} streamed successfully over {stripes} stripes"
+            }
+        except Exception as e:
+            duration = time.time() - start_time
+            logging.error(f"Worker {worker_id}: General error during parallel GET for {filename}: {e}")
+            self.fail_count['get'] += 1
+            return {'worker_id': worker_id, 'operation': 'GET', 'filename': filename, 'filesize': actual_file_size, 'duration': duration, 'throughput': 0, 'status': 'ERROR', 'message': str(e)}
+
+
+
     def record_upload(self, file_path, worker_id):
         start_time = time.time()
         filename = os.path.basename(file_path)
@@ -290,13 +553,11 @@ class Client:
         try:
             logging.info(f"Worker {worker_id} - upload command for {filename} ({file_size/1024/1024:.2f} MB)")
 
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-                encoded_file_content = base64.b64encode(file_content).decode()
-            
-            command_str = f"UPLOAD {filename} {encoded_file_content}"
+            # raw bytes follow the command, no base64 and no need to hold the file in memory
+            command_str = f"UPLOAD_STREAM {filename} {file_size}"
 
-            result = self.send_command(command_str)
+            with open(file_path, 'rb') as f:
+                result = self.send_command(command_str, body_file=f)
 
             end_time = time.time()
             duration = end_time - start_time
@@ -394,7 +655,10 @@ class Client:
                 if operation == 'upload':
                     future = executor.submit(self.record_upload, f"test_file_{file_size_mb}mb.bin", i)
                 elif operation == 'get':
-                    future = executor.submit(self.record_get, f"test_file_{file_size_mb}mb.bin", i)
+                    if self.download_stripes > 1:
+                        future = executor.submit(self.record_get_parallel, f"test_file_{file_size_mb}mb.bin", i)
+                    else:
+                        future = executor.submit(self.record_get, f"test_file_{file_size_mb}mb.bin", i)
                 elif operation == 'list':
                     future = executor.submit(self.record_list, i)
                 else:
@@ -575,6 +839,7 @@ if __name__ == "__main__":
     client = Client(server_address=('localhost', 6666))
     # res = client.run_test('upload', 10, 10, executor_type='thread')
     client.set_server_config()
+    client.set_download_config()
     res = client.automate_stress_test()
     # res = json.dumps(res, indent=4)
     # print(res)
\ No newline at end of file
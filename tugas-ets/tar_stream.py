@@ -0,0 +1,63 @@
+import tarfile
+
+from response import FileRange
+
+BLOCK_SIZE = tarfile.BLOCKSIZE # 512, headers and member bodies are padded to this
+RECORD_SIZE = tarfile.RECORDSIZE # 10240, the whole archive is padded to this like tarfile does
+
+"""
+* ARCHIVE mengirim file-file dalam format tar tanpa membuat file tar di disk:
+header setiap member dibuat dari metadata di FileIndex (nama, size, mtime),
+isi file dikirim langsung dari cache/chunk store/disk (sendfile), lalu
+di-padding ke kelipatan 512 byte
+
+* karena header hanya bergantung pada (nama, size, mtime), ukuran archive
+bisa dihitung sebelum satu byte pun dikirim, jadi client tahu persis berapa
+byte yang harus dibaca (data_length) dan koneksi bisa dipakai lagi
+
+* formatnya PAX (POSIX.1-2001), nama panjang atau non-ASCII tetap utuh dan
+bisa dibaca tar/bsdtar/tarfile biasa
+"""
+
+
+def member_header(name, size, mtime):
+    """Tar header block(s) of a regular file, ready to be followed by its content"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    info.type = tarfile.REGTYPE
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def padding(size):
+    """Zero bytes that follow a member body of size bytes"""
+    return bytes(-size % BLOCK_SIZE)
+
+
+def end_of_archive(archive_size):
+    """Two zero blocks, then zeros up to a whole record. archive_size is what came before."""
+    return bytes(2 * BLOCK_SIZE + (-(archive_size + 2 * BLOCK_SIZE) % RECORD_SIZE))
+
+
+def archive_parts(members, path_for):
+    """
+    Body parts (response.Body) of the tar of members, a list of (name, size, mtime):
+    header bytes, the content as a FileRange of path_for(name), padding, and the trailer
+    """
+    total = 0
+    for name, size, mtime in members:
+        header = member_header(name, size, mtime)
+        yield header
+        yield FileRange(path_for(name), 0, size)
+        yield padding(size)
+        total += len(header) + size + len(padding(size))
+    yield end_of_archive(total)
+
+
+def archive_size(members):
+    """Exact size of the tar of members, a list of (name, size, mtime)"""
+    total = 0
+    for name, size, mtime in members:
+        total += len(member_header(name, size, mtime)) + size + len(padding(size))
+    return total + len(end_of_archive(total))
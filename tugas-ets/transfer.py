@@ -0,0 +1,106 @@
+import os
+import io
+import stat
+import logging
+
+STREAM_BUFFER_SIZE = 65536 # 64KB, used by the read/send fallback
+MAX_SEND_BUFFERS = 512 # buffers per sendmsg call, below the usual IOV_MAX of 1024
+
+
+def can_sendfile(f):
+    """Check whether f can be handed to the kernel for a zero-copy send"""
+    if not hasattr(os, 'sendfile'):
+        return False
+    try:
+        fileno = f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(fileno).st_mode)
+    except OSError:
+        return False
+
+
+def send_file(connection, f, offset, count, buffer_size=STREAM_BUFFER_SIZE):
+    """
+    Send count bytes of f starting at offset to connection.
+
+    Uses socket.sendfile (os.sendfile underneath) so the data never passes through
+    Python, and falls back to a read/sendall loop when the platform or file object
+    can't do that. Returns the number of bytes sent, which is less than count if
+    the file ended early. Socket errors are raised to the caller; in that case the
+    file position is left right after the last byte that was sent, so
+    f.tell() - offset still tells how far the transfer got.
+    """
+    if count <= 0:
+        return 0
+
+    if can_sendfile(f):
+        # socket.sendfile keeps track of short writes and EAGAIN itself and always
+        # seeks f to offset + bytes sent, also when the client disconnects
+        return connection.sendfile(f, offset, count)
+
+    logging.info(f"Server: sendfile not available for {getattr(f, 'name', f)}, using read/send loop")
+    f.seek(offset)
+    sent_bytes = 0
+    while sent_bytes < count:
+        chunk = f.read(min(buffer_size, count - sent_bytes))
+        if not chunk:
+            break
+        try:
+            connection.sendall(chunk)
+        except Exception:
+            # sendall gives no partial count, so only count the chunks that made it
+            f.seek(offset + sent_bytes)
+            raise
+        sent_bytes += len(chunk)
+    return sent_bytes
+
+
+def send_buffers(connection, buffers):
+    """
+    Send every buffer in buffers, in order, as one stream. Uses sendmsg so many
+    small buffers (cached files) go out in a few gather-write syscalls instead of
+    one sendall each, without joining them into a new bytes object first. Returns
+    the number of bytes sent; socket errors are raised to the caller.
+    """
+    views = [memoryview(b) for b in buffers if len(b)]
+    if not hasattr(connection, 'sendmsg'):
+        for view in views:
+            connection.sendall(view)
+        return sum(len(view) for view in views)
+
+    sent_bytes = 0
+    i = 0
+    while i < len(views):
+        n = connection.sendmsg(views[i:i + MAX_SEND_BUFFERS])
+        sent_bytes += n
+        # skip what was sent completely, the rest of a partly sent buffer goes next
+        while i < len(views) and n >= len(views[i]):
+            n -= len(views[i])
+            i += 1
+        if n:
+            views[i] = views[i][n:]
+    return sent_bytes
+
+
+def recv_to_file(connection, f, count, buffer_size=STREAM_BUFFER_SIZE):
+    """
+    Write count bytes coming from connection into f. connection only needs
+    recv_into, so a framing.RequestReader holding bytes that arrived together with
+    the command works as well.
+
+    Only one buffer_size buffer is used no matter how big the file is. Returns the
+    number of bytes written, which is less than count if the client closed the
+    connection early.
+    """
+    received_bytes = 0
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while received_bytes < count:
+        n = connection.recv_into(view, min(buffer_size, count - received_bytes))
+        if n == 0:
+            break
+        f.write(view[:n])
+        received_bytes += n
+    return received_bytes